@@ -0,0 +1,57 @@
+"""
+Performance benchmarks for mozpay.
+
+Run one from the root of the source checkout, for example::
+
+    python -m benchmarks.prefilter
+"""
+import calendar
+import time
+import timeit
+
+import jwt
+
+KEY = 'FIREFOX_MARKETPLACE_KEY'
+SECRET = 'FIREFOX_MARKETPLACE_SECRET'
+
+
+def payload(typ='mozilla/postback/pay/v1', transaction_id='1234',
+            product_data='my_product_id=1234', extra_res=None):
+    """A notice payload shaped like the ones the Marketplace sends."""
+    iat = calendar.timegm(time.gmtime())
+    res = {'transactionID': transaction_id}
+    if extra_res:
+        res.update(extra_res)
+    return {
+        'iss': 'marketplace.mozilla.org',
+        'aud': KEY,
+        'typ': typ,
+        'exp': iat + 3600,
+        'iat': iat,
+        'request': {'pricePoint': 1,
+                    'name': 'My bands latest album',
+                    'description': '320kbps MP3 download, DRM free!',
+                    'productData': product_data},
+        'response': res,
+    }
+
+
+def token(secret=SECRET, algorithm='HS256', **payload_kw):
+    return jwt.encode(payload(**payload_kw), secret, algorithm=algorithm)
+
+
+def per_call(func, min_time=0.2):
+    """Returns the best seconds per call of *func* over a few runs."""
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time / 10:
+        number *= 10
+    return min(timer.repeat(3, number)) / number
+
+
+def report(rows, unit='us'):
+    """Prints (name, seconds) rows."""
+    scale = {'us': 1e6, 'ms': 1e3}[unit]
+    width = max(len(name) for name, seconds in rows)
+    for name, seconds in rows:
+        print '%-*s %10.2f %s' % (width, name, seconds * scale, unit)
@@ -0,0 +1,143 @@
+"""
+Load test of the Django views under a flood of invalid notices.
+
+A threaded HTTP server runs the Django app in a child process. A few
+flood processes post large notices with bad signatures, claiming to be
+from the Marketplace, as fast as they can from their own loopback
+addresses while a client posts valid notices at a steady rate. The
+latency of the valid notices is reported without a flood, with a flood
+and no admission control, and with a flood and the ``MOZ_ADMISSION_*``
+settings below.
+"""
+import httplib
+import logging
+import multiprocessing
+import subprocess
+import sys
+import time
+import urllib
+
+from . import KEY, SECRET, token
+
+ADMISSION = {'MOZ_ADMISSION_SOURCE_RATE': 100,
+             'MOZ_ADMISSION_MAX_CONCURRENT': 8}
+FLOODERS = 4
+GOOD = 300
+GOOD_RATE = 50
+
+
+def serve(admission):
+    from SocketServer import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+    logging.getLogger('mozpay').addHandler(logging.NullHandler())
+    from django.conf import settings
+    settings.configure(MOZ_APP_KEY=KEY, MOZ_APP_SECRET=SECRET,
+                       ROOT_URLCONF='mozpay.djangoapp.urls',
+                       INSTALLED_APPS=['mozpay.djangoapp'],
+                       **(ADMISSION if admission == 'on' else {}))
+    from django.core.handlers.wsgi import WSGIHandler
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    class Handler(WSGIRequestHandler):
+        def address_string(self):
+            return self.client_address[0]  # No reverse DNS lookups.
+
+        def log_message(self, *args):
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.set_app(WSGIHandler())
+    print server.server_port
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+def post(port, body, source='127.0.0.1'):
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout=30,
+                                  source_address=(source, 0))
+    try:
+        conn.request('POST', '/postback', body,
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def flood(port, source, stop, counts):
+    body = urllib.urlencode({'notice': token(secret='wrong secret',
+                                             product_data='x' * 8192)})
+    seen = {}
+    while not stop.is_set():
+        try:
+            status = post(port, body, source)
+        except Exception:
+            status = 'error'
+        seen[status] = seen.get(status, 0) + 1
+    counts.put(seen)
+
+
+def run(admission, flooders):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.admission', 'serve', admission],
+        stdout=subprocess.PIPE)
+    try:
+        port = int(server.stdout.readline())
+        stop = multiprocessing.Event()
+        counts = multiprocessing.Queue()
+        workers = [multiprocessing.Process(
+            target=flood, args=(port, '127.0.0.%d' % (i + 2), stop, counts))
+            for i in range(flooders)]
+        for worker in workers:
+            worker.start()
+        time.sleep(1)  # Let the flood build up.
+        body = urllib.urlencode({'notice': token()})
+        latencies, failed = [], 0
+        start = time.time()
+        for i in xrange(GOOD):
+            time.sleep(max(0, start + float(i) / GOOD_RATE - time.time()))
+            sent = time.time()
+            if post(port, body) != 200:
+                failed += 1
+            latencies.append(time.time() - sent)
+        elapsed = time.time() - start
+        stop.set()
+        flooded = {}
+        for worker in workers:
+            for status, count in counts.get().items():
+                flooded[status] = flooded.get(status, 0) + count
+            worker.join()
+        return latencies, failed, flooded, elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == 'serve':
+        return serve(sys.argv[2])
+    print '%-22s %9s %9s %7s %10s %7s' % ('run', 'p50 ms', 'p99 ms',
+                                          'failed', 'flood/s', '503s')
+    for label, admission, flooders in (('no flood', 'off', 0),
+                                       ('flood', 'off', FLOODERS),
+                                       ('flood + admission', 'on', FLOODERS)):
+        latencies, failed, flooded, elapsed = run(admission, flooders)
+        total = sum(flooded.values())
+        print '%-22s %9.1f %9.1f %7d %10.0f %6.0f%%' % (
+            label, percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000, failed, total / elapsed,
+            flooded.get(503, 0) * 100.0 / (total or 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Memory allocated while verifying a large notice, by token type.
+
+Python 2 has no tracemalloc, so large allocations are counted instead:
+each measurement runs in a fresh process where glibc serves every
+allocation of 128KB or more with its own ``mmap``, and the minor page
+faults of a verification are the pages those allocations touched. The
+notice is about a megabyte, so each copy of the token is one such
+allocation while small objects come from pools that are reused.
+
+The ``copies`` column is the memory allocated per verification divided
+by the token size. Parsing the payload JSON, shown as its own row,
+allocates the same for every token type.
+"""
+import os
+import resource
+import subprocess
+import sys
+
+from . import KEY, SECRET, token
+
+CALLS = 20
+KINDS = ('json', 'pyjwt', 'unicode', 'str', 'bytearray', 'memoryview')
+
+
+def allocate(kind, calls=CALLS):
+    import jwt
+    from jwt.utils import base64url_decode
+
+    import mozpay
+    from mozpay import jsonlib
+
+    request = str(token(product_data='x' * (1 << 20)))
+    if kind == 'json':
+        payload = base64url_decode(request.split('.')[1])
+        call = lambda: jsonlib.loads(payload)
+    elif kind == 'pyjwt':
+        request = unicode(request)
+        call = lambda: jwt.decode(request, SECRET, audience=KEY)
+    else:
+        request = {'unicode': unicode, 'str': str, 'bytearray': bytearray,
+                   'memoryview': memoryview}[kind](request)
+        verifier = mozpay.Verifier(KEY, SECRET, max_length=1 << 21)
+        call = lambda: verifier(request)
+    call()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    for i in xrange(calls):
+        call()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    print '%s %d %d' % (kind, len(request),
+                        (after - before) * resource.getpagesize() / calls)
+
+
+def main():
+    if len(sys.argv) > 1:
+        return allocate(sys.argv[1])
+    env = dict(os.environ, MALLOC_MMAP_THRESHOLD_=str(128 * 1024))
+    print '%-12s %12s %8s' % ('token', 'KB/verify', 'copies')
+    for kind in KINDS:
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.allocations', kind], env=env)
+        name, size, allocated = output.split()
+        print '%-12s %12d %8.1f' % (name, int(allocated) / 1024,
+                                    float(allocated) / int(size))
+
+
+if __name__ == '__main__':
+    main()
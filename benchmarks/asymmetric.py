@@ -0,0 +1,63 @@
+"""
+Verifications per second for each signature algorithm.
+
+Compares :class:`mozpay.Verifier`, which parses a public key once, with
+``jwt.decode``, which parses the PEM string for every token. This needs
+the cryptography package.
+"""
+import sys
+
+import jwt
+
+import mozpay
+
+from . import KEY, SECRET, per_call, token
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+except ImportError:
+    rsa = None
+
+
+def pems(private_key):
+    private = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption())
+    public = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private, public
+
+
+def main():
+    if rsa is None:
+        sys.exit('This benchmark needs the cryptography package.')
+    rsa_private, rsa_public = pems(rsa.generate_private_key(
+        public_exponent=65537, key_size=2048, backend=default_backend()))
+    ec_private, ec_public = pems(ec.generate_private_key(
+        ec.SECP256R1(), default_backend()))
+    cases = [('HS256', SECRET, SECRET),
+             ('RS256', rsa_private, rsa_public),
+             ('ES256', ec_private, ec_public)]
+    width = len('RS256 (jwt.decode)')
+    for alg, signing_key, verifying_key in cases:
+        request = token(secret=signing_key, algorithm=alg)
+        verifier = mozpay.Verifier(KEY, verifying_key, algorithms=[alg])
+
+        def cached():
+            verifier(request)
+
+        def decode():
+            jwt.decode(request, verifying_key, algorithms=[alg],
+                       audience=KEY)
+
+        for name, func in [(alg, cached), (alg + ' (jwt.decode)', decode)]:
+            print '%-*s %10.0f verifications/s' % (width, name,
+                                                   1 / per_call(func))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Records written per second by :class:`mozpay.audit.AuditLog`.
+
+Threads standing in for concurrent requests record notices as fast as
+they can: without waiting, waiting for each record to be synced (group
+commit) and, for comparison, with a write and fsync of their own per
+record. Then a short time range is read back from the whole log.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mozpay.audit import AuditLog, _frame_record, read_records
+from mozpay.metrics import MemorySink
+
+from . import payload, per_call, report, token
+
+RECORDS = 20000
+
+
+def run(threads, mode):
+    directory = tempfile.mkdtemp()
+    try:
+        sink = MemorySink()
+        audit = AuditLog(directory, metrics=sink)
+        signed_request, data = token(), payload()
+        lock = threading.Lock()
+        path = os.path.join(directory, 'direct.log')
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+        def record():
+            for i in xrange(RECORDS / threads):
+                if mode == 'fsync each':
+                    with lock:
+                        os.write(fd, _frame_record(signed_request))
+                        os.fsync(fd)
+                else:
+                    audit.record(signed_request, data,
+                                 wait=mode == 'wait')
+
+        workers = [threading.Thread(target=record) for i in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        audit.flush()
+        elapsed = time.time() - start
+        audit.close()
+        os.close(fd)
+        batch = sink.histograms.get(('audit.batch', ()))
+        return RECORDS / elapsed, batch.mean if batch else 1
+    finally:
+        shutil.rmtree(directory)
+
+
+def read_range():
+    directory = tempfile.mkdtemp()
+    try:
+        audit = AuditLog(directory, segment_size=4 * 1024 * 1024,
+                         fsync=False)
+        signed_request, data = token(), payload()
+        for i in xrange(500000):
+            audit.record(signed_request, data, now=i)
+        audit.close()
+        report([('read 10 of 500k records',
+                 per_call(lambda: list(read_records(directory, 250000,
+                                                    250010)))),
+                ('read 10k of 500k records',
+                 per_call(lambda: list(read_records(directory, 250000,
+                                                    260000))))],
+               unit='ms')
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    print '%-12s %8s %12s %14s' % ('mode', 'threads', 'records/s',
+                                   'records/fsync')
+    for mode in ('fsync each', 'wait', 'no wait'):
+        for threads in (1, 16):
+            rate, batch = run(threads, mode)
+            print '%-12s %8d %12.0f %14.1f' % (mode, threads, rate, batch)
+    print
+    read_range()
+
+
+if __name__ == '__main__':
+    main()
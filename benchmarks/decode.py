@@ -0,0 +1,38 @@
+"""
+Payload decoding time for each installed JSON backend.
+
+Parses the decoded payload segment of a realistic notice and of notices
+with large ``productData`` with every backend in
+:data:`mozpay.jsonlib.backends`, then verifies each notice end to end.
+"""
+from jwt.utils import base64url_decode
+
+import mozpay
+from mozpay import jsonlib
+
+from . import KEY, SECRET, per_call, report, token
+
+
+def main():
+    notices = [('realistic', token())]
+    for size in (1024, 16 * 1024, 256 * 1024):
+        product_data = '&'.join('item_%d=%d' % (i, i * 7)
+                                for i in xrange(size / 12))[:size]
+        notices.append(('productData %dKB' % (size / 1024),
+                        token(product_data=product_data)))
+    rows = []
+    for label, request in notices:
+        payload = base64url_decode(request.split('.')[1])
+        for name, (loads, dumps) in sorted(jsonlib.backends.items()):
+            rows.append(('%s: %s loads' % (label, name),
+                         per_call(lambda: loads(payload))))
+        for name in sorted(jsonlib.backends):
+            jsonlib.use(name)
+            verifier = mozpay.Verifier(KEY, SECRET, max_length=1 << 20)
+            rows.append(('%s: %s verify' % (label, name),
+                         per_call(lambda: verifier(request))))
+    report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Memory held by verified notices.
+
+Each representation is built in a fresh process which verifies a batch
+of distinct postbacks and keeps all of the results. The growth of the
+process's peak RSS is reported, for the nested dicts that
+:func:`mozpay.process_postback` returns by default and for the
+:class:`mozpay.transaction.Transaction` objects of ``as_object=True``.
+"""
+import resource
+import subprocess
+import sys
+
+from . import KEY, SECRET, token
+
+COUNT = 50000
+
+
+def hold(kind, count=COUNT):
+    import mozpay
+    tokens = [token(transaction_id=str(i),
+                    product_data='my_product_id=%d' % i)
+              for i in xrange(count)]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results = [mozpay.process_postback(t, KEY, SECRET,
+                                       as_object=(kind == 'transaction'))
+               for t in tokens]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert len(results) == count
+    print '%s %d' % (kind, after - before)
+
+
+def main():
+    if len(sys.argv) > 1:
+        return hold(sys.argv[1])
+    print '%-12s %12s %14s' % ('result', 'RSS KB', 'bytes/notice')
+    for kind in ('dict', 'transaction'):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.memory', kind])
+        name, kb = output.split()
+        print '%-12s %12d %14.0f' % (name, int(kb),
+                                     int(kb) * 1024.0 / COUNT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Notices stored per second by :class:`mozpay.outbox.Outbox`.
+
+Threads standing in for concurrent requests put notices as fast as they
+can, with group commit and with one commit per notice (``max_batch=1``),
+for each SQLite ``synchronous`` setting.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mozpay.metrics import MemorySink
+from mozpay.outbox import Outbox
+
+from . import payload
+
+NOTICES = 2000
+
+
+def run(threads, max_batch, synchronous):
+    directory = tempfile.mkdtemp()
+    try:
+        sink = MemorySink()
+        outbox = Outbox(os.path.join(directory, 'outbox.db'),
+                        lambda kind, data: None, max_batch=max_batch,
+                        synchronous=synchronous, metrics=sink)
+        data = payload()
+
+        def put():
+            for i in xrange(NOTICES / threads):
+                outbox.put('postback', data)
+
+        workers = [threading.Thread(target=put) for i in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        outbox.close()
+        return NOTICES / elapsed, sink.histograms[('outbox.batch', ())].mean
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    print '%-8s %-8s %8s %12s %10s' % ('sync', 'batch', 'threads',
+                                      'notices/s', 'ops/commit')
+    for synchronous in ('FULL', 'NORMAL'):
+        for max_batch in (1, 256):
+            for threads in (1, 16):
+                rate, batch = run(threads, max_batch, synchronous)
+                print '%-8s %-8d %8d %12.0f %10.1f' % (
+                    synchronous, max_batch, threads, rate, batch)
+
+
+if __name__ == '__main__':
+    main()
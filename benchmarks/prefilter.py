@@ -0,0 +1,49 @@
+"""
+Cost of rejecting garbage notices.
+
+Compares how long :class:`mozpay.Verifier` takes to reject each kind
+of junk request with the cost of just decoding it with PyJWT.
+"""
+import jwt
+
+import mozpay
+
+from . import KEY, SECRET, per_call, report, token
+
+
+def main():
+    verifier = mozpay.Verifier(KEY, SECRET)
+    valid = token()
+    garbage = [
+        ('oversized', 'x' * 1024 * 1024),
+        ('one segment', 'x' * 500),
+        ('four segments', valid + '.abc'),
+        ('bad alphabet', valid[:-10] + '!' * 10),
+        ('wrong alg', token(algorithm='HS512')),
+        ('bad json', 'eyJhbGciOiJIUzI1NiJ9.bm90IGpzb24.abc'),
+        ('bad signature', valid[:-5] + 'AAAAA'),
+    ]
+
+    def reject(request):
+        try:
+            verifier(request)
+        except mozpay.InvalidJWT:
+            pass
+
+    def decode(request):
+        try:
+            jwt.decode(request, verify=False)
+        except jwt.InvalidTokenError:
+            pass
+
+    rows = []
+    for name, request in garbage:
+        rows.append(('reject %s' % name, per_call(lambda: reject(request))))
+        rows.append(('  (decode %s)' % name,
+                     per_call(lambda: decode(request))))
+    rows.append(('verify valid', per_call(lambda: verifier(valid))))
+    report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Indexing postbacks and matching chargebacks with :mod:`mozpay.reconcile`.
+
+An audit log of postbacks is indexed, in memory-bounded runs, and a
+stream of chargebacks (a tenth of them orphans) is matched against it.
+"""
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from mozpay.audit import AuditLog
+from mozpay.reconcile import ReconciliationIndex, build_index
+
+POSTBACKS = 200000
+CHARGEBACKS = 50000
+RUN_SIZE = 50000
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        audit_directory = os.path.join(directory, 'audit')
+        path = os.path.join(directory, 'postbacks.index')
+        audit = AuditLog(audit_directory, fsync=False)
+        for i in xrange(POSTBACKS):
+            audit.record('a.b.%d' % i, {
+                'iss': 'marketplace.mozilla.org',
+                'typ': 'mozilla/postback/pay/v1',
+                'response': {'transactionID': 'tx-%d' % i}})
+        audit.close()
+
+        start = time.time()
+        count = build_index(audit_directory, path, run_size=RUN_SIZE)
+        print 'indexed %d postbacks in %.2fs (%d KB)' % (
+            count, time.time() - start, os.path.getsize(path) // 1024)
+
+        chargebacks = ({'iss': 'marketplace.mozilla.org',
+                        'typ': 'mozilla/chargeback/refund/v1',
+                        'response': {'transactionID': (
+                            'orphan-%d' if i % 10 == 0 else 'tx-%d') % i}}
+                       for i in xrange(CHARGEBACKS))
+        index = ReconciliationIndex(path, audit_directory)
+        statuses = {}
+        start = time.time()
+        for result in index.reconcile(chargebacks):
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+        elapsed = time.time() - start
+        index.close()
+        print 'matched %d chargebacks/s: %s' % (
+            CHARGEBACKS / elapsed,
+            ', '.join('%s=%d' % item for item in sorted(statuses.items())))
+        print 'peak RSS %d MB' % (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
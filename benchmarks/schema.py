@@ -0,0 +1,46 @@
+"""
+Cost of validating a payload's fields.
+
+Compares the compiled :data:`mozpay.schema.PAYMENTS` schema with the
+``required_keys`` paths plus the separate chargeback reason check.
+PAYMENTS also checks the types of more fields, so a schema of just the
+required keys is timed as well.
+"""
+from mozpay.processor import _validate_chargeback
+from mozpay.schema import Field, PAYMENTS, Schema
+from mozpay.verify import (DEFAULT_REQUIRED_KEYS, _compile_key_paths,
+                           _verify_key_paths)
+
+from . import payload, per_call, report
+
+
+def main():
+    key_paths = _compile_key_paths(DEFAULT_REQUIRED_KEYS)
+    same_keys = Schema({None: dict((path, Field())
+                                   for path in DEFAULT_REQUIRED_KEYS)})
+    postback = payload()
+    chargeback = payload(typ='mozilla/chargeback/pay/v1',
+                         extra_res={'reason': 'refund'})
+
+    def keys(data, validators=()):
+        _verify_key_paths(data, key_paths, data['iss'])
+        for validator in validators:
+            validator(data)
+
+    rows = [
+        ('postback required_keys',
+         per_call(lambda: keys(postback))),
+        ('postback schema',
+         per_call(lambda: PAYMENTS.validate(postback))),
+        ('postback schema of required_keys',
+         per_call(lambda: same_keys.validate(postback))),
+        ('chargeback required_keys + reason',
+         per_call(lambda: keys(chargeback, [_validate_chargeback]))),
+        ('chargeback schema',
+         per_call(lambda: PAYMENTS.validate(chargeback))),
+    ]
+    report(rows)
+
+
+if __name__ == '__main__':
+    main()
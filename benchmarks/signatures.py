@@ -0,0 +1,38 @@
+"""
+HMAC signature checks per second.
+
+Compares the pre-keyed :class:`mozpay.keyring.Key` with preparing the
+key through PyJWT for every token, for each HS algorithm.
+"""
+from jwt.algorithms import get_default_algorithms
+from jwt.utils import base64url_decode
+
+from mozpay.keyring import Key
+
+from . import SECRET, per_call, token
+
+ALGORITHMS = ['HS256', 'HS384', 'HS512']
+
+
+def main():
+    algorithms = get_default_algorithms()
+    key = Key(SECRET, algorithms=ALGORITHMS)
+    width = max(len(alg) for alg in ALGORITHMS) + len(' (pyjwt)')
+    for alg in ALGORITHMS:
+        signing_input, crypto_segment = token(algorithm=alg).rsplit('.', 1)
+        signature = base64url_decode(crypto_segment)
+        pyjwt = algorithms[alg]
+
+        def fast():
+            assert key.verify(alg, signing_input, signature)
+
+        def slow():
+            assert pyjwt.verify(signing_input, pyjwt.prepare_key(SECRET),
+                                signature)
+
+        for name, func in [(alg, fast), (alg + ' (pyjwt)', slow)]:
+            print '%-*s %12.0f sigs/s' % (width, name, 1 / per_call(func))
+
+
+if __name__ == '__main__':
+    main()
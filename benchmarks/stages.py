@@ -0,0 +1,189 @@
+"""
+Times each stage of verifying postbacks and chargebacks.
+
+The corpus is made of postbacks and chargebacks with varied
+``productData`` sizes plus some invalid notices. Every stage of
+:mod:`mozpay.verify` is timed on its own, followed by complete
+verification and, when Django is installed, the Django views.
+
+Results can be written as JSON and compared with a stored baseline::
+
+    python -m benchmarks.stages --output baseline.json
+    python -m benchmarks.stages --baseline baseline.json --threshold 0.2
+
+With a baseline, the exit status is 1 if any benchmark got slower by
+more than the threshold (a fraction).
+"""
+import argparse
+import json
+import platform
+import sys
+
+import jwt
+
+import mozpay
+from mozpay import verify
+from mozpay.processor import _validate_chargeback
+
+from . import KEY, SECRET, payload, per_call
+
+POSTBACK = 'mozilla/postback/pay/v1'
+CHARGEBACK = 'mozilla/chargeback/pay/v1'
+
+# productData sizes: empty, typical, the Marketplace maximum and larger.
+PRODUCT_DATA = {
+    'empty': '',
+    'typical': 'my_product_id=1234',
+    'max': 'x' * 255,
+    'large': 'x' * 4096,
+}
+
+
+def corpus():
+    """Yields (name, typ, token) tuples of valid notices."""
+    for size, product_data in sorted(PRODUCT_DATA.items()):
+        yield ('postback/%s' % size, POSTBACK,
+               _encode(payload(product_data=product_data)))
+        yield ('chargeback/%s' % size, CHARGEBACK,
+               _encode(payload(typ=CHARGEBACK, product_data=product_data,
+                               extra_res={'reason': 'refund'})))
+
+
+def invalid_corpus():
+    """Yields (name, token) tuples of invalid notices."""
+    valid = _encode(payload())
+    missing_key = payload()
+    del missing_key['request']['pricePoint']
+    expired = payload()
+    expired['exp'] = 1
+    yield 'invalid/garbage', 'not a JWT'
+    yield 'invalid/signature', _encode(payload(), secret='wrong')
+    yield 'invalid/truncated', valid[:-10]
+    yield 'invalid/expired', _encode(expired)
+    yield 'invalid/missing_key', _encode(missing_key)
+
+
+def stage_benchmarks():
+    """Yields (name, callable) pairs."""
+    required_keys = verify.DEFAULT_REQUIRED_KEYS
+    for name, typ, token in corpus():
+        data = verify._get_json(token)
+        yield ('_get_issuer/%s' % name,
+               lambda token=token: verify._get_issuer(signed_request=token))
+        yield ('_get_json/%s' % name,
+               lambda token=token: verify._get_json(token))
+        yield ('verify_sig/%s' % name,
+               lambda token=token: verify.verify_sig(
+                   token, SECRET, algorithms=['HS256'], expected_aud=KEY))
+        yield ('verify_claims/%s' % name,
+               lambda data=data: verify.verify_claims(
+                   data, issuer=data['iss']))
+        yield ('verify_keys/%s' % name,
+               lambda data=data: verify.verify_keys(
+                   data, required_keys, issuer=data['iss']))
+        if typ == CHARGEBACK:
+            yield ('validators/%s' % name,
+                   lambda data=data: _validate_chargeback(data))
+            process = mozpay.process_chargeback
+        else:
+            process = mozpay.process_postback
+        yield ('verify_jwt/%s' % name,
+               lambda token=token, process=process: process(token, KEY,
+                                                            SECRET))
+
+    for name, token in invalid_corpus():
+        yield 'verify_jwt/%s' % name, lambda token=token: _reject(token)
+
+    for item in _django_benchmarks():
+        yield item
+
+
+def _django_benchmarks():
+    try:
+        from django.conf import settings
+    except ImportError:
+        return
+    if not settings.configured:
+        settings.configure(MOZ_APP_KEY=KEY, MOZ_APP_SECRET=SECRET,
+                           INSTALLED_APPS=['mozpay.djangoapp'])
+    from django.test.client import RequestFactory
+    from mozpay.djangoapp import views
+
+    factory = RequestFactory()
+    for name, typ, token in corpus():
+        view = views.chargeback if typ == CHARGEBACK else views.postback
+
+        def request(view=view, token=token):
+            response = view(factory.post('/', {'notice': token}))
+            assert response.status_code == 200, response.status_code
+
+        yield 'django_view/%s' % name, request
+
+
+def run(pattern=None):
+    results = {}
+    for name, func in stage_benchmarks():
+        if pattern and pattern not in name:
+            continue
+        results[name] = per_call(func)
+        print '%-40s %10.2f us' % (name, results[name] * 1e6)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of (name, baseline, result) that regressed."""
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if before and seconds > before * (1 + threshold):
+            regressions.append((name, before, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.stages',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown as a fraction '
+                             '(default: 0.25).')
+    parser.add_argument('--filter', help='Only run benchmarks whose name '
+                                         'contains this.')
+    args = parser.parse_args(argv)
+
+    results = run(args.filter)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'pyjwt': jwt.__version__,
+                       'results': results}, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print 'REGRESSION %s: %.2f us -> %.2f us (+%d%%)' % (
+                name, before * 1e6, after * 1e6,
+                (after / before - 1) * 100)
+        if regressions:
+            return 1
+    return 0
+
+
+def _encode(data, secret=SECRET):
+    return unicode(jwt.encode(data, secret))
+
+
+def _reject(token):
+    try:
+        mozpay.process_postback(token, KEY, SECRET)
+    except mozpay.InvalidJWT:
+        pass
+    else:
+        raise AssertionError('%r was accepted' % token)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Load test of :class:`mozpay.wsgi.PostbackApp` against the Django views.
+
+Each app is run in a fresh process which serves postbacks in-process
+(through its WSGI interface, without a network) for a few seconds. The
+requests per second and the peak RSS of that process are reported.
+The Django app is skipped if Django is not installed.
+"""
+import resource
+from StringIO import StringIO
+import subprocess
+import sys
+import time
+import urllib
+
+from . import KEY, SECRET, token
+
+
+def make_wsgi_app():
+    from mozpay.wsgi import PostbackApp
+    return PostbackApp(KEY, SECRET)
+
+
+def make_django_app():
+    from django.conf import settings
+    settings.configure(MOZ_APP_KEY=KEY, MOZ_APP_SECRET=SECRET,
+                       ROOT_URLCONF='mozpay.djangoapp.urls',
+                       INSTALLED_APPS=['mozpay.djangoapp'])
+    from django.core.handlers.wsgi import WSGIHandler
+    return WSGIHandler()
+
+
+def serve(name, seconds=3.0):
+    app = {'wsgi': make_wsgi_app, 'django': make_django_app}[name]()
+    body = urllib.urlencode({'notice': token()})
+
+    def start_response(status, headers):
+        assert status.startswith('200'), status
+
+    requests = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/postback',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': StringIO(body), 'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr}
+        ''.join(app(environ, start_response))
+        requests += 1
+    rps = requests / (time.time() - start)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%s %f %d' % (name, rps, rss)
+
+
+def main():
+    if len(sys.argv) > 1:
+        return serve(sys.argv[1])
+    print '%-8s %12s %12s' % ('app', 'requests/s', 'max RSS KB')
+    for name in ('wsgi', 'django'):
+        proc = subprocess.Popen([sys.executable, '-m', 'benchmarks.wsgi',
+                                 name], stdout=subprocess.PIPE)
+        out = proc.communicate()[0]
+        if proc.returncode:
+            print '%-8s %12s' % (name, 'failed')
+            continue
+        name, rps, rss = out.split()
+        print '%-8s %12.0f %12s' % (name, float(rps), rss)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 from .exc import *
 from .processor import *
+from .verify import Verifier
@@ -0,0 +1,6 @@
+import sys
+
+from mozpay.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Admission control for the endpoints that receive notices.
+
+During a flood of junk, verifying every request makes good notices
+wait behind bad ones. An :class:`Admission` sheds load early instead:
+a request is turned away with :class:`Overloaded` when too many are
+already running, when its source sent more than its share (or keeps
+sending invalid notices) or when the total rate is exceeded::
+
+    admission = Admission(rate=500, source_rate=50, max_concurrent=16)
+
+    admission.enter()  # Raises Overloaded.
+    try:
+        source = environ['REMOTE_ADDR']
+        admission.admit(source)  # Raises Overloaded.
+        try:
+            data = process_postback(signed_request, key, secret)
+        except InvalidJWT:
+            admission.penalize(source)
+            raise
+    finally:
+        admission.leave()
+
+The source must be something the sender cannot choose, such as the
+client's address. Claims of the notice, like its issuer, are not
+authenticated before it is verified, so anyone could spend the share of
+the Marketplace by naming it.
+
+The Django views do this when the ``MOZ_ADMISSION_*`` settings are set.
+"""
+import threading
+import time
+
+from .cache import ExpiringLRU
+
+__all__ = ['Admission', 'Overloaded', 'TokenBucket']
+
+
+class Overloaded(Exception):
+    """
+    A request was not admitted.
+
+    ``reason`` is ``'concurrency'``, ``'source'`` or ``'global'`` and
+    ``retry_after`` is how many seconds to wait before trying again.
+    """
+
+    def __init__(self, reason, retry_after):
+        super(Overloaded, self).__init__(
+            'Overloaded (%s); retry after %.2fs' % (reason, retry_after))
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        return (self.__class__, (self.reason, self.retry_after))
+
+
+class TokenBucket(object):
+    """
+    Allows *rate* events per second on average and up to *burst* at once.
+
+    *burst* defaults to one second's worth of events. A penalized
+    bucket can be in debt by up to *burst* tokens, which it pays back at
+    *rate* before admitting anything again.
+    """
+
+    def __init__(self, rate, burst=None, now=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._level = self.burst
+        self._updated = time.time() if now is None else now
+        self._lock = threading.Lock()
+
+    def take(self, count=1, now=None):
+        """
+        Takes *count* tokens if there are enough.
+
+        Returns 0 if they were taken or else the seconds until there
+        will be enough, without taking any.
+        """
+        with self._lock:
+            level = self._refill(now)
+            if level >= count:
+                self._level = level - count
+                return 0
+            return (count - level) / self.rate
+
+    def penalize(self, count, now=None):
+        """Takes *count* tokens even if there are not enough."""
+        with self._lock:
+            self._level = max(self._refill(now) - count, -self.burst)
+
+    def full_in(self, now=None):
+        """Returns the seconds until the bucket is full again."""
+        with self._lock:
+            return (self.burst - self._refill(now)) / self.rate
+
+    def _refill(self, now):
+        if now is None:
+            now = time.time()
+        if now > self._updated:
+            self._level = min(self.burst, self._level +
+                              (now - self._updated) * self.rate)
+            self._updated = now
+        return self._level
+
+
+class Admission(object):
+    """
+    Decides which requests are worth verifying.
+
+    Arguments:
+
+    **rate**, **burst**
+        The total requests admitted per second and at once.
+
+    **source_rate**, **source_burst**
+        The same for each source.
+
+    **max_concurrent**
+        The most requests handled at the same time.
+
+    **penalty**
+        The tokens a source loses for each invalid notice, on top of
+        the one the notice used. A source that keeps sending invalid
+        notices is turned away until it has paid them back.
+
+    **max_sources**
+        The most source buckets kept. Buckets are dropped once they are
+        full again, so this only matters with many active sources.
+
+    Any of the limits can be None to turn it off.
+    """
+
+    def __init__(self, rate=None, burst=None, source_rate=None,
+                 source_burst=None, max_concurrent=None, penalty=10,
+                 max_sources=10000):
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.penalty = penalty
+        self._global = TokenBucket(rate, burst) if rate else None
+        self._slots = (threading.Semaphore(max_concurrent)
+                       if max_concurrent else None)
+        self._sources = ExpiringLRU(max_sources) if source_rate else None
+
+    def enter(self):
+        """
+        Takes a concurrency slot or raises :class:`Overloaded`.
+
+        Call :meth:`leave` once the request is done.
+        """
+        if self._slots is not None and not self._slots.acquire(False):
+            raise Overloaded('concurrency', 1)
+
+    def leave(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def admit(self, source, now=None):
+        """
+        Admits a request from *source* or raises :class:`Overloaded`.
+
+        Requests without a known source can pass None, which shares a
+        bucket.
+        """
+        if self._sources is not None:
+            bucket = self._bucket(source, now)
+            wait = bucket.take(now=now)
+            self._keep(source, bucket, now)
+            if wait:
+                raise Overloaded('source', wait)
+        if self._global is not None:
+            wait = self._global.take(now=now)
+            if wait:
+                raise Overloaded('global', wait)
+
+    def penalize(self, source, now=None):
+        """Records that *source* sent an invalid notice."""
+        if self._sources is not None and self.penalty:
+            bucket = self._bucket(source, now)
+            bucket.penalize(self.penalty, now=now)
+            self._keep(source, bucket, now)
+
+    def _bucket(self, source, now):
+        bucket = self._sources.get(source, now=now)
+        if bucket is None:
+            bucket = TokenBucket(self.source_rate, self.source_burst, now=now)
+            if not self._sources.add(source, bucket, _now(now) + 1,
+                                     now=now):
+                # Another thread added one first.
+                bucket = self._sources.get(source, bucket, now=now)
+        return bucket
+
+    def _keep(self, source, bucket, now):
+        # A full bucket is the same as a new one so it can be dropped.
+        self._sources.set(source, bucket,
+                          _now(now) + bucket.full_in(now) + 1)
+
+
+def _now(now):
+    return time.time() if now is None else now
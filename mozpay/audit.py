@@ -0,0 +1,523 @@
+"""
+An append-only audit log of verified notices.
+
+Pass an :class:`AuditLog` as the ``audit`` argument of
+:func:`mozpay.verify.verify_jwt` (or the processor functions) and a
+record is appended for each notice it verifies or rejects::
+
+    audit = AuditLog('/var/log/myapp/mozpay-audit')
+    data = process_postback(signed_request, app_key, app_secret,
+                            audit=audit)
+
+Recording does not wait for the disk. A single thread writes all records
+that arrived since its last write at once and syncs them with one fsync
+(group commit). Pass ``wait=True`` to :meth:`AuditLog.record`, or call
+:meth:`AuditLog.flush`, to wait until records are on disk.
+
+Records are read back with :func:`read_records`, which can seek to a
+time range without reading the records before it.
+
+The log is a directory of segment files. Each :class:`AuditLog` writing
+to the directory takes a writer number, which it holds with an exclusive
+:func:`fcntl.flock` until it is closed, and only writes to its own
+segments, named after the writer and a sequence number. So pre-forked
+workers can each open an :class:`AuditLog` on the same directory;
+:func:`read_records` merges the writers' records by time. A new segment
+is started once the current one is larger than *segment_size*. Each
+record is framed as::
+
+    magic (2 bytes) | body length (4) | CRC-32 of the body (4) | body
+
+and its body holds the timestamp, the SHA-1 digest of the token and the
+issuer, typ, transaction ID and outcome as length-prefixed UTF-8
+strings. A record torn by a crash fails its check and ends its segment;
+an :class:`AuditLog` opened on the directory again cuts it off before
+appending.
+"""
+from collections import namedtuple
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows.
+    fcntl = None
+
+from .cache import token_digest
+from .executor import Future
+from .verify import _token_types
+
+__all__ = ['AuditLog', 'AuditRecord', 'read_records']
+
+log = logging.getLogger(__name__)
+
+# Segments are started once they are larger than this.
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+_file_magic = 'MOZPAYA1'
+_record_magic = '\xa5\x7e'
+_frame = struct.Struct('>2sII')
+_timestamp = struct.Struct('>d')
+_field_length = struct.Struct('>H')
+_segment_re = re.compile(r'(\d+)-(\d{8})\.audit\Z')
+# Below this many bytes, a time range is found by reading records in order.
+_scan_size = 4096
+
+
+class AuditRecord(namedtuple('AuditRecord', 'timestamp digest issuer typ '
+                             'transaction_id outcome')):
+    """
+    A record of the audit log.
+
+    ``digest`` is the SHA-1 digest of the token (see
+    :func:`mozpay.cache.token_digest`) and ``outcome`` is ``'ok'`` or the
+    name of the exception the notice was rejected with. The other fields
+    are ``u''`` when the notice did not have them.
+    """
+    __slots__ = ()
+
+
+class AuditLog(object):
+    """
+    Appends records to the segment files in *directory*.
+
+    Other arguments:
+
+    **segment_size**
+        The size in bytes after which a new segment is started.
+
+    **fsync**
+        When False, records are written but not synced, so they survive
+        a crash of the process but not of the machine.
+
+    **metrics**
+        A :class:`mozpay.metrics.Sink` for the time of each write and
+        sync (``audit.commit``) and the records written at once
+        (``audit.batch``).
+
+    Records are timestamped when they are recorded, and never earlier
+    than the record before them, so each writer's segments are ordered by
+    time. The writer number is in the ``writer`` attribute. Without
+    :mod:`fcntl` (on Windows), writer numbers are not locked and only one
+    :class:`AuditLog` may write to a directory at a time.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                 fsync=True, metrics=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.metrics = metrics
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._pending = []
+        self._last = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self.writer, self._lock_fd = _claim(directory)
+        segments = _segments(directory).get(self.writer)
+        if segments:
+            self._sequence = segments[-1][0]
+            self._open(segments[-1][1], recover=True)
+        else:
+            self._sequence = 0
+            self._open(self._path(0))
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='mozpay-audit')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def record(self, signed_request, jwt_data=None, outcome='ok',
+               issuer=None, now=None, wait=False):
+        """
+        Records the outcome of verifying *signed_request*.
+
+        The issuer, typ and transaction ID are taken from *jwt_data* if
+        it is given, otherwise *issuer* is recorded. With *wait*, this
+        returns once the record is on disk and raises the error if it
+        could not be written.
+        """
+        if jwt_data is not None:
+            response = jwt_data.get('response')
+            issuer = jwt_data.get('iss')
+            typ = jwt_data.get('typ')
+            transaction_id = (response.get('transactionID')
+                              if isinstance(response, dict) else None)
+        else:
+            typ = transaction_id = None
+        if isinstance(signed_request, _token_types):
+            if isinstance(signed_request, memoryview):
+                signed_request = signed_request.tobytes()
+            digest = token_digest(signed_request)
+        else:
+            digest = ''
+        body = (_encode(digest) + _encode(issuer) + _encode(typ) +
+                _encode(transaction_id) + _encode(outcome))
+        future = Future() if wait else None
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The audit log is closed')
+            now = max(time.time() if now is None else now, self._last)
+            self._last = now
+            self._pending.append((_frame_record(_timestamp.pack(now) + body),
+                                  future))
+            self._ready.notify()
+        if future is not None:
+            future.result()
+
+    def flush(self, timeout=None):
+        """
+        Returns once all records recorded so far are on disk.
+
+        Raises the error if any of them could not be written, or
+        RuntimeError if *timeout* seconds pass first.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return
+            self._pending.append((None, future))
+            self._ready.notify()
+        future.result(timeout)
+
+    def close(self, timeout=None):
+        """Writes the records recorded so far and stops the writer."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._ready.notify()
+        self._writer.join(timeout)
+
+    def _path(self, sequence):
+        return os.path.join(self.directory,
+                            '%d-%08d.audit' % (self.writer, sequence))
+
+    def _open(self, path, recover=False):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0644)
+        if recover:
+            size = _valid_size(path)
+            if size < os.fstat(self._fd).st_size:
+                log.warning('cutting off a torn record at %s:%d'
+                            % (path, size))
+                os.ftruncate(self._fd, size)
+        if os.fstat(self._fd).st_size < len(_file_magic):
+            os.ftruncate(self._fd, 0)
+            _write_all(self._fd, _file_magic)
+            self._sync()
+            _sync_directory(self.directory)
+        self._size = os.fstat(self._fd).st_size
+
+    def _rotate(self):
+        os.close(self._fd)
+        self._sequence += 1
+        self._open(self._path(self._sequence))
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._ready.wait()
+                batch, self._pending = self._pending, []
+                closed = self._closed
+            if batch:
+                self._commit(batch)
+            if closed and not batch:
+                os.close(self._fd)
+                if self._lock_fd is not None:
+                    os.close(self._lock_fd)  # Frees the writer number.
+                return
+
+    def _commit(self, batch):
+        # All records are written with one write and synced with one
+        # fsync. A failed write is cut off so later records follow the
+        # last good one.
+        start = time.time()
+        records = [record for record, _ in batch if record is not None]
+        data = ''.join(records)
+        try:
+            try:
+                if data:
+                    _write_all(self._fd, data)
+                    self._sync()
+            except (IOError, OSError):
+                os.ftruncate(self._fd, self._size)
+                raise
+        except Exception, exc:
+            log.exception('writing %d audit records' % len(records))
+            for _, future in batch:
+                if future is not None:
+                    future._set((False, exc))
+            return
+        self._size += len(data)
+        for _, future in batch:
+            if future is not None:
+                future._set((True, None))
+        if self.metrics is not None:
+            # The writer must outlive a broken sink.
+            try:
+                self.metrics.timing('audit.commit', time.time() - start)
+                self.metrics.histogram('audit.batch', len(records))
+            except Exception:
+                log.exception('sending audit metrics')
+        if self._size >= self.segment_size:
+            try:
+                self._rotate()
+            except (IOError, OSError):
+                log.exception('starting a new audit segment')
+
+    def _sync(self):
+        if self.fsync:
+            getattr(os, 'fdatasync', os.fsync)(self._fd)
+
+
+def read_records(directory, start=None, end=None):
+    """
+    Yields the :class:`AuditRecord` objects of the log in *directory*.
+
+    Only records with *start* <= timestamp < *end* are yielded; either
+    can be None. The segments are memory-mapped and the first record of
+    the range is found by a binary search, so a short range of a large
+    log is read quickly. Records still being written are skipped. The
+    records of all writers are merged in the order of their timestamps.
+    """
+    for _, record in _scan(directory, start, end):
+        yield record
+
+
+def _scan(directory, start=None, end=None):
+    # Yields (((writer, sequence), offset), record) for read_records().
+    writers = [_scan_writer(writer, segments, start, end)
+               for writer, segments in sorted(_segments(directory).items())]
+    if len(writers) == 1:
+        return writers[0]
+    merged = heapq.merge(*[_by_time(writer) for writer in writers])
+    return ((location, record) for _, location, record in merged)
+
+
+def _by_time(scan):
+    for location, record in scan:
+        yield record.timestamp, location, record
+
+
+def _scan_writer(writer, segments, start, end):
+    if start is not None:
+        # Skip the segments that end before start.
+        firsts = [_first_timestamp(path) for _, path in segments]
+        while (len(segments) > 1 and firsts[1] is not None and
+               firsts[1] <= start):
+            segments.pop(0)
+            firsts.pop(0)
+    for sequence, path in segments:
+        mm = _map(path)
+        if mm is None:
+            continue
+        try:
+            offset = len(_file_magic)
+            if start is not None:
+                offset = _seek(mm, offset, start)
+            for offset, record in _records(mm, offset):
+                if end is not None and record.timestamp >= end:
+                    return
+                if start is None or record.timestamp >= start:
+                    yield ((writer, sequence), offset), record
+        finally:
+            mm.close()
+
+
+def _write_all(fd, data):
+    # os.write() may write only part of the data, such as when the disk
+    # fills up or a signal arrives; a record must never be left half
+    # written.
+    offset = 0
+    while offset < len(data):
+        offset += os.write(fd, buffer(data, offset))
+
+
+def _map(path):
+    """Memory-maps the segment *path*, or returns None if it is empty."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= len(_file_magic):
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _frame_record(body):
+    return _frame.pack(_record_magic, len(body),
+                       zlib.crc32(body) & 0xffffffff) + body
+
+
+def _encode(value):
+    if value is None:
+        value = ''
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    value = value[:0xffff]
+    return _field_length.pack(len(value)) + value
+
+
+def _body_at(mm, offset):
+    """Returns the body of the valid record at *offset*, or None."""
+    if offset + _frame.size > len(mm):
+        return None
+    magic, length, crc = _frame.unpack_from(mm, offset)
+    start = offset + _frame.size
+    if magic != _record_magic or start + length > len(mm):
+        return None
+    body = mm[start:start + length]
+    if zlib.crc32(body) & 0xffffffff != crc:
+        return None
+    return body
+
+
+def _record_at(mm, offset):
+    """Returns the record at *offset*, or None if it is not valid."""
+    body = _body_at(mm, offset)
+    if body is None:
+        return None
+    return _parse(body)
+
+
+def _parse(body):
+    fields = []
+    offset = _timestamp.size
+    for i in range(5):
+        length, = _field_length.unpack_from(body, offset)
+        offset += _field_length.size
+        fields.append(body[offset:offset + length])
+        offset += length
+    digest, issuer, typ, transaction_id, outcome = fields
+    timestamp, = _timestamp.unpack_from(body)
+    return AuditRecord(
+        timestamp, digest, issuer.decode('utf-8'), typ.decode('utf-8'),
+        transaction_id.decode('utf-8'), outcome.decode('utf-8'))
+
+
+def _records(mm, offset):
+    # Stops at the first record that is torn or not written yet.
+    while True:
+        body = _body_at(mm, offset)
+        if body is None:
+            return
+        yield offset, _parse(body)
+        offset += _frame.size + len(body)
+
+
+def _seek(mm, lo, timestamp):
+    """
+    Returns the offset of a record before the first one at *timestamp*.
+
+    *lo* is the offset of the first record. Records have different
+    sizes, so a point in the middle is turned into the next record by
+    looking for its magic and checking its CRC.
+    """
+    hi = len(mm)
+    while hi - lo > _scan_size:
+        mid = (lo + hi) // 2
+        offset = _resync(mm, mid, hi)
+        if offset is None:
+            hi = mid
+            continue
+        body = _body_at(mm, offset)
+        if _timestamp.unpack_from(body)[0] < timestamp:
+            lo = offset
+        else:
+            hi = mid
+    return lo
+
+
+def _resync(mm, offset, end):
+    while True:
+        offset = mm.find(_record_magic, offset, end)
+        if offset < 0:
+            return None
+        if _body_at(mm, offset) is not None:
+            return offset
+        offset += 1
+
+
+def _valid_size(path):
+    # The size of a segment up to the end of its last valid record.
+    mm = _map(path)
+    if mm is None:
+        return os.path.getsize(path)
+    try:
+        offset = len(_file_magic)
+        while True:
+            body = _body_at(mm, offset)
+            if body is None:
+                return offset
+            offset += _frame.size + len(body)
+    finally:
+        mm.close()
+
+
+def _first_timestamp(path):
+    with open(path, 'rb') as f:
+        f.seek(len(_file_magic))
+        head = f.read(_frame.size + _timestamp.size)
+    if len(head) < _frame.size + _timestamp.size:
+        return None
+    magic = _frame.unpack_from(head)[0]
+    if magic != _record_magic:
+        return None
+    return _timestamp.unpack_from(head, _frame.size)[0]
+
+
+def _segments(directory):
+    """
+    Returns a dict of each writer number to the (sequence, path) of its
+    segments, oldest first.
+    """
+    segments = {}
+    for name in os.listdir(directory):
+        match = _segment_re.match(name)
+        if match:
+            segments.setdefault(int(match.group(1)), []).append(
+                (int(match.group(2)), os.path.join(directory, name)))
+    for writer_segments in segments.values():
+        writer_segments.sort()
+    return segments
+
+
+def _claim(directory):
+    """
+    Returns the lowest free writer number of *directory* and the file
+    descriptor that holds its lock.
+    """
+    if fcntl is None:
+        return 0, None
+    for writer in itertools.count():
+        fd = os.open(os.path.join(directory, 'writer-%d.lock' % writer),
+                     os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)  # Another AuditLog writes as this writer.
+        else:
+            return writer, fd
+
+
+def _sync_directory(directory):
+    # Makes a new segment's directory entry durable.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
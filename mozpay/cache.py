@@ -0,0 +1,185 @@
+"""
+Small in-process caches used by mozpay.
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from .exc import DuplicateNotice, InvalidJWT, RequestExpired
+
+
+class ExpiringLRU(object):
+    """
+    A thread-safe, size bounded LRU mapping whose entries expire.
+
+    Each entry is stored with an absolute expiry time (a unix
+    timestamp). Expired entries are never returned and once *maxsize*
+    entries are stored, the least recently used one is evicted to make
+    room so memory use is bounded.
+    """
+
+    def __init__(self, maxsize=10000):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, now=None):
+        """Returns the unexpired value of *key* or *default*."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires <= now:
+                return default
+            self._data[key] = (value, expires)  # Most recently used.
+            return value
+
+    def set(self, key, value, expires):
+        """Stores *value* for *key* until the *expires* timestamp."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._set(key, value, expires)
+
+    def add(self, key, value, expires, now=None):
+        """
+        Stores *value* for *key* unless an unexpired entry exists.
+
+        Returns True if the value was stored and False otherwise.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None and entry[1] > now:
+                self._data[key] = entry
+                return False
+            self._set(key, value, expires)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _set(self, key, value, expires):
+        while len(self._data) >= self.maxsize:
+            self._data.popitem(last=False)
+        self._data[key] = (value, expires)
+
+
+class TokenCache(object):
+    """
+    Caches the outcome of verifying a signed token.
+
+    Pass this as the ``token_cache`` of a :class:`mozpay.verify.Verifier`
+    (or :func:`mozpay.verify.verify_jwt`) so that verifying the same token
+    again, for example when a notice is retried, skips the signature check
+    and JSON parsing.
+
+    Verified data is cached until the JWT expires (its ``exp`` claim)
+    and is returned as a read-only :class:`mozpay.cache.FrozenDict`.
+    Rejections are cached for *error_ttl* seconds and raise the same
+    exception again, except for time dependent ones such as
+    :class:`mozpay.exc.RequestExpired`. At most *maxsize* tokens
+    are kept.
+
+    The ``hits`` and ``misses`` attributes count cache lookups.
+    """
+
+    def __init__(self, maxsize=10000, error_ttl=60):
+        self.error_ttl = error_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = ExpiringLRU(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def verify(self, key, verify, signed_request):
+        """
+        Returns the cached outcome for *key* or calls
+        ``verify(signed_request)`` and caches its outcome.
+        """
+        entry = self._cache.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is not None:
+            ok, value = entry
+            if ok:
+                return value
+            raise _copy_error(value)
+
+        try:
+            app_req = verify(signed_request)
+        except (RequestExpired, DuplicateNotice):
+            raise
+        except InvalidJWT, exc:
+            self._cache.set(key, (False, exc), time.time() + self.error_ttl)
+            raise
+        app_req = freeze(app_req)
+        try:
+            expires = float(app_req['exp'])
+        except (KeyError, TypeError, ValueError):
+            expires = time.time() + self.error_ttl
+        self._cache.set(key, (True, app_req), expires)
+        return app_req
+
+    def clear(self):
+        self._cache.clear()
+
+
+def _copy_error(exc):
+    """
+    Returns a new copy of the cached rejection *exc*.
+
+    Subclasses that take other arguments than InvalidJWT are raised as
+    a plain :class:`mozpay.exc.InvalidJWT` with the same message.
+    """
+    rebuild, args = exc.__reduce__()[:2]
+    try:
+        return rebuild(*args)
+    except Exception:
+        return InvalidJWT(getattr(exc, 'msg', str(exc)),
+                          issuer=getattr(exc, 'issuer', None))
+
+
+class FrozenDict(dict):
+    """A read-only dict."""
+
+    def _read_only(self, *args, **kw):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+def freeze(value):
+    """Returns a read-only deep copy of JSON data."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def token_digest(signed_request):
+    """Returns a digest of a signed token."""
+    if isinstance(signed_request, unicode):
+        signed_request = signed_request.encode('utf-8')
+    return hashlib.sha1(signed_request).digest()
@@ -0,0 +1,236 @@
+"""
+Command line tools. Run ``python -m mozpay --help`` to see them.
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+from . import jsonlib, profiling
+from .audit import _segments, read_records
+from .exc import InvalidJWT
+from .processor import _validate_chargeback
+from .reconcile import ReconciliationIndex, build_index
+from .verify import verify_many
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mozpay')
+    commands = parser.add_subparsers(title='commands')
+
+    cmd = commands.add_parser(
+        'verify', help='Verify notices from a JSON lines file.',
+        description='Verify each postback/chargeback notice of a JSON lines '
+                    'file and write one JSON result per line. A line can '
+                    'be an object with a "notice" key, a JSON string or a '
+                    'bare JWT.')
+    cmd.add_argument('path', help='JSON lines file of notices '
+                                  '(use - for stdin)')
+    cmd.add_argument('--key', default=os.environ.get('MOZ_APP_KEY'),
+                     help='Application key; defaults to $MOZ_APP_KEY.')
+    cmd.add_argument('--secret', default=os.environ.get('MOZ_APP_SECRET'),
+                     help='Application secret; defaults to '
+                          '$MOZ_APP_SECRET.')
+    cmd.add_argument('--type', choices=('auto', 'postback', 'chargeback'),
+                     default='auto',
+                     help='Which rules to verify with. With auto (the '
+                          'default) chargeback rules are used when the '
+                          'typ claim is a chargeback.')
+    cmd.add_argument('--offset', type=int, default=0,
+                     help='Start reading at this byte offset, such as the '
+                          'next_offset of an earlier summary.')
+    cmd.add_argument('--output', '-o', default='-',
+                     help='Where to write results (default: stdout).')
+    cmd.add_argument('--processes', type=int, default=None,
+                     help='Number of worker processes '
+                          '(default: number of CPUs).')
+    cmd.add_argument('--chunksize', type=int, default=256,
+                     help='Notices sent to a worker at once.')
+    cmd.set_defaults(func=verify_command)
+
+    cmd = commands.add_parser(
+        'profile-report', help='Report the hottest functions of profiles.',
+        description='Aggregate the profiles written by '
+                    'mozpay.profiling.Profiler (for example by the Django '
+                    'views when MOZ_PROFILE_DIR is set) into a report of '
+                    'the hottest functions.')
+    cmd.add_argument('directory', help='The directory of profiles.')
+    cmd.add_argument('--limit', type=int, default=20,
+                     help='How many functions to show.')
+    cmd.set_defaults(func=profile_report_command)
+
+    cmd = commands.add_parser(
+        'reconcile', help='Match chargebacks to their postbacks.',
+        description='Index the postbacks of an audit log (see '
+                    'mozpay.audit), match chargebacks against them and '
+                    'write one JSON result per chargeback that is an '
+                    'orphan, a duplicate or ambiguous. The index is '
+                    'built again when the log changed since.')
+    cmd.add_argument('audit_directory', help='The directory of the audit '
+                                             'log.')
+    cmd.add_argument('chargebacks', nargs='?',
+                     help='JSON lines file of chargebacks, such as the '
+                          'results of the verify command (use - for '
+                          'stdin). Defaults to the chargebacks of the '
+                          'audit log.')
+    cmd.add_argument('--index',
+                     help='The index file (default: postbacks.index in '
+                          'the audit directory).')
+    cmd.add_argument('--all', action='store_true',
+                     help='Also write the matched chargebacks.')
+    cmd.add_argument('--output', '-o', default='-',
+                     help='Where to write results (default: stdout).')
+    cmd.set_defaults(func=reconcile_command)
+
+    args = parser.parse_args(argv)
+    return args.func(parser, args)
+
+
+def verify_command(parser, args):
+    if not args.key or not args.secret:
+        parser.error('--key and --secret (or $MOZ_APP_KEY and '
+                     '$MOZ_APP_SECRET) are required')
+    validators = {'auto': [_validate_by_typ],
+                  'postback': [],
+                  'chargeback': [_validate_chargeback]}[args.type]
+
+    if args.path == '-':
+        infile = sys.stdin
+        if args.offset:
+            parser.error('--offset cannot be used with stdin')
+    else:
+        infile = open(args.path, 'rb')
+        infile.seek(args.offset)
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'ab')
+
+    # Offsets of the lines being verified; results come back in order.
+    # The notices are read ahead, so next_offset only moves past a line
+    # once its result is written.
+    offsets = collections.deque()
+    end = []
+    summary = {'ok': 0, 'errors': collections.defaultdict(int),
+               'next_offset': args.offset}
+
+    def notices():
+        offset = args.offset
+        for line in infile:
+            next_offset = offset + len(line)
+            line = line.strip()
+            if line:
+                offsets.append((offset, next_offset))
+                yield _parse_notice(line)
+            offset = next_offset
+        end.append(offset)
+
+    start = time.time()
+    try:
+        results = verify_many(notices(), args.key, args.secret,
+                              processes=args.processes,
+                              chunksize=args.chunksize,
+                              validators=validators)
+        for token, result in results:
+            offset, next_offset = offsets.popleft()
+            if isinstance(result, InvalidJWT):
+                record = {'offset': offset, 'ok': False,
+                          'error': result.__class__.__name__,
+                          'message': str(result)}
+            else:
+                record = {'offset': offset, 'ok': True,
+                          'iss': result.get('iss'),
+                          'typ': result.get('typ'),
+                          'transactionID':
+                              result['response']['transactionID']}
+            outfile.write(jsonlib.dumps(record))
+            outfile.write('\n')
+            if record['ok']:
+                summary['ok'] += 1
+            else:
+                summary['errors'][record['error']] += 1
+            summary['next_offset'] = next_offset
+        # Skip the blank lines at the end too.
+        summary['next_offset'] = end[0]
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+        elapsed = time.time() - start
+        total = summary['ok'] + sum(summary['errors'].values())
+        summary.update(total=total, seconds=round(elapsed, 3),
+                       per_second=round(total / elapsed, 1) if elapsed else 0,
+                       errors=dict(summary['errors']))
+        sys.stderr.write(json.dumps(summary, sort_keys=True) + '\n')
+    return 0 if not summary['errors'] else 1
+
+
+def profile_report_command(parser, args):
+    if not os.path.isdir(args.directory):
+        parser.error('%s is not a directory' % args.directory)
+    profiling.report(args.directory, limit=args.limit)
+    return 0
+
+
+def reconcile_command(parser, args):
+    if not os.path.isdir(args.audit_directory):
+        parser.error('%s is not a directory' % args.audit_directory)
+    path = args.index or os.path.join(args.audit_directory,
+                                      'postbacks.index')
+    start = time.time()
+    summary = collections.defaultdict(int)
+    changed = max([os.path.getmtime(segment) for segments
+                   in _segments(args.audit_directory).values()
+                   for _, segment in segments] or [0])
+    if not os.path.exists(path) or os.path.getmtime(path) < changed:
+        summary['indexed'] = build_index(args.audit_directory, path)
+
+    if args.chargebacks is None:
+        chargebacks = read_records(args.audit_directory)
+    elif args.chargebacks == '-':
+        chargebacks = (jsonlib.loads(line) for line in sys.stdin
+                       if line.strip())
+    else:
+        chargebacks = (jsonlib.loads(line)
+                       for line in open(args.chargebacks, 'rb')
+                       if line.strip())
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'ab')
+    index = ReconciliationIndex(path, args.audit_directory)
+    try:
+        for result in index.reconcile(chargebacks):
+            summary[result.status] += 1
+            if result.status == 'matched' and not args.all:
+                continue
+            outfile.write(jsonlib.dumps({
+                'status': result.status, 'iss': result.issuer,
+                'transactionID': result.transaction_id,
+                'postbacks': [{'timestamp': record.timestamp,
+                               'digest': record.digest.encode('hex')}
+                              for record in result.postbacks]}))
+            outfile.write('\n')
+    finally:
+        index.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+        summary['seconds'] = round(time.time() - start, 3)
+        sys.stderr.write(json.dumps(summary, sort_keys=True) + '\n')
+    problems = sum(summary[status] for status in
+                   ('orphan', 'duplicate', 'ambiguous'))
+    return 0 if not problems else 1
+
+
+def _parse_notice(line):
+    if line[:1] in ('{', '"'):
+        try:
+            notice = jsonlib.loads(line)
+        except ValueError:
+            return line
+        if isinstance(notice, dict):
+            notice = notice.get('notice', '')
+        if isinstance(notice, basestring):
+            return notice
+        return line
+    return line
+
+
+def _validate_by_typ(jwt_data):
+    if 'chargeback' in (jwt_data.get('typ') or ''):
+        _validate_chargeback(jwt_data)
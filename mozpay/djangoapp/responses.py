@@ -0,0 +1,100 @@
+"""
+Responses remembered for notices the Marketplace retries.
+
+Set ``MOZ_RESPONSE_CACHE`` to one of these classes (or to an instance)
+and a notice that was already answered gets the same response again
+without being verified or signalled::
+
+    MOZ_RESPONSE_CACHE = 'mozpay.djangoapp.responses.ResponseCache'
+
+Entries are keyed by a digest of the notice so only the exact same token
+is answered from the cache, and never outlive the token's ``exp`` claim.
+"""
+import binascii
+import time
+
+from mozpay.cache import ExpiringLRU, token_digest
+
+__all__ = ['ResponseCache', 'DjangoResponseCache']
+
+# How long responses are remembered.
+DEFAULT_TTL = 3600
+
+
+class ResponseCache(object):
+    """
+    Remembers responses in this process.
+
+    At most *maxsize* responses are kept for *ttl* seconds each, or until
+    their notice expires if that is sooner. The ``hits`` and ``misses``
+    attributes count lookups.
+    """
+
+    def __init__(self, maxsize=10000, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = ExpiringLRU(maxsize=maxsize)
+
+    def get(self, name, notice):
+        """Returns the response body for *notice* at view *name*, or None."""
+        body = self._get(self.key(name, notice))
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def set(self, name, notice, body, expires=None):
+        """
+        Remembers the response *body* for *notice* at view *name*.
+
+        *expires* is the timestamp the notice expires at (its ``exp``
+        claim); an expired notice is not remembered.
+        """
+        ttl = self.ttl
+        if expires is not None:
+            ttl = min(ttl, float(expires) - time.time())
+        if ttl > 0:
+            self._set(self.key(name, notice), body, ttl)
+
+    def key(self, name, notice):
+        return 'mozpay:%s:%s' % (name,
+                                 binascii.hexlify(token_digest(notice)))
+
+    def _get(self, key):
+        return self._cache.get(key)
+
+    def _set(self, key, body, ttl):
+        self._cache.set(key, body, time.time() + ttl)
+
+
+class DjangoResponseCache(ResponseCache):
+    """
+    Remembers responses in a cache of Django's cache framework.
+
+    *alias* names one of the ``CACHES``. With a shared backend such as
+    memcached, every worker sees the responses of the others. The
+    counters only count the lookups of this process.
+    """
+
+    def __init__(self, alias='default', ttl=DEFAULT_TTL):
+        super(DjangoResponseCache, self).__init__(ttl=ttl)
+        try:
+            from django.core.cache import caches
+        except ImportError:  # Django < 1.7
+            from django.core.cache import get_cache
+            backend = get_cache(alias)
+            self._backend = lambda: backend
+        else:
+            # Each thread has its own connection.
+            self._backend = lambda: caches[alias]
+
+    def _get(self, key):
+        return self._backend().get(key)
+
+    def _set(self, key, body, ttl):
+        # Backends take whole seconds, and memcached never expires a
+        # timeout of 0.
+        if ttl >= 1:
+            self._backend().set(key, body, int(ttl))
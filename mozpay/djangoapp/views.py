@@ -1,42 +1,299 @@
 import logging
+import math
+import re
+from timeit import default_timer as timer
 
 from django import http
 from django.conf import settings
+from django.utils.importlib import import_module
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
 import mozpay
-from mozpay import InvalidJWT
+from mozpay import DuplicateNotice, InvalidJWT, profiling
+from mozpay.admission import Admission, Overloaded
+from mozpay.audit import AuditLog
+from mozpay.keyring import Keyring
+from mozpay.outbox import Outbox
 from . import signals
 
 log = logging.getLogger(__name__)
 
+_settings_objects = {}
+
+_admission_settings = ('RATE', 'BURST', 'SOURCE_RATE', 'SOURCE_BURST',
+                       'MAX_CONCURRENT', 'PENALTY')
+
+_signals = {'postback': signals.moz_inapp_postback,
+            'chargeback': signals.moz_inapp_chargeback}
+
+# A notice form field that needs no unquoting.
+_notice_re = re.compile(r'(?:^|&)notice=([^&%+]*)(?:&|$)')
+
 
 @require_POST
 @csrf_exempt
 def postback(request):
-    try:
-        data = mozpay.process_postback(request.POST['notice'],
-                                       settings.MOZ_APP_KEY,
-                                       settings.MOZ_APP_SECRET)
-    except InvalidJWT:
-        log.exception('in postback')
-        return http.HttpResponseBadRequest()
-    signals.moz_inapp_postback.send(sender=None, jwt_data=data,
-                                    request=request)
-    return http.HttpResponse(str(data['response']['transactionID']))
+    return _process(request, mozpay.process_postback,
+                    signals.moz_inapp_postback, 'postback')
 
 
 @require_POST
 @csrf_exempt
 def chargeback(request):
+    return _process(request, mozpay.process_chargeback,
+                    signals.moz_inapp_chargeback, 'chargeback')
+
+
+def _process(request, processor, signal, name):
+    metrics = _setting_object('MOZ_METRICS')
+    admission = _admission()
+    if admission is None:
+        return _measure(request, processor, signal, name, metrics)
+    try:
+        admission.enter()
+    except Overloaded, exc:
+        return _overloaded(exc, name, metrics)
+    try:
+        return _measure(request, processor, signal, name, metrics,
+                        admission)
+    finally:
+        admission.leave()
+
+
+def _measure(request, processor, signal, name, metrics, admission=None):
+    profiler = _profiler()
+    args = (request, processor, signal, name, metrics)
+    if metrics is None and profiler is None:
+        return _respond(*args, admission=admission)
+    start = timer()
+    try:
+        if profiler is None:
+            return _respond(*args, admission=admission)
+        meta = {'view': name}
+        return profiler.call(meta, _respond, *(args + (meta,)),
+                             admission=admission)
+    finally:
+        if metrics is not None:
+            metrics.timing('view.%s' % name, timer() - start)
+
+
+def _respond(request, processor, signal, name, metrics=None, meta=None,
+             admission=None):
+    notice = _notice(request)
+    if meta is not None:
+        meta['token_size'] = len(notice)
+    responses = _setting_object('MOZ_RESPONSE_CACHE')
+    if responses is not None:
+        body = responses.get(name, notice)
+        if metrics is not None:
+            metrics.incr('response_cache', tags={
+                'view': name, 'outcome': 'miss' if body is None else 'hit'})
+        if body is not None:
+            if meta is not None:
+                meta['outcome'] = 'cached'
+            return http.HttpResponse(body)
+    if admission is not None:
+        # The address can't be forged, unlike the claims of the notice.
+        source = request.META.get('REMOTE_ADDR')
+        try:
+            admission.admit(source)
+        except Overloaded, exc:
+            if meta is not None:
+                meta['outcome'] = 'Overloaded'
+            return _overloaded(exc, name, metrics)
+    replay_cache = _setting_object('MOZ_REPLAY_CACHE')
     try:
-        data = mozpay.process_chargeback(request.POST['notice'],
-                                         settings.MOZ_APP_KEY,
-                                         settings.MOZ_APP_SECRET)
-    except InvalidJWT:
-        log.exception('in chargeback')
+        key, secret = _credentials()
+        data = processor(notice, key, secret, replay_cache=replay_cache,
+                         metrics=metrics, audit=_audit_log())
+    except DuplicateNotice, exc:
+        if meta is not None:
+            meta.update(outcome='DuplicateNotice', issuer=exc.issuer)
+        # This was already processed; acknowledge it again without
+        # sending the signal.
+        log.info('duplicate %s: %s' % (name, exc))
+        return _remember(responses, name, notice, exc.jwt_data)
+    except InvalidJWT, exc:
+        if meta is not None:
+            meta.update(outcome=exc.__class__.__name__, issuer=exc.issuer)
+        if admission is not None:
+            admission.penalize(source)
+        log.exception('in %s' % name)
         return http.HttpResponseBadRequest()
-    signals.moz_inapp_chargeback.send(sender=None, jwt_data=data,
-                                      request=request)
-    return http.HttpResponse(str(data['response']['transactionID']))
+    if meta is not None:
+        meta.update(outcome='ok', issuer=data['iss'])
+    start = timer()
+    outbox = _outbox()
+    try:
+        if outbox is None:
+            signal.send(sender=None, jwt_data=data, request=request)
+        else:
+            outbox.put(name, data)
+    except:
+        # The Marketplace retries the notice, which must not be taken for
+        # a duplicate.
+        if replay_cache is not None:
+            replay_cache.forget(data, notice)
+        raise
+    if metrics is not None:
+        metrics.timing('%s.%s' % ('signal' if outbox is None else 'outbox',
+                                  name), timer() - start)
+    return _remember(responses, name, notice, data)
+
+
+def _remember(responses, name, notice, jwt_data):
+    # Only notices that were acknowledged are answered from the cache,
+    # and only until they expire.
+    body = str(jwt_data['response']['transactionID'])
+    if responses is not None:
+        responses.set(name, notice, body, jwt_data.get('exp'))
+    return http.HttpResponse(body)
+
+
+def _overloaded(exc, name, metrics):
+    if metrics is not None:
+        metrics.incr('overloaded', tags={'view': name, 'reason': exc.reason})
+    response = http.HttpResponse(status=503)
+    response['Retry-After'] = str(int(math.ceil(exc.retry_after)))
+    return response
+
+
+def _notice(request):
+    """
+    Returns the notice, as bytes when it can be sliced out of the body.
+
+    Notices are base64url encoded, which form encoding leaves as is, so
+    this saves decoding the whole form to unicode. Other requests are
+    left to ``request.POST``.
+    """
+    content_type = request.META.get('CONTENT_TYPE', '')
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        match = _notice_re.search(request.body)
+        if match is not None:
+            return match.group(1)
+    return request.POST['notice']
+
+
+def _credentials():
+    """
+    Returns the expected audience and the secret (or keyring) to use.
+
+    MOZ_KEYRING can be a :class:`mozpay.keyring.Keyring` or the path of a
+    keyring JSON file. When it's set, MOZ_APP_SECRET is not used and
+    MOZ_APP_KEY is optional.
+    """
+    keyring = getattr(settings, 'MOZ_KEYRING', None)
+    if keyring is None:
+        return settings.MOZ_APP_KEY, settings.MOZ_APP_SECRET
+    if isinstance(keyring, basestring):
+        cache_key = ('MOZ_KEYRING', keyring)
+        if cache_key not in _settings_objects:
+            _settings_objects[cache_key] = Keyring.from_file(keyring)
+        keyring = _settings_objects[cache_key]
+    return getattr(settings, 'MOZ_APP_KEY', None), keyring
+
+
+def _admission():
+    """
+    Returns the admission control configured by the MOZ_ADMISSION_*
+    settings, if any.
+
+    MOZ_ADMISSION_RATE and MOZ_ADMISSION_BURST limit the notices verified
+    per second and at once, MOZ_ADMISSION_SOURCE_RATE and
+    MOZ_ADMISSION_SOURCE_BURST do the same for each client address
+    (REMOTE_ADDR), and MOZ_ADMISSION_MAX_CONCURRENT limits the notices
+    handled at the same time. Each invalid notice costs its address
+    MOZ_ADMISSION_PENALTY more. See :class:`mozpay.admission.Admission`.
+    """
+    kw = {}
+    for name in _admission_settings:
+        value = getattr(settings, 'MOZ_ADMISSION_' + name, None)
+        if value is not None:
+            kw[name.lower()] = value
+    if not (kw.get('rate') or kw.get('source_rate') or
+            kw.get('max_concurrent')):
+        return None
+    config = ('MOZ_ADMISSION',) + tuple(sorted(kw.items()))
+    if config not in _settings_objects:
+        _settings_objects[config] = Admission(**kw)
+    return _settings_objects[config]
+
+
+def _outbox():
+    """
+    Returns the outbox that signals are sent from, if any.
+
+    MOZ_OUTBOX can be a :class:`mozpay.outbox.Outbox` or the path of the
+    SQLite file to keep notices in. Then signals are sent in the
+    background, with ``request=None``, by MOZ_OUTBOX_WORKERS threads.
+    """
+    outbox = getattr(settings, 'MOZ_OUTBOX', None)
+    if not isinstance(outbox, basestring):
+        return outbox
+    cache_key = ('MOZ_OUTBOX', outbox)
+    if cache_key not in _settings_objects:
+        _settings_objects[cache_key] = Outbox(
+            outbox, _send_signal,
+            workers=getattr(settings, 'MOZ_OUTBOX_WORKERS', 4),
+            metrics=_setting_object('MOZ_METRICS'))
+    return _settings_objects[cache_key]
+
+
+def _audit_log():
+    """
+    Returns the audit log that notices are recorded in, if any.
+
+    MOZ_AUDIT_LOG can be a :class:`mozpay.audit.AuditLog` or the
+    directory to keep one in.
+    """
+    audit = getattr(settings, 'MOZ_AUDIT_LOG', None)
+    if not isinstance(audit, basestring):
+        return audit
+    cache_key = ('MOZ_AUDIT_LOG', audit)
+    if cache_key not in _settings_objects:
+        _settings_objects[cache_key] = AuditLog(
+            audit, metrics=_setting_object('MOZ_METRICS'))
+    return _settings_objects[cache_key]
+
+
+def _send_signal(kind, jwt_data):
+    # Exceptions of the receivers make the outbox retry the notice.
+    _signals[kind].send(sender=None, jwt_data=jwt_data, request=None)
+
+
+def _profiler():
+    """
+    Returns the profiler configured by the MOZ_PROFILE_* settings.
+
+    Profiling is on when MOZ_PROFILE_DIR is set. MOZ_PROFILE_RATE is the
+    fraction of requests to profile and requests slower than
+    MOZ_PROFILE_SLOW_MS milliseconds are sampled too. Only the latest
+    MOZ_PROFILE_KEEP profiles are kept.
+    """
+    directory = getattr(settings, 'MOZ_PROFILE_DIR', None)
+    if not directory:
+        return None
+    slow = getattr(settings, 'MOZ_PROFILE_SLOW_MS', None)
+    config = (directory, getattr(settings, 'MOZ_PROFILE_RATE', 0.0),
+              slow / 1000.0 if slow is not None else None,
+              getattr(settings, 'MOZ_PROFILE_KEEP', 100))
+    if config not in _settings_objects:
+        _settings_objects[config] = profiling.Profiler(*config)
+    return _settings_objects[config]
+
+
+def _setting_object(name):
+    """
+    Returns the object configured by setting *name*.
+
+    The setting can be an object or a dotted path to a class which is
+    instantiated without arguments the first time it's needed.
+    """
+    value = getattr(settings, name, None)
+    if not isinstance(value, basestring):
+        return value
+    if value not in _settings_objects:
+        module, attr = value.rsplit('.', 1)
+        _settings_objects[value] = getattr(import_module(module), attr)()
+    return _settings_objects[value]
@@ -1,18 +1,59 @@
 """
 Exceptions that might be raised during JWT processing.
 """
-__all__ = ['InvalidJWT', 'RequestExpired']
+__all__ = ['InvalidJWT', 'RequestExpired', 'MalformedJWT', 'DuplicateNotice']
 
 
 class InvalidJWT(Exception):
     """The JWT received by an issuer is invalid."""
 
     def __init__(self, msg, issuer=None):
+        self.msg = msg
         self.issuer = issuer
         if self.issuer:
             msg = '%s (iss=%r)' % (msg, self.issuer)
         super(Exception, self).__init__(msg)
 
+    def __reduce__(self):
+        # Keep the issuer when exceptions cross process boundaries.
+        return (self.__class__, (self.msg, self.issuer))
+
 
 class RequestExpired(InvalidJWT):
     """The JWT request expired."""
+
+
+class MalformedJWT(InvalidJWT):
+    """
+    The JWT is not even structurally valid.
+
+    The ``reason`` attribute says why:
+
+    - ``'too-long'``: the token is longer than the allowed maximum.
+    - ``'segments'``: the token does not have exactly three segments.
+    - ``'alphabet'``: the token has characters outside of base64url.
+    - ``'alg'``: the header's alg is not an allowed algorithm.
+    - ``'decode'``: the header or payload is not base64url encoded JSON.
+    """
+
+    def __init__(self, msg, issuer=None, reason=None):
+        super(MalformedJWT, self).__init__(msg, issuer=issuer)
+        self.reason = reason
+
+    def __reduce__(self):
+        return (self.__class__, (self.msg, self.issuer, self.reason))
+
+
+class DuplicateNotice(InvalidJWT):
+    """
+    The JWT is valid but it was already processed.
+
+    The verified JSON data is available as ``jwt_data``.
+    """
+
+    def __init__(self, msg, issuer=None, jwt_data=None):
+        super(DuplicateNotice, self).__init__(msg, issuer=issuer)
+        self.jwt_data = jwt_data
+
+    def __reduce__(self):
+        return (self.__class__, (self.msg, self.issuer, self.jwt_data))
@@ -0,0 +1,154 @@
+"""
+Run verification in the background without blocking the caller.
+"""
+import cPickle as pickle
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+
+__all__ = ['BoundedExecutor', 'Future']
+
+
+class Future(object):
+    """The eventual result of a call made by a :class:`BoundedExecutor`."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._ok = None
+        self._value = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish and returns its result.
+
+        If the call raised an exception, that exception is raised.
+        If *timeout* seconds pass first, RuntimeError is raised.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for the result')
+        if not self._ok:
+            raise self._value
+        return self._value
+
+    def exception(self, timeout=None):
+        """Like :meth:`result` but returns the exception or None."""
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for the result')
+        return None if self._ok else self._value
+
+    def add_done_callback(self, callback):
+        """
+        Calls ``callback(future)`` once the call finishes.
+
+        Callbacks run in a thread of the executor so they should be quick,
+        for example handing the future over to an event loop.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, outcome):
+        with self._lock:
+            self._ok, self._value = outcome
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class BoundedExecutor(object):
+    """
+    A worker pool that applies backpressure.
+
+    At most *max_pending* calls can be queued or running at once; after
+    that :meth:`submit` blocks until a call finishes. This keeps a burst of
+    work from piling up in memory.
+
+    Arguments:
+
+    **workers**
+        The number of workers. Defaults to the number of CPUs.
+
+    **max_pending**
+        Defaults to twice the number of workers.
+
+    **processes**
+        Use worker processes instead of threads. Verification is CPU bound
+        so this lets it use all cores, but every function, argument and
+        result must be picklable. :meth:`submit` raises the pickling
+        error of a call that can't be sent, and the future of a call
+        whose result or exception can't be sent back fails with
+        :class:`pickle.PicklingError`.
+    """
+
+    def __init__(self, workers=None, max_pending=None, processes=False):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if max_pending is None:
+            max_pending = workers * 2
+        self._processes = processes
+        if processes:
+            self._pool = multiprocessing.Pool(workers)
+        else:
+            self._pool = ThreadPool(workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, func, *args, **kw):
+        """
+        Schedules ``func(*args, **kw)`` and returns a :class:`Future`.
+
+        This blocks while *max_pending* calls are outstanding.
+        """
+        call = _call
+        if self._processes:
+            # The pool only calls back on success, so a call it fails to
+            # send or receive would never finish. Check both ends first.
+            pickle.dumps((func, args, kw), pickle.HIGHEST_PROTOCOL)
+            call = _call_pickled
+        self._slots.acquire()
+        future = Future()
+
+        def done(outcome):
+            self._slots.release()
+            future._set(outcome)
+
+        try:
+            self._pool.apply_async(call, (func, args, kw), callback=done)
+        except:
+            self._slots.release()
+            raise
+        return future
+
+    def shutdown(self, wait=True):
+        self._pool.close()
+        if wait:
+            self._pool.join()
+
+
+def _call(func, args, kw):
+    # Exceptions are returned so that the caller is always notified.
+    try:
+        return True, func(*args, **kw)
+    except Exception, exc:
+        return False, exc
+
+
+def _call_pickled(func, args, kw):
+    # Runs in a worker process. An outcome that would not survive the
+    # trip back is replaced by an error that will.
+    outcome = _call(func, args, kw)
+    try:
+        pickle.loads(pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL))
+    except Exception, exc:
+        return False, pickle.PicklingError(
+            'Could not send back %s %r: %s'
+            % ('the result' if outcome[0] else 'the exception',
+               type(outcome[1]).__name__, exc))
+    return outcome
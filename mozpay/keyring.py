@@ -0,0 +1,339 @@
+"""
+Keys and keyrings to verify JWT signatures with.
+
+If you host many apps, each with its own key and secret, put their
+secrets in a :class:`Keyring` and pass it where a secret is expected::
+
+    keyring = Keyring()
+    keyring.add(secret_one, aud=app_key_one)
+    keyring.add(secret_two, aud=app_key_two)
+
+    data = process_postback(signed_request, None, keyring)
+
+The right secret for each JWT is found by its ``aud`` (audience) and
+``iss`` (issuer) claims and its header's ``kid`` (key ID) with a
+constant number of dictionary lookups.
+
+Besides HMAC secrets, a key can be an RSA or EC public key for the
+RS* and ES* algorithms, as a PEM string or a JWK (JSON Web Key) dict.
+These need the `cryptography <https://cryptography.io/>`_ package.
+Public keys are parsed once and the key objects are shared by every
+:class:`Key` with the same key material.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import InvalidKeyError
+from jwt.utils import base64url_decode
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+except ImportError:  # Only HMAC keys can be used.
+    ec = rsa = None
+
+__all__ = ['Key', 'Keyring']
+
+log = logging.getLogger(__name__)
+
+_algorithms = get_default_algorithms()
+
+# Algorithms verified with a pre-keyed hmac object instead of PyJWT.
+_hmac_digests = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
+
+def _compare_digest(a, b):
+    # Constant time for Python versions without hmac.compare_digest.
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+_compare_digest = getattr(hmac, 'compare_digest', _compare_digest)
+
+# Parsed public keys by (algorithm family, fingerprint).
+_key_objects = {}
+_max_key_objects = 256
+
+_curves = {
+    'P-256': 'SECP256R1',
+    'P-384': 'SECP384R1',
+    'P-521': 'SECP521R1',
+}
+
+
+class Key(object):
+    """
+    A secret and the tokens it applies to.
+
+    *aud*, *iss* and *kid* restrict the key to tokens with that audience,
+    issuer or key ID; None matches anything. The key is only used from
+    the *not_before* until the *not_after* unix timestamps, when given,
+    so that old and new keys can overlap during a rotation.
+
+    The *secret* is an HMAC secret, a PEM encoded public key or a JWK
+    dict. It is prepared for each of *algorithms* up front and for any
+    other algorithm when it is first used. For HMAC algorithms that means
+    keying an :mod:`hmac` object once; each token then only needs a copy
+    of it.
+    """
+
+    def __init__(self, secret, aud=None, iss=None, kid=None,
+                 not_before=None, not_after=None, algorithms=('HS256',)):
+        self.secret = secret
+        self.aud = aud
+        self.iss = iss
+        self.kid = kid
+        self.not_before = not_before
+        self.not_after = not_after
+        self._prepared = {}
+        for alg in algorithms:
+            try:
+                self._prepare(alg)
+            except Exception:
+                pass  # Raised again if the key is used with this alg.
+
+    @classmethod
+    def from_jwk(cls, jwk, **kw):
+        """
+        Returns a key for a JWK dict.
+
+        The key ID defaults to the JWK's ``kid``. Other keyword arguments
+        are passed to :class:`Key`.
+        """
+        kw.setdefault('kid', jwk.get('kid'))
+        return cls(jwk, **kw)
+
+    def __repr__(self):
+        return '<%s aud=%r iss=%r kid=%r>' % (self.__class__.__name__,
+                                              self.aud, self.iss, self.kid)
+
+    def valid_at(self, now):
+        return ((self.not_before is None or self.not_before <= now) and
+                (self.not_after is None or now < self.not_after))
+
+    def verify(self, alg, signing_input, signature):
+        """
+        Returns True if *signature* is valid for *signing_input*.
+
+        The signing input can be any bytes-like object.
+        """
+        try:
+            prepared = self._prepared[alg]
+        except KeyError:
+            prepared = self._prepare(alg)
+        if alg in _hmac_digests:
+            mac = prepared.copy()
+            mac.update(signing_input)
+            return _compare_digest(mac.digest(), signature)
+        # cryptography only signs str.
+        return _algorithms[alg].verify(str(signing_input), prepared,
+                                       signature)
+
+    def _prepare(self, alg):
+        # PyJWT validates the key (an HMAC secret must not be a public
+        # key, for example) so the same keys are accepted.
+        if alg in _hmac_digests:
+            secret = self.secret
+            if isinstance(secret, dict):
+                secret = _load_jwk(secret)
+            prepared = hmac.new(_algorithms[alg].prepare_key(secret),
+                                digestmod=_hmac_digests[alg])
+        elif alg[:2] in ('RS', 'ES'):
+            prepared = _key_object(alg, self.secret)
+        else:
+            prepared = _algorithms[alg].prepare_key(self.secret)
+        self._prepared[alg] = prepared
+        return prepared
+
+
+def _key_object(alg, secret):
+    """Returns the parsed public key for *secret*, parsing it only once."""
+    if not isinstance(secret, (basestring, dict)):
+        return _algorithms[alg].prepare_key(secret)  # Already a key object.
+    if isinstance(secret, dict):
+        material = json.dumps(secret, sort_keys=True)
+    elif isinstance(secret, unicode):
+        material = secret.strip().encode('utf8')
+    else:
+        material = secret.strip()
+    cache_key = (alg[:2], hashlib.sha256(material).hexdigest())
+    try:
+        return _key_objects[cache_key]
+    except KeyError:
+        pass
+    if isinstance(secret, dict):
+        secret = _load_jwk(secret)
+    key = _algorithms[alg].prepare_key(secret)
+    if len(_key_objects) >= _max_key_objects:
+        _key_objects.clear()
+    _key_objects[cache_key] = key
+    return key
+
+
+def _load_jwk(jwk):
+    """Returns the HMAC secret or public key object for a JWK dict."""
+    kty = jwk.get('kty')
+    if kty == 'oct':
+        return base64url_decode(_jwk_bytes(jwk['k']))
+    if kty not in ('RSA', 'EC'):
+        raise InvalidKeyError('Unsupported JWK key type: %r' % kty)
+    if rsa is None:
+        raise InvalidKeyError('The cryptography package is needed for '
+                              '%s keys' % kty)
+    if kty == 'RSA':
+        numbers = rsa.RSAPublicNumbers(_jwk_int(jwk['e']),
+                                       _jwk_int(jwk['n']))
+    else:
+        try:
+            curve = getattr(ec, _curves[jwk['crv']])()
+        except KeyError:
+            raise InvalidKeyError('Unsupported JWK curve: %r'
+                                  % jwk.get('crv'))
+        numbers = ec.EllipticCurvePublicNumbers(_jwk_int(jwk['x']),
+                                                _jwk_int(jwk['y']), curve)
+    return numbers.public_key(default_backend())
+
+
+def _jwk_bytes(value):
+    if isinstance(value, unicode):
+        value = value.encode('ascii')
+    return value
+
+
+def _jwk_int(value):
+    return int(binascii.hexlify(base64url_decode(_jwk_bytes(value))), 16)
+
+
+class Keyring(object):
+    """
+    A collection of keys indexed by audience, issuer and key ID.
+
+    Keys are added with :meth:`add`; :meth:`from_file` loads them from a
+    JSON file (such as a JWKS document) and reloads it when it changes.
+    """
+
+    def __init__(self, keys=()):
+        self._index = {}
+        self._path = None
+        for key in keys:
+            self._add(self._index, key)
+
+    @classmethod
+    def from_file(cls, path, check_interval=5.0):
+        """
+        Loads a keyring from a JSON file.
+
+        The file is checked for changes at most every *check_interval*
+        seconds and reloaded when its modification time changes, so keys
+        can be rotated without restarting. If a reload fails, the keys
+        loaded before are kept. The file looks like this::
+
+            {"keys": [{"secret": "...", "aud": "app key",
+                       "iss": "marketplace.mozilla.org", "kid": "2014-1",
+                       "not_before": 1400000000, "not_after": 1500000000}]}
+
+        All fields but ``secret`` are optional. The file can also be a
+        JWKS (JSON Web Key Set) document; each JWK may have the ``aud``,
+        ``iss``, ``not_before`` and ``not_after`` fields above::
+
+            {"keys": [{"kty": "RSA", "kid": "2014-1", "n": "...",
+                       "e": "AQAB", "aud": "app key"}]}
+        """
+        keyring = cls()
+        keyring._path = path
+        keyring._check_interval = check_interval
+        keyring._lock = threading.Lock()
+        keyring._next_check = 0
+        keyring._mtime = None
+        keyring._reload(raise_errors=True)
+        return keyring
+
+    def add(self, secret, **kw):
+        """
+        Adds a secret and returns its :class:`Key`.
+
+        Keyword arguments are passed to :class:`Key`.
+        """
+        key = Key(secret, **kw)
+        self._add(self._index, key)
+        return key
+
+    def find(self, aud=None, iss=None, kid=None, now=None):
+        """
+        Returns the keys that may have signed a token, most specific first.
+
+        Only keys that are valid *now* (a unix timestamp) are returned.
+        """
+        if now is None:
+            now = time.time()
+        if self._path is not None and now >= self._next_check:
+            self._reload()
+        if not isinstance(aud, basestring):
+            aud = None
+        if not isinstance(iss, basestring):
+            iss = None
+        if not isinstance(kid, basestring):
+            kid = None
+        index = self._index
+        found = []
+        for kid_ in ((kid, None) if kid is not None else (None,)):
+            for aud_ in ((aud, None) if aud is not None else (None,)):
+                for iss_ in ((iss, None) if iss is not None else (None,)):
+                    for key in index.get((aud_, iss_, kid_), ()):
+                        if key.valid_at(now):
+                            found.append(key)
+        return found
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._index.values())
+
+    def _add(self, index, key):
+        index.setdefault((key.aud, key.iss, key.kid), []).append(key)
+
+    def _reload(self, raise_errors=False):
+        with self._lock:
+            if time.time() < self._next_check:
+                return  # Another thread got here first.
+            self._next_check = time.time() + self._check_interval
+            try:
+                mtime = os.stat(self._path).st_mtime
+                if mtime == self._mtime:
+                    return
+                with open(self._path) as fp:
+                    data = json.load(fp)
+                if isinstance(data, dict):
+                    data = data['keys']
+                index = {}
+                for entry in data:
+                    self._add(index, _key_from_entry(entry))
+            except Exception:
+                if raise_errors:
+                    raise
+                log.exception('could not reload keyring %s' % self._path)
+                return
+            self._index = index  # Swapped all at once.
+            self._mtime = mtime
+
+
+def _key_from_entry(entry):
+    """Returns the :class:`Key` for an entry of a keyring file."""
+    entry = dict((str(k), v) for k, v in entry.items())
+    if 'kty' not in entry:
+        return Key(entry.pop('secret'), **entry)
+    kw = dict((name, entry.pop(name)) for name in
+              ('aud', 'iss', 'not_before', 'not_after') if name in entry)
+    return Key.from_jwk(entry, **kw)
@@ -0,0 +1,175 @@
+"""
+Metrics for the verification of postbacks and chargebacks.
+
+Pass a sink as the ``metrics`` argument of
+:class:`mozpay.verify.Verifier` (or :func:`mozpay.verify.verify_jwt` and
+the processor functions) to receive:
+
+- ``stage.<name>`` timings for each verification stage: ``precheck``,
+  ``decode``, ``signature``, ``claims``, ``keys``, ``validators``,
+  ``cache`` (a token cache lookup that hit) and ``replay``.
+- a ``verify`` timing of the whole call.
+- an ``outcome`` count tagged with the ``outcome`` (``ok`` or the name of
+  the exception class) and the ``issuer``.
+- a ``token_size`` histogram of the raw token lengths.
+
+The Django views also send ``signal.<name>`` timings for signal
+dispatch and a ``view.<name>`` timing of the whole request.
+
+Without a sink none of this is measured.
+"""
+import socket
+import threading
+
+__all__ = ['Sink', 'MemorySink', 'StatsdSink']
+
+
+class Sink(object):
+    """
+    The interface for metric sinks.
+
+    Times are in seconds. *tags* is None or a dict of strings.
+    """
+
+    def timing(self, name, seconds, tags=None):
+        raise NotImplementedError
+
+    def incr(self, name, count=1, tags=None):
+        raise NotImplementedError
+
+    def histogram(self, name, value, tags=None):
+        raise NotImplementedError
+
+
+class MemorySink(Sink):
+    """
+    Aggregates metrics in memory.
+
+    Counters are kept in ``counters`` which maps ``(name, tags)`` to a
+    count, where *tags* is a sorted tuple of ``(key, value)`` pairs.
+    Timings and histograms are summarized in ``timings`` and
+    ``histograms`` which map ``(name, tags)`` to a :class:`Summary`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def timing(self, name, seconds, tags=None):
+        self._summarize(self.timings, name, seconds, tags)
+
+    def incr(self, name, count=1, tags=None):
+        key = (name, _tag_key(tags))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + count
+
+    def histogram(self, name, value, tags=None):
+        self._summarize(self.histograms, name, value, tags)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timings = {}
+            self.histograms = {}
+
+    def _summarize(self, summaries, name, value, tags):
+        key = (name, _tag_key(tags))
+        with self._lock:
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = Summary()
+            summary.add(value)
+
+
+class Summary(object):
+    """The count, total, min and max of some values."""
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+
+class StatsdSink(Sink):
+    """
+    Sends metrics to a statsd server over UDP.
+
+    Metric names are prefixed with *prefix*. Timings are sent in
+    milliseconds, with microsecond precision. Plain statsd has no tags so
+    tag values are appended to the metric name
+    (``mozpay.outcome.InvalidJWT``) unless *tagged* is True, in which
+    case they are sent with the DogStatsD ``|#key:value`` extension.
+
+    The issuer of a rejected notice is whatever its unverified ``iss``
+    claim says, so it is left out of metric names unless it is one of
+    *issuers*; other issuers are named ``other``. With *tagged*, issuers
+    are sent as they are.
+
+    Sending is fire and forget; errors are ignored.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='mozpay',
+                 tagged=False, issuers=None):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tagged = tagged
+        self.issuers = frozenset(issuers or ())
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, seconds, tags=None):
+        self._send(name, '%.3f|ms' % (seconds * 1000), tags)
+
+    def incr(self, name, count=1, tags=None):
+        self._send(name, '%d|c' % count, tags)
+
+    def histogram(self, name, value, tags=None):
+        self._send(name, '%s|h' % value, tags)
+
+    def _send(self, name, value, tags):
+        if self.prefix:
+            name = '%s.%s' % (self.prefix, name)
+        tags = _tag_key(tags)
+        if self.tagged and tags:
+            line = '%s:%s|#%s' % (name, value, ','.join(
+                '%s:%s' % (k, _clean(v)) for k, v in tags))
+        else:
+            # Junk tokens must not make up new metric names.
+            names = [name]
+            for k, v in tags:
+                if k == 'issuer':
+                    if not self.issuers:
+                        continue
+                    if v not in self.issuers:
+                        v = 'other'
+                names.append(_clean(v))
+            line = '%s:%s' % ('.'.join(names), value)
+        try:
+            self._socket.sendto(line, self.address)
+        except (socket.error, UnicodeError):
+            pass
+
+
+def _tag_key(tags):
+    return tuple(sorted(tags.items())) if tags else ()
+
+
+def _clean(value):
+    # Characters that statsd treats specially.
+    value = unicode(value)
+    for char in '.:|@#, ':
+        value = value.replace(char, '_')
+    return value.encode('utf-8')
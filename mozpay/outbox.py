@@ -0,0 +1,322 @@
+"""
+Durable hand-off of verified notices to background workers.
+
+An :class:`Outbox` stores each verified notice in a local SQLite
+database before it is acknowledged and delivers it to a handler from a
+pool of worker threads afterwards, so slow handlers (database writes,
+fulfillment calls) stay out of the Marketplace's HTTP callback::
+
+    def deliver(kind, jwt_data):
+        fulfill(jwt_data['response']['transactionID'])
+
+    outbox = Outbox('/var/lib/myapp/notices.db', deliver)
+    outbox.put('postback', data)  # Returns once data is on disk.
+
+Delivery is at least once. A notice is deleted only after its handler
+returns; if the handler raises, it is retried later, and notices that
+were stored but not delivered before a crash are delivered again when an
+outbox is opened on the same file.
+"""
+import atexit
+import logging
+import Queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+
+from . import jsonlib
+from .executor import Future
+
+__all__ = ['Outbox']
+
+log = logging.getLogger(__name__)
+
+# Failed deliveries are retried with an exponential backoff up to this.
+MAX_RETRY_DELAY = 3600
+
+# Open outboxes, whose wake up timers are stopped at exit.
+_outboxes = weakref.WeakSet()
+
+_schema = """
+CREATE TABLE IF NOT EXISTS notices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notices_due ON notices (due);
+"""
+
+
+class Outbox(object):
+    """
+    A durable queue of verified notices, stored in the SQLite file *path*.
+
+    :meth:`put` returns once a notice is committed. All notices put while
+    the previous commit was in progress are written together by a single
+    thread in one transaction (group commit), so a burst of notices costs
+    a few fsyncs rather than one each. Committed notices are passed to
+    ``handler(kind, jwt_data)`` in one of *workers* threads.
+
+    A notice being delivered is leased: it is not delivered again for
+    *lease* seconds, after which it is assumed that the process handling
+    it died. Pick a lease longer than a delivery takes. Leases let any
+    number of processes share one file; whichever has room picks up
+    notices that are due.
+
+    Other arguments:
+
+    **retry_delay**
+        Seconds before a failed delivery is retried. This doubles with
+        every attempt, up to an hour.
+
+    **max_batch**
+        The most notices written in one transaction.
+
+    **synchronous**
+        SQLite's ``synchronous`` setting. ``'FULL'`` (the default)
+        survives power loss; ``'NORMAL'`` only survives a crash of the
+        process but commits faster.
+
+    **metrics**
+        A :class:`mozpay.metrics.Sink` for the commit time
+        (``outbox.commit``), the notices per commit (``outbox.batch``)
+        and the delivery outcomes (``outbox.delivery``).
+    """
+
+    def __init__(self, path, handler, workers=4, lease=60.0,
+                 retry_delay=5.0, max_batch=256, synchronous='FULL',
+                 metrics=None):
+        self.path = path
+        self.handler = handler
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=%s' % synchronous)
+        self._conn.executescript(_schema)
+        self._ops = Queue.Queue()
+        self._deliveries = Queue.Queue()
+        self._max_inflight = workers * 4
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wake_at = None
+        self._timer = None
+        self._ops.put(('wake',))  # Deliver what an earlier run left.
+        _outboxes.add(self)
+        self._committer = _start(self._commit_loop, 'mozpay-outbox')
+        self._workers = [_start(self._work, 'mozpay-outbox-%d' % i)
+                         for i in range(workers)]
+
+    def put(self, kind, jwt_data, timeout=None):
+        """
+        Stores a notice of *kind* and returns once it is on disk.
+
+        Raises the :mod:`sqlite3` error if it could not be stored, or
+        RuntimeError if *timeout* seconds pass first.
+        """
+        future = Future()
+        data = jsonlib.dumps(jwt_data)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The outbox is closed')
+            self._ops.put(('put', kind, data, future))
+        future.result(timeout)
+
+    def pending(self):
+        """Returns the number of notices that were not delivered yet."""
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM notices').fetchone()[0]
+        finally:
+            conn.close()
+
+    def close(self, timeout=None):
+        """
+        Stops taking notices and waits for the workers to finish.
+
+        Notices still waiting to be delivered stay in the file.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            self._deliveries.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._ops.put(('stop',))
+        self._committer.join(timeout)
+        self._stop_timer()
+
+    def _stop_timer(self):
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+
+    def _commit_loop(self):
+        maybe_due = False
+        while True:
+            ops = [self._ops.get()]
+            while len(ops) < self.max_batch:
+                try:
+                    ops.append(self._ops.get_nowait())
+                except Queue.Empty:
+                    break
+            start = time.time()
+            try:
+                maybe_due, deliveries, next_due = self._commit(ops, start,
+                                                               maybe_due)
+            except Exception, exc:
+                log.exception('committing %d outbox operations' % len(ops))
+                outcomes = []
+                for op in ops:
+                    if op[0] == 'put':
+                        op[3]._set((False, exc))
+                    elif op[0] in ('ack', 'retry'):
+                        outcomes.append(op)
+                if outcomes:
+                    # Delivered notices are deleted, and their workers
+                    # counted as free, by a later commit. Another process
+                    # holding the file's write lock is expected.
+                    time.sleep(0.1)
+                    for op in outcomes:
+                        self._ops.put(op)
+            else:
+                for op in ops:
+                    if op[0] == 'put':
+                        op[3]._set((True, None))
+                for delivery in deliveries:
+                    self._deliveries.put(delivery)
+                self._schedule_wake(next_due)
+                if self.metrics is not None:
+                    self.metrics.timing('outbox.commit', time.time() - start)
+                    self.metrics.histogram('outbox.batch', len(ops))
+            if any(op[0] == 'stop' for op in ops):
+                self._conn.close()
+                return
+
+    def _commit(self, ops, now, maybe_due):
+        # Writes *ops* in one transaction and claims notices that are due
+        # while there are free workers. Claims, acks and retries only
+        # count once the transaction is committed.
+        conn = self._conn
+        inflight = self._inflight
+        deliveries = []
+        began = False
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            began = True
+            for op in ops:
+                if op[0] == 'put':
+                    kind, data = op[1:3]
+                    claim = inflight < self._max_inflight
+                    cursor = conn.execute(
+                        'INSERT INTO notices (kind, data, due) '
+                        'VALUES (?, ?, ?)',
+                        (kind, data, now + self.lease if claim else now))
+                    if claim:
+                        inflight += 1
+                        deliveries.append((cursor.lastrowid, kind, data, 0))
+                    else:
+                        maybe_due = True
+                elif op[0] == 'ack':
+                    inflight -= 1
+                    conn.execute('DELETE FROM notices WHERE id = ?',
+                                 (op[1],))
+                elif op[0] == 'retry':
+                    inflight -= 1
+                    delay = min(self.retry_delay * 2 ** op[2],
+                                MAX_RETRY_DELAY)
+                    conn.execute('UPDATE notices SET attempts = ?, due = ? '
+                                 'WHERE id = ?', (op[2] + 1, now + delay,
+                                                  op[1]))
+                elif op[0] == 'wake':
+                    maybe_due = True
+            free = self._max_inflight - inflight
+            if maybe_due and free > 0:
+                rows = conn.execute(
+                    'SELECT id, kind, data, attempts FROM notices '
+                    'WHERE due <= ? ORDER BY id LIMIT ?',
+                    (now, free)).fetchall()
+                conn.executemany('UPDATE notices SET due = ? WHERE id = ?',
+                                 [(now + self.lease, row[0])
+                                  for row in rows])
+                inflight += len(rows)
+                deliveries.extend(rows)
+                maybe_due = len(rows) == free
+            next_due = conn.execute('SELECT MIN(due) FROM notices '
+                                    'WHERE due > ?', (now,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except:
+            etype, val, tb = sys.exc_info()
+            if began:
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass  # SQLite already rolled back after the error.
+            raise etype, val, tb
+        self._inflight = inflight
+        return maybe_due, deliveries, next_due
+
+    def _schedule_wake(self, due):
+        # Retries and expired leases are picked up by waking the commit
+        # thread at the earliest due time.
+        if due is None or (self._wake_at is not None and
+                           self._wake_at <= due):
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake_at = due
+        self._timer = threading.Timer(max(due - time.time(), 0), self._wake,
+                                      [due])
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _wake(self, due):
+        if self._wake_at == due:
+            self._wake_at = None
+        self._ops.put(('wake',))
+
+    def _work(self):
+        while True:
+            delivery = self._deliveries.get()
+            if delivery is None:
+                return
+            id, kind, data, attempts = delivery
+            try:
+                self.handler(kind, jsonlib.loads(data))
+            except Exception:
+                log.exception('delivering %s %d (attempt %d)'
+                              % (kind, id, attempts + 1))
+                outcome = 'retry'
+                self._ops.put(('retry', id, attempts))
+            else:
+                outcome = 'ok'
+                self._ops.put(('ack', id))
+            if self.metrics is not None:
+                self.metrics.incr('outbox.delivery',
+                                  tags={'kind': kind, 'outcome': outcome})
+
+
+@atexit.register
+def _stop_timers():
+    # A daemon thread that runs while the interpreter shuts down dies
+    # with noisy errors.
+    for outbox in list(_outboxes):
+        outbox._stop_timer()
+
+
+def _start(target, name):
+    thread = threading.Thread(target=target, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
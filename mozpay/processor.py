@@ -1,16 +1,82 @@
+import threading
+
 from .exc import InvalidJWT
+from .executor import BoundedExecutor
+from .transaction import Chargeback, Transaction
 from .verify import verify_jwt
 
-__all__ = ['process_postback', 'process_chargeback']
+__all__ = ['process_postback', 'process_chargeback',
+           'process_postback_async', 'process_chargeback_async']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_postback(signed_postback, key, secret, as_object=False, **kw):
+    """
+    Verifies a postback JWT and returns its data.
+
+    With *as_object*, a :class:`mozpay.transaction.Transaction` is
+    returned instead of a dict. Other keyword arguments are passed to
+    :func:`mozpay.verify.verify_jwt`.
+    """
+    data = verify_jwt(signed_postback, key, secret, **kw)
+    if as_object:
+        return Transaction.from_jwt(data, signed_postback)
+    return data
+
+
+def process_chargeback(signed_chargeback, key, secret, as_object=False,
+                       **kw):
+    """
+    Verifies a chargeback JWT and returns its data.
+
+    With *as_object*, a :class:`mozpay.transaction.Chargeback` is
+    returned instead of a dict. See :func:`process_postback`.
+    """
+    if kw.get('schema') is None:
+        # A schema already requires the reason.
+        kw.setdefault('validators', [_validate_chargeback])
+    data = verify_jwt(signed_chargeback, key, secret, **kw)
+    if as_object:
+        return Chargeback.from_jwt(data, signed_chargeback)
+    return data
+
+
+def process_postback_async(signed_postback, key, secret, executor=None,
+                           **kw):
+    """
+    Like :func:`process_postback` but runs in the background.
+
+    Returns a :class:`mozpay.executor.Future`. Its result is the
+    verified data or it raises the :class:`mozpay.exc.InvalidJWT`.
+    Calls run in *executor* (a :class:`mozpay.executor.BoundedExecutor`)
+    or in a shared thread pool; either way this blocks when too many
+    calls are already pending.
+    """
+    return _get_executor(executor).submit(
+        process_postback, signed_postback, key, secret, **kw)
+
 
+def process_chargeback_async(signed_chargeback, key, secret, executor=None,
+                             **kw):
+    """
+    Like :func:`process_chargeback` but runs in the background.
 
-def process_postback(signed_postback, key, secret, **kw):
-    return verify_jwt(signed_postback, key, secret, **kw)
+    See :func:`process_postback_async`.
+    """
+    return _get_executor(executor).submit(
+        process_chargeback, signed_chargeback, key, secret, **kw)
 
 
-def process_chargeback(signed_chargeback, key, secret, **kw):
-    kw.setdefault('validators', [_validate_chargeback])
-    return verify_jwt(signed_chargeback, key, secret, **kw)
+def _get_executor(executor):
+    global _executor
+    if executor is not None:
+        return executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = BoundedExecutor()
+    return _executor
 
 
 def _validate_chargeback(jwt_data):
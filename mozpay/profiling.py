@@ -0,0 +1,232 @@
+"""
+Profile a sample of requests and any slow request.
+
+A :class:`Profiler` profiles a random fraction of calls with
+:mod:`cProfile`. Calls that take longer than a threshold are caught
+too, without profiling every call: a background thread samples their
+stacks once they run past the threshold. Profiles are written to a
+directory that keeps only the most recent files, along with metadata
+about each call.
+
+The Django views use this when ``MOZ_PROFILE_DIR`` is set. Use
+``python -m mozpay profile-report <dir>`` to find the hot functions.
+"""
+import cProfile
+from collections import defaultdict
+import glob
+import itertools
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from timeit import default_timer as timer
+
+__all__ = ['Profiler', 'report']
+
+
+class Profiler(object):
+    """
+    Profiles a sample of calls and any slow call.
+
+    Arguments:
+
+    **directory**
+        Where profiles are written. It is created if needed.
+
+    **rate**
+        The fraction of calls to profile with cProfile, such as 0.01.
+
+    **slow**
+        Sample the stack of any call running longer than this many
+        seconds. None turns this off.
+
+    **keep**
+        How many profiles to keep. Older ones are deleted.
+
+    **interval**
+        How often, in seconds, the stacks of slow calls are sampled.
+    """
+
+    def __init__(self, directory, rate=0.0, slow=None, keep=100,
+                 interval=0.005):
+        self.directory = directory
+        self.rate = rate
+        self.slow = slow
+        self.keep = keep
+        self.interval = interval
+        self._active = {}  # Thread ID to a _Call.
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._serial = itertools.count()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def call(self, meta, func, *args, **kw):
+        """
+        Calls ``func(*args, **kw)``, maybe profiling it.
+
+        *meta* is a dict of details about the call, such as its issuer or
+        outcome, that is saved with its profile. *func* may add to it.
+        """
+        if self.rate and random.random() < self.rate:
+            return self._profile(meta, func, args, kw)
+        if self.slow is None:
+            return func(*args, **kw)
+        return self._watch(meta, func, args, kw)
+
+    def _profile(self, meta, func, args, kw):
+        profile = cProfile.Profile()
+        start = timer()
+        try:
+            return profile.runcall(func, *args, **kw)
+        finally:
+            meta = dict(meta, seconds=timer() - start, mode='sampled')
+            path = self._path('prof')
+            profile.dump_stats(path)
+            self._write(path, meta)
+
+    def _watch(self, meta, func, args, kw):
+        self._start_watcher()
+        thread_id = threading.current_thread().ident
+        call = self._active[thread_id] = _Call()
+        try:
+            return func(*args, **kw)
+        finally:
+            del self._active[thread_id]
+            seconds = timer() - call.start
+            if seconds >= self.slow:
+                path = self._path('stacks')
+                with open(path, 'w') as fp:
+                    json.dump([[list(stack), count] for stack, count
+                               in call.stacks.iteritems()], fp)
+                self._write(path, dict(meta, seconds=seconds, mode='slow'))
+
+    def _start_watcher(self):
+        if self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._sample_slow,
+                                                 name='mozpay-profiler')
+                self._watcher.daemon = True
+                self._watcher.start()
+
+    def _sample_slow(self):
+        # Only locals are used since module globals are torn down while
+        # this daemon thread may still be running at exit.
+        sleep, now, current_frames, stack = (time.sleep, timer,
+                                             sys._current_frames, _stack)
+        while True:
+            sleep(self.interval)
+            frames = None
+            started_before = now() - self.slow
+            for thread_id, call in self._active.items():
+                if call.start > started_before:
+                    continue
+                if frames is None:
+                    frames = current_frames()
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    call.stacks[stack(frame)] += 1
+
+    def _path(self, kind):
+        return os.path.join(self.directory, '%d-%d-%d.%s' % (
+            time.time() * 1000, os.getpid(), next(self._serial), kind))
+
+    def _write(self, path, meta):
+        with open(path + '.json', 'w') as fp:
+            json.dump(meta, fp)
+        self._rotate()
+
+    def _rotate(self):
+        profiles = sorted(_profiles(self.directory),
+                          key=lambda path: os.path.getmtime(path))
+        for path in profiles[:max(len(profiles) - self.keep, 0)]:
+            for name in (path, path + '.json'):
+                try:
+                    os.unlink(name)
+                except OSError:
+                    pass  # Another process got it first.
+
+
+class _Call(object):
+    __slots__ = ('start', 'stacks')
+
+    def __init__(self):
+        self.start = timer()
+        self.stacks = defaultdict(int)
+
+
+def _stack(frame, limit=100):
+    # Outermost call first.
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append('%s:%d(%s)' % (code.co_filename, code.co_firstlineno,
+                                    code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def _profiles(directory):
+    return (glob.glob(os.path.join(directory, '*.prof')) +
+            glob.glob(os.path.join(directory, '*.stacks')))
+
+
+def report(directory, limit=20, out=sys.stdout):
+    """Writes a report of the hottest functions of all profiles."""
+    metas = []
+    prof_paths = []
+    self_counts = defaultdict(int)
+    total_counts = defaultdict(int)
+    samples = 0
+    for path in sorted(_profiles(directory)):
+        try:
+            with open(path + '.json') as fp:
+                meta = json.load(fp)
+            if path.endswith('.prof'):
+                pstats.Stats(path)  # Skip unreadable profiles.
+                stacks = ()
+            else:
+                with open(path) as fp:
+                    stacks = json.load(fp)
+        except (IOError, ValueError, EOFError, TypeError):
+            continue  # Probably being written or rotated.
+        metas.append(meta)
+        if path.endswith('.prof'):
+            prof_paths.append(path)
+        for stack, count in stacks:
+            samples += count
+            self_counts[stack[-1]] += count
+            for func in set(stack):
+                total_counts[func] += count
+
+    out.write('%d profiles in %s\n' % (len(metas), directory))
+    for key in ('view', 'outcome', 'mode'):
+        counts = defaultdict(int)
+        for meta in metas:
+            counts[meta.get(key)] += 1
+        out.write('  by %s: %s\n' % (key, ', '.join(
+            '%s=%d' % item for item in sorted(counts.items()))))
+    if metas:
+        seconds = sorted(meta.get('seconds', 0) for meta in metas)
+        out.write('  seconds: median %.4f, max %.4f\n'
+                  % (seconds[len(seconds) // 2], seconds[-1]))
+
+    if prof_paths:
+        out.write('\nSampled calls (cProfile), by internal time:\n')
+        stats = pstats.Stats(*prof_paths, stream=out)
+        stats.sort_stats('tottime').print_stats(limit)
+
+    if samples:
+        out.write('\nSlow calls (%d stack samples):\n' % samples)
+        out.write('%8s %8s  function\n' % ('self %', 'total %'))
+        hottest = sorted(total_counts, key=lambda func: (
+            -self_counts.get(func, 0), -total_counts[func]))
+        for func in hottest[:limit]:
+            out.write('%8.1f %8.1f  %s\n' % (
+                100.0 * self_counts.get(func, 0) / samples,
+                100.0 * total_counts[func] / samples, func))
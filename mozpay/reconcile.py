@@ -0,0 +1,292 @@
+"""
+Matching chargebacks to the postbacks they refund.
+
+The postbacks of an audit log (see :mod:`mozpay.audit`) are indexed by
+issuer and transaction ID into a sorted file, which is then memory-mapped
+to look up each chargeback without a database round trip::
+
+    build_index('/var/log/myapp/mozpay-audit', 'postbacks.index')
+
+    index = ReconciliationIndex('postbacks.index',
+                                '/var/log/myapp/mozpay-audit')
+    for result in index.reconcile(chargebacks):
+        if result.status != 'matched':
+            print result.status, result.transaction_id
+
+Building the index sorts runs of at most *run_size* entries in memory
+and merges them on disk, so a log of any size can be indexed. Each
+entry is 18 bytes: 8 bytes of the SHA-1 digest of the issuer and
+transaction ID and the writer, segment and offset of the postback's
+record.
+Entries of the same digest are confirmed against the records they point
+to, so digest collisions are not mistaken for matches.
+"""
+from collections import namedtuple
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+from .audit import _map, _record_at, _scan, _segments
+from .transaction import Transaction
+
+__all__ = ['ReconciliationIndex', 'Reconciliation', 'build_index']
+
+# The most index entries sorted in memory at once.
+DEFAULT_RUN_SIZE = 500000
+
+_index_magic = 'MOZPAYX1'
+_entry = struct.Struct('>8sHII')
+_key_size = 8
+
+
+class Reconciliation(namedtuple('Reconciliation', 'status issuer '
+                                'transaction_id chargeback postbacks')):
+    """
+    The outcome of matching a chargeback.
+
+    ``status`` is one of:
+
+    - ``'matched'``: the chargeback refunds exactly one postback.
+    - ``'orphan'``: there is no postback for its transaction.
+    - ``'duplicate'``: an earlier chargeback already refunded the
+      postback.
+    - ``'ambiguous'``: there are postbacks of different types (``typ``
+      claims) for its transaction.
+
+    ``chargeback`` is the chargeback as it was passed in and
+    ``postbacks`` are the :class:`mozpay.audit.AuditRecord` objects of
+    the postbacks, the first of each type. Postbacks of the same issuer,
+    transaction ID and type are one postback recorded more than once,
+    such as a notice the Marketplace retried with the same token or a
+    freshly signed one. The audit log does not record amounts, so
+    retries are not told apart from payloads that differ otherwise.
+    """
+    __slots__ = ()
+
+
+def build_index(audit_directory, path, run_size=DEFAULT_RUN_SIZE):
+    """
+    Indexes the verified postbacks of the audit log in *audit_directory*.
+
+    The index is written to *path*, replacing any earlier one only once
+    it is complete. Returns the number of postbacks indexed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    runs = []
+    entries = []
+    count = 0
+    try:
+        for ((writer, sequence), offset), record in _scan(audit_directory):
+            if record.outcome != 'ok' or not _is_postback(record.typ):
+                continue
+            entries.append(_entry.pack(
+                _key(record.issuer, record.transaction_id), writer,
+                sequence, offset))
+            count += 1
+            if len(entries) >= run_size:
+                runs.append(_write_run(entries, directory))
+                entries = []
+        entries.sort()
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.index-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_index_magic)
+            for entry in heapq.merge(entries, *[_read_run(run)
+                                               for run in runs]):
+                f.write(entry)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+    finally:
+        for run in runs:
+            run.close()
+    return count
+
+
+class ReconciliationIndex(object):
+    """
+    An index of postbacks, built by :func:`build_index`.
+
+    *path* is the index file and *audit_directory* is the audit log it
+    was built from, where the records of the postbacks are read.
+    """
+
+    def __init__(self, path, audit_directory):
+        self.path = path
+        self.audit_directory = audit_directory
+        with open(path, 'rb') as f:
+            if f.read(len(_index_magic)) != _index_magic:
+                raise ValueError('%s is not a reconciliation index' % path)
+            size = os.fstat(f.fileno()).st_size
+            self._mm = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        if size > len(_index_magic) else '')
+        self._count = (size - len(_index_magic)) // _entry.size
+        self._segments = None
+        self._maps = {}
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, issuer, transaction_id):
+        """Returns the records of the postbacks of a transaction."""
+        lo, hi = self._range(_key(issuer, transaction_id))
+        return [record for _, record in self._postbacks(
+            lo, hi, issuer, transaction_id)]
+
+    def reconcile(self, chargebacks):
+        """
+        Matches each of *chargebacks* and yields its
+        :class:`Reconciliation`, in order.
+
+        A chargeback can be the dict of a verified notice, a
+        :class:`mozpay.transaction.Chargeback`, an
+        :class:`mozpay.audit.AuditRecord` or a dict with ``iss`` and
+        ``transactionID`` keys like the results of ``python -m mozpay
+        verify``. Items whose ``typ`` is not a chargeback, and records of
+        rejected notices, are skipped, so all the records of a log can
+        be passed.
+
+        The chargebacks are read once. Besides the index, which is
+        memory-mapped, this keeps one byte per postback to find
+        duplicates.
+        """
+        refunded = bytearray(self._count)
+        for chargeback in chargebacks:
+            fields = _fields(chargeback)
+            if fields is None:
+                continue
+            issuer, transaction_id = fields
+            lo, hi = self._range(_key(issuer, transaction_id))
+            found = list(self._postbacks(lo, hi, issuer, transaction_id))
+            if not found:
+                status = 'orphan'
+            elif any(refunded[position] for position, _ in found):
+                status = 'duplicate'
+            elif len(set(record.typ for _, record in found)) > 1:
+                status = 'ambiguous'
+            else:
+                status = 'matched'
+            for position, _ in found:
+                refunded[position] = 1
+            postbacks = []
+            typs = set()
+            for _, record in found:
+                if record.typ not in typs:
+                    typs.add(record.typ)
+                    postbacks.append(record)
+            yield Reconciliation(status, issuer, transaction_id, chargeback,
+                                 postbacks)
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+        for mm in self._maps.values():
+            if mm is not None:
+                mm.close()
+        self._maps.clear()
+
+    def _range(self, key):
+        # Binary searches the entries for the ones with *key*.
+        mm, count = self._mm, self._count
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = len(_index_magic) + mid * _entry.size
+            if mm[start:start + _key_size] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = lo
+        while end < count:
+            start = len(_index_magic) + end * _entry.size
+            if mm[start:start + _key_size] != key:
+                break
+            end += 1
+        return lo, end
+
+    def _postbacks(self, lo, hi, issuer, transaction_id):
+        # Yields (position, record) for the entries in [lo, hi) that
+        # really are this transaction.
+        for position in xrange(lo, hi):
+            _, writer, sequence, offset = _entry.unpack_from(
+                self._mm, len(_index_magic) + position * _entry.size)
+            mm = self._segment((writer, sequence))
+            record = _record_at(mm, offset) if mm is not None else None
+            if (record is not None and record.issuer == issuer and
+                    record.transaction_id == transaction_id):
+                yield position, record
+
+    def _segment(self, segment):
+        # *segment* is a (writer, sequence) pair.
+        if segment not in self._maps:
+            if self._segments is None:
+                self._segments = dict(
+                    ((writer, sequence), path) for writer, segments
+                    in _segments(self.audit_directory).items()
+                    for sequence, path in segments)
+            path = self._segments.get(segment)
+            self._maps[segment] = _map(path) if path else None
+        return self._maps[segment]
+
+
+def _fields(item):
+    """Returns the (issuer, transaction ID) of a chargeback, or None."""
+    if isinstance(item, Transaction):
+        issuer, typ, transaction_id = item.iss, item.typ, item.transactionID
+    elif isinstance(item, dict):
+        response = item.get('response')
+        issuer, typ = item.get('iss'), item.get('typ')
+        if isinstance(response, dict):
+            transaction_id = response.get('transactionID')
+        else:
+            transaction_id = item.get('transactionID')
+        if item.get('ok') is False:
+            return None
+    else:
+        if item.outcome != 'ok':
+            return None
+        issuer, typ, transaction_id = (item.issuer, item.typ,
+                                       item.transaction_id)
+    if not _is_chargeback(typ) or transaction_id is None:
+        return None
+    return _text(issuer), _text(transaction_id)
+
+
+def _key(issuer, transaction_id):
+    return hashlib.sha1(_text(issuer).encode('utf-8') + '\0' +
+                        _text(transaction_id).encode('utf-8')
+                        ).digest()[:_key_size]
+
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+def _is_postback(typ):
+    return (typ or '').startswith('mozilla/postback/')
+
+
+def _is_chargeback(typ):
+    return (typ or '').startswith('mozilla/chargeback/')
+
+
+def _write_run(entries, directory):
+    entries.sort()
+    run = tempfile.TemporaryFile(dir=directory)
+    run.write(''.join(entries))
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        entry = run.read(_entry.size)
+        if len(entry) < _entry.size:
+            return
+        yield entry
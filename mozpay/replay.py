@@ -0,0 +1,219 @@
+"""
+Replay protection for postbacks and chargebacks.
+
+The Firefox Marketplace retries notices so the same transaction can
+be delivered more than once. Pass a replay cache to
+:func:`mozpay.verify.verify_jwt` (or any of the processor functions)
+and a verified notice that was already seen raises
+:class:`mozpay.exc.DuplicateNotice`.
+
+A notice is recorded as soon as it is verified so that a retry arriving
+while it is still being handled is not handled twice. If handling it
+fails, call :meth:`ReplayCache.forget` so the Marketplace's retry is
+handled again instead of being acknowledged as a duplicate.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows.
+    fcntl = None
+
+from .cache import ExpiringLRU, token_digest
+
+__all__ = ['ReplayCache', 'MemoryReplayCache', 'SharedReplayCache']
+
+# How long to remember notices without an exp claim.
+DEFAULT_TTL = 3600
+
+
+class ReplayCache(object):
+    """
+    The interface for replay cache backends.
+
+    Subclasses only need to implement :meth:`add` and :meth:`delete`.
+    """
+
+    def add(self, key, expires):
+        """
+        Remembers *key* (a byte string) until the *expires* timestamp.
+
+        Returns True if the key was new and False if it had already
+        been added and has not expired yet. This must be atomic.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Forgets *key* if it was added."""
+        raise NotImplementedError
+
+    def seen(self, jwt_data, signed_request):
+        """
+        Records a verified notice and returns True if it was a duplicate.
+
+        A notice is a duplicate when its token or its
+        ``response.transactionID`` (for the same issuer and typ) was
+        already recorded. Both are remembered until the JWT expires.
+        """
+        try:
+            expires = float(jwt_data['exp'])
+        except (KeyError, TypeError, ValueError):
+            expires = time.time() + DEFAULT_TTL
+        duplicate = False
+        response = jwt_data.get('response')
+        if (isinstance(response, dict) and
+                response.get('transactionID') is not None):
+            duplicate = not self.add(transaction_key(jwt_data), expires)
+        if not self.add(token_key(signed_request), expires):
+            duplicate = True
+        return duplicate
+
+    def forget(self, jwt_data, signed_request):
+        """
+        Forgets a notice that :meth:`seen` recorded.
+
+        Call this when handling a notice failed after it was verified so
+        that a retry of it is not treated as a duplicate.
+        """
+        response = jwt_data.get('response')
+        if (isinstance(response, dict) and
+                response.get('transactionID') is not None):
+            self.delete(transaction_key(jwt_data))
+        self.delete(token_key(signed_request))
+
+
+class MemoryReplayCache(ReplayCache):
+    """
+    An in-process replay cache.
+
+    At most *maxsize* keys are kept; the least recently used key is
+    dropped first when it is full.
+    """
+
+    def __init__(self, maxsize=100000):
+        self._cache = ExpiringLRU(maxsize=maxsize)
+
+    def add(self, key, expires):
+        return self._cache.add(key, True, expires)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+
+class SharedReplayCache(ReplayCache):
+    """
+    A replay cache shared by all processes on a host.
+
+    Keys are stored in a fixed-size hash table in the memory-mapped
+    file *path* so that pre-forked server workers (such as gunicorn's)
+    see each other's notices without an external service. Any process
+    that opens the same path shares the table; the file is created on
+    first use.
+
+    The table has *slots* entries split into buckets of *bucket_size*
+    slots. A key is hashed to a bucket and probed linearly within it.
+    Each bucket is protected by its own lock (a POSIX record lock on
+    the bucket's bytes) so inserts into different buckets never
+    contend. When a bucket is full of unexpired keys, the key expiring
+    soonest is replaced so memory use is fixed.
+
+    The *slots* and *bucket_size* of an existing file always win.
+    This needs the :mod:`fcntl` module so it does not work on Windows.
+    """
+    _magic = 'MOZPAYRC'
+    _header = struct.Struct('<8sQQ')  # magic, slots, bucket_size
+    _slot = struct.Struct('<16sd')  # key digest, expiry timestamp
+    _thread_locks = 64
+
+    def __init__(self, path, slots=2 ** 20, bucket_size=16):
+        if fcntl is None:
+            raise NotImplementedError('SharedReplayCache needs fcntl')
+        if slots < bucket_size or slots % bucket_size:
+            raise ValueError('slots must be a multiple of bucket_size')
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.read(self._fd, self._header.size)
+            if len(header) == self._header.size and header.strip('\0'):
+                magic, slots, bucket_size = self._header.unpack(header)
+                if magic != self._magic:
+                    raise ValueError('%r is not a replay cache' % path)
+            else:
+                # A new file, or one whose creator died before writing
+                # the header; the table is all empty slots either way.
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, self._header.pack(self._magic, slots,
+                                                     bucket_size))
+            size = self._header.size + slots * self._slot.size
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self.slots = slots
+        self.bucket_size = bucket_size
+        self._buckets = slots // bucket_size
+        self._map = mmap.mmap(self._fd,
+                              self._header.size + slots * self._slot.size)
+        # Record locks only exclude other processes; threads of this
+        # process are serialized by these.
+        self._locks = [threading.Lock() for i in range(self._thread_locks)]
+
+    def add(self, key, expires):
+        return self._locked(key, self._add, expires, time.time())
+
+    def delete(self, key):
+        self._locked(key, self._delete)
+
+    def _locked(self, key, func, *args):
+        # Calls func(digest, start, *args) with the key's bucket locked.
+        digest = hashlib.md5(key).digest()
+        bucket = struct.unpack_from('<Q', digest)[0] % self._buckets
+        start = self._header.size + (bucket * self.bucket_size *
+                                     self._slot.size)
+        length = self.bucket_size * self._slot.size
+        with self._locks[bucket % self._thread_locks]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                return func(digest, start, *args)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _add(self, digest, start, expires, now):
+        victim = None
+        victim_expires = None
+        for offset in xrange(start, start + self.bucket_size *
+                             self._slot.size, self._slot.size):
+            slot_digest, slot_expires = self._slot.unpack_from(self._map,
+                                                               offset)
+            if slot_digest == digest and slot_expires > now:
+                return False
+            if victim is None or slot_expires < victim_expires:
+                victim, victim_expires = offset, slot_expires
+        self._slot.pack_into(self._map, victim, digest, expires)
+        return True
+
+    def _delete(self, digest, start):
+        for offset in xrange(start, start + self.bucket_size *
+                             self._slot.size, self._slot.size):
+            if self._slot.unpack_from(self._map, offset)[0] == digest:
+                self._slot.pack_into(self._map, offset, '\0' * 16, 0)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def transaction_key(jwt_data):
+    tx = u'%s\n%s\n%s' % (jwt_data.get('iss'), jwt_data.get('typ'),
+                          jwt_data['response']['transactionID'])
+    return 'tx:' + hashlib.sha1(tx.encode('utf-8')).digest()
+
+
+def token_key(signed_request):
+    return 'jwt:' + token_digest(signed_request)
@@ -0,0 +1,270 @@
+"""
+Declarative schemas for the payload of each JWT type.
+
+A schema maps the ``typ`` claim of a JWT to the fields its payload must
+have, each one a dot-separated path like in
+:func:`mozpay.verify.verify_keys`::
+
+    schema = Schema({
+        'mozilla/postback/pay/v1': {
+            'request.pricePoint': Field(int),
+            'request.productData': Field(basestring, required=False),
+            'response.transactionID': Field(basestring),
+        },
+    })
+    schema.validate(jwt_data)
+
+The paths are compiled once into a tree of the payload's keys so that
+validating a payload looks at each value just once.
+"""
+from .cache import FrozenDict
+from .exc import InvalidJWT
+
+__all__ = ['Field', 'Schema', 'PAYMENTS']
+
+# Falsy values that are still present, unlike None, '' or {}.
+_numbers = (int, long, float)
+# The classes json gives values, which fields without a type accept.
+_json_classes = frozenset((dict, FrozenDict, list, tuple, unicode, str, int,
+                           long, float, bool))
+_dict_classes = frozenset((dict, FrozenDict))
+
+
+class Field(object):
+    """
+    What a value in the payload must look like.
+
+    *type* is a type or tuple of types the value must be an instance
+    of; ``int`` also accepts ``long`` but never ``bool``. A *required*
+    value must be present and not None or empty. *choices* lists the
+    allowed values and *check* is a callable that returns False for
+    invalid values.
+    """
+
+    def __init__(self, type=None, required=True, choices=None, check=None):
+        if type is int:
+            type = (int, long)
+        self.type = type
+        self.required = required
+        self.choices = None if choices is None else frozenset(choices)
+        self.check = check
+
+    def __repr__(self):
+        return '<Field type=%r required=%r>' % (self.type, self.required)
+
+
+class Schema(object):
+    """
+    A compiled schema.
+
+    *types* is a dict of ``typ`` claim values to dicts of paths and
+    :class:`Field` objects. Payloads of any other type are rejected
+    unless there is a ``None`` entry for them.
+    """
+
+    def __init__(self, types):
+        self.types = types
+        self._trees = dict((typ, _compile(fields))
+                           for typ, fields in types.items())
+        self._default = self._trees.get(None)
+
+    def __reduce__(self):
+        # Pickle the declaration; the tree is compiled again.
+        return (self.__class__, (self.types,))
+
+    def validate(self, app_req, issuer=None):
+        """
+        Raises :class:`mozpay.exc.InvalidJWT` if *app_req* does not match.
+        """
+        if issuer is None:
+            issuer = app_req.get('iss')
+        typ = app_req.get('typ')
+        try:
+            tree = self._trees.get(typ)
+        except TypeError:  # Unhashable, such as a dict.
+            tree = None
+        if tree is None:
+            tree = self._default
+            if tree is None:
+                raise InvalidJWT('JWT has an unknown typ: %r' % (typ,),
+                                 issuer=issuer)
+        _walk(app_req, tree, issuer)
+
+
+def _compile(fields):
+    """
+    Returns the tree that :func:`_walk` checks *fields* with.
+
+    Paths sharing a prefix share their nodes, so each value is looked up
+    once. Each dict of the payload is checked by a ``(leaves, tested,
+    dicts, nodes)`` tuple:
+
+    - *leaves* are ``(key, classes)`` pairs; a non-empty value whose
+      class is in *classes* is valid.
+    - *tested* are ``(key, classes, test)`` tuples for fields with
+      choices or a check; the value must also pass *test*.
+    - *dicts* are ``(key, tree)`` pairs for the dicts under this one.
+    - *nodes* maps each key to its ``(path, field, required)``.
+
+    Values that fail these quick tests, such as missing values or
+    instances of subclasses, are checked closely by :func:`_check_key`,
+    which raises the right error or lets them pass.
+    """
+    tree = {}
+    for path in sorted(fields):
+        node = tree
+        parts = path.split('.')
+        for depth, part in enumerate(parts):
+            entry = node.setdefault(part, {'children': {}, 'field': None,
+                                           'leaf': path})
+            if depth == len(parts) - 1:
+                entry['field'] = fields[path]
+            node = entry['children']
+    return _tree(tree)
+
+
+def _tree(entries):
+    leaves, tested, dicts, nodes = [], [], [], {}
+    for key, entry in sorted(entries.items()):
+        field = entry['field']
+        children = _tree(entry['children']) if entry['children'] else None
+        nodes[key] = (entry['leaf'], field, _required(entry), children)
+        if children is not None:
+            # A dict with a field of its own is checked closely.
+            dicts.append((key, _dict_classes if field is None
+                          else frozenset(), children))
+        elif field is not None and (field.choices is not None or
+                                    field.check is not None):
+            tested.append((key, _fast_classes(field), _test(field)))
+        else:
+            leaves.append((key, _fast_classes(field)))
+    return tuple(leaves), tuple(tested), tuple(dicts), nodes
+
+
+def _fast_classes(field):
+    # The classes of values that need no closer look. Values of other
+    # classes, such as subclasses, are still checked by _check_key().
+    if field is None or field.type is None:
+        return _json_classes
+    types = field.type if isinstance(field.type, tuple) else (field.type,)
+    classes = set(types)
+    if basestring in classes:
+        classes.update((str, unicode))
+    classes.discard(bool)
+    return frozenset(classes)
+
+
+def _test(field):
+    # Returns a callable that is True for the values *field* allows.
+    choices, check = field.choices, field.check
+    if choices is None:
+        return check
+    if check is None:
+        return lambda value: _is_choice(value, choices)
+    return lambda value: _is_choice(value, choices) and check(value)
+
+
+def _required(entry):
+    if entry['field'] is not None and entry['field'].required:
+        return True
+    return any(_required(child) for child in entry['children'].values())
+
+
+def _walk(value, tree, issuer):
+    leaves, tested, dicts, nodes = tree
+    get = value.get
+    for key, classes in leaves:
+        child = get(key)
+        if child.__class__ not in classes or not child:
+            _check_key(child, key, nodes, issuer)
+    for key, classes, test in tested:
+        child = get(key)
+        if child.__class__ not in classes or not child or not test(child):
+            _check_key(child, key, nodes, issuer)
+    for key, classes, children in dicts:
+        child = get(key)
+        if child.__class__ in classes and child:
+            _walk(child, children, issuer)
+        else:
+            _check_key(child, key, nodes, issuer)
+
+
+def _check_key(value, key, nodes, issuer):
+    path, field, required, children = nodes[key]
+    if not value and (value is None or value.__class__ not in _numbers):
+        if required:
+            _missing(path, key, issuer)
+        return
+    if field is not None:
+        _check_value(value, path, field, issuer)
+    if children is not None:
+        if not isinstance(value, dict):
+            _not_a_dict(path, key, issuer)
+        _walk(value, children, issuer)
+
+
+def _missing(path, key, issuer):
+    raise InvalidJWT('JWT is missing %r: %s is not a valid key'
+                     % (path, key), issuer=issuer)
+
+
+def _not_a_dict(path, key, issuer):
+    raise InvalidJWT('JWT is missing %r: %s is not a dict' % (path, key),
+                     issuer=issuer)
+
+
+def _check_value(value, path, field, issuer):
+    if field.type is not None and (not isinstance(value, field.type) or
+                                   value is True or value is False):
+        raise InvalidJWT('JWT has an invalid %r: expected %s, got %r'
+                         % (path, _type_name(field.type), value),
+                         issuer=issuer)
+    if field.choices is not None and not _is_choice(value, field.choices):
+        raise InvalidJWT('JWT has an invalid %r: %r is not one of %s'
+                         % (path, value, ', '.join(sorted(
+                             repr(c) for c in field.choices))),
+                         issuer=issuer)
+    if field.check is not None and not field.check(value):
+        raise InvalidJWT('JWT has an invalid %r: %r' % (path, value),
+                         issuer=issuer)
+
+
+def _is_choice(value, choices):
+    try:
+        return value in choices
+    except TypeError:  # Unhashable, such as a dict.
+        return False
+
+
+def _type_name(types):
+    if not isinstance(types, tuple):
+        types = (types,)
+    if types == (int, long):
+        return 'int'
+    return ' or '.join(t.__name__ for t in types)
+
+
+def _not_negative(value):
+    return value >= 0
+
+
+_notice = {
+    'iss': Field(basestring),
+    'aud': Field(basestring),
+    'iat': Field((int, long, float)),
+    'exp': Field((int, long, float)),
+    'request.pricePoint': Field(int, check=_not_negative),
+    'request.name': Field(basestring),
+    'request.description': Field(basestring),
+    'request.productData': Field(basestring, required=False),
+    'response.transactionID': Field(basestring),
+}
+
+_chargeback = dict(_notice)
+_chargeback['response.reason'] = Field(basestring)
+
+# Firefox Marketplace postbacks and chargebacks.
+PAYMENTS = Schema({
+    'mozilla/postback/pay/v1': _notice,
+    'mozilla/chargeback/pay/v1': _chargeback,
+})
@@ -0,0 +1,145 @@
+"""
+Compact, read-only results of verifying a notice.
+
+By default the processing functions return the JWT's nested JSON dicts.
+Pass ``as_object=True`` to get a :class:`Transaction` (or a
+:class:`Chargeback`) instead; these take a fraction of the memory, which
+matters when many verified notices are kept around, for example to
+reconcile them in a batch::
+
+    tx = process_postback(signed_request, app_key, app_secret,
+                          as_object=True)
+    print tx.transactionID, tx.pricePoint
+
+Fields other than the core ones are kept in the untouched payload JSON
+(:attr:`Transaction.raw`) and only parsed when :attr:`Transaction.data`
+is read.
+"""
+from . import jsonlib
+from .verify import _payload_bytes
+
+__all__ = ['Transaction', 'Chargeback']
+
+# Claims shared by many notices, such as the issuer, are stored once.
+_shared = {}
+_max_shared = 1024
+
+
+class Transaction(object):
+    """
+    A verified postback.
+
+    The attributes are named like the JWT fields they come from: ``iss``,
+    ``aud``, ``typ``, ``iat`` and ``exp`` from the top level,
+    ``pricePoint``, ``name``, ``description`` and ``productData`` from
+    the request and ``transactionID`` from the response. Missing fields
+    are None. ASCII text is kept as :class:`str` to save memory.
+    """
+    __slots__ = ('raw', 'iss', 'aud', 'typ', 'iat', 'exp', 'pricePoint',
+                 'name', 'description', 'productData', 'transactionID')
+
+    _claims = ('iss', 'aud', 'typ', 'iat', 'exp')
+    _request = ('pricePoint', 'name', 'description', 'productData')
+    _response = ('transactionID',)
+
+    def __init__(self, raw, **fields):
+        set_ = object.__setattr__
+        set_(self, 'raw', raw)
+        for name in self._fields():
+            set_(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError('Unknown fields: %s' % ', '.join(sorted(fields)))
+
+    @classmethod
+    def from_jwt(cls, jwt_data, signed_request=None):
+        """
+        Returns the object for verified *jwt_data*.
+
+        The raw JSON is taken from *signed_request*, the JWT that
+        *jwt_data* was decoded from, or encoded again if that is not
+        given.
+        """
+        if signed_request is not None:
+            raw = _payload_bytes(signed_request)
+        else:
+            raw = jsonlib.dumps(jwt_data)
+        fields = {}
+        for name in cls._claims:
+            fields[name] = _shared_value(jwt_data.get(name))
+        for section, names in (('request', cls._request),
+                               ('response', cls._response)):
+            values = jwt_data.get(section)
+            if not isinstance(values, dict):
+                values = {}
+            for name in names:
+                fields[name] = _compact(values.get(name))
+        return cls(raw, **fields)
+
+    @property
+    def data(self):
+        """The full JWT payload, parsed from :attr:`raw` on every access."""
+        return jsonlib.loads(self.raw)
+
+    def __setattr__(self, name, value=None):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+    def __getstate__(self):
+        return tuple(getattr(self, name)
+                     for name in ('raw',) + self._fields())
+
+    def __setstate__(self, state):
+        for name, value in zip(('raw',) + self._fields(), state):
+            object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and
+                self.__getstate__() == other.__getstate__())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        return '<%s transactionID=%r>' % (self.__class__.__name__,
+                                          self.transactionID)
+
+    @classmethod
+    def _fields(cls):
+        return cls._claims + cls._request + cls._response
+
+
+class Chargeback(Transaction):
+    """
+    A verified chargeback.
+
+    This also has the ``reason`` of the response.
+    """
+    __slots__ = ('reason',)
+
+    _response = ('transactionID', 'reason')
+
+
+def _compact(value):
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    return value
+
+
+def _shared_value(value):
+    value = _compact(value)
+    if not isinstance(value, basestring):
+        return value
+    try:
+        return _shared[value]
+    except KeyError:
+        if len(_shared) >= _max_shared:
+            _shared.clear()
+        _shared[value] = value
+        return value
@@ -4,20 +4,216 @@ Some are specific to Firefox Marketplace payments, others are more generic.
 
 .. _`JWT`: http://openid.net/specs/draft-jones-json-web-token-07.html
 """
-import json
+import binascii
+import calendar
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import re
+import string
 import sys
+import threading
+from datetime import datetime
+from timeit import default_timer as _timer
 
 import jwt
+from jwt.exceptions import InvalidAlgorithmError, InvalidKeyError
+from jwt.utils import base64url_decode
 
-from .exc import InvalidJWT, RequestExpired
+from . import jsonlib
+from .cache import token_digest
+from .exc import DuplicateNotice, InvalidJWT, MalformedJWT, RequestExpired
+from .keyring import _algorithms, Key, Keyring
+from .schema import Schema
+
+
+DEFAULT_REQUIRED_KEYS = ('request.pricePoint',
+                         'request.name',
+                         'request.description',
+                         'response.transactionID')
+
+# Verifiers built by verify_jwt(), keyed by their configuration.
+_verifiers = {}
+_max_cached_verifiers = 64
+_serials = itertools.count()
+
+# Tokens longer than this are rejected before anything else is done.
+MAX_TOKEN_LENGTH = 16384
+
+_token_re = re.compile(r'[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*\Z')
+
+# Tokens can be text or any of these bytes-like types.
+_token_types = (basestring, bytearray, memoryview)
+
+# The segments of a base64url encoded token, matched without copying it.
+_segments_re = re.compile(
+    r'([A-Za-z0-9_-]*)\.([A-Za-z0-9_-]*)\.([A-Za-z0-9_-]*)\Z')
+_b64_alphabet = string.maketrans('-_', '+/')
+
+
+class Verifier(object):
+    """
+    A reusable postback/chargeback JWT verifier.
+
+    All per-configuration setup (the algorithm list, the parsed
+    ``required_keys`` paths, the validators and the prepared secret)
+    is done once when the verifier is created so that calling it only
+    does per-token work::
+
+        verifier = Verifier(app_key, app_secret)
+        data = verifier(signed_request)
+
+    The arguments are the same as for :func:`mozpay.verify.verify_jwt`.
+    """
+
+    def __init__(self, expected_aud, secret, validators=(),
+                 required_keys=DEFAULT_REQUIRED_KEYS, algorithms=None,
+                 replay_cache=None, token_cache=None,
+                 max_length=MAX_TOKEN_LENGTH, metrics=None, schema=None,
+                 audit=None):
+        self.expected_aud = expected_aud
+        self.algorithms = tuple(algorithms or ('HS256',))
+        self.validators = tuple(validators)
+        self.required_keys = tuple(required_keys)
+        self.replay_cache = replay_cache
+        self.token_cache = token_cache
+        self.max_length = max_length
+        self.metrics = metrics
+        self.audit = audit
+        if isinstance(schema, dict):
+            schema = Schema(schema)
+        self.schema = schema
+        self._key_paths = _compile_key_paths(self.required_keys)
+        self._keys = _key(secret, algorithms=self.algorithms)
+        # Keeps this verifier's entries apart in a shared token cache.
+        self._serial = next(_serials)
+
+    def __call__(self, signed_request):
+        if self.audit is not None:
+            return self._audited(signed_request)
+        if self.metrics is not None:
+            return self._measure(signed_request)
+        return self._call(signed_request)
+
+    def forget(self, jwt_data, signed_request):
+        """
+        Forgets a notice this verifier returned, in its replay cache.
+
+        Call this when handling the notice failed so that a retry of it
+        is not rejected as a duplicate.
+        """
+        if self.replay_cache is not None:
+            self.replay_cache.forget(
+                jwt_data, _precheck(signed_request, self.max_length))
+
+    def _audited(self, signed_request):
+        try:
+            if self.metrics is not None:
+                app_req = self._measure(signed_request)
+            else:
+                app_req = self._call(signed_request)
+        except InvalidJWT, exc:
+            self.audit.record(signed_request, getattr(exc, 'jwt_data', None),
+                              outcome=exc.__class__.__name__,
+                              issuer=exc.issuer)
+            raise
+        self.audit.record(signed_request, app_req)
+        return app_req
+
+    def _call(self, signed_request, marks=None):
+        # When measuring, each stage appends a (stage, time) mark.
+        signed_request = _precheck(signed_request, self.max_length)
+        if marks is not None:
+            marks.append(('precheck', _timer()))
+        if self.token_cache is None:
+            app_req = self._verify(signed_request, marks)
+        else:
+            verify = self._verify
+            if marks is not None:
+                verify = lambda signed_request: self._verify(signed_request,
+                                                             marks)
+            app_req = self.token_cache.verify(
+                (self._serial, token_digest(signed_request)),
+                verify, signed_request)
+            if marks is not None and marks[-1][0] == 'precheck':
+                marks.append(('cache', _timer()))
+
+        if self.replay_cache is not None:
+            duplicate = self.replay_cache.seen(app_req, signed_request)
+            if marks is not None:
+                marks.append(('replay', _timer()))
+            if duplicate:
+                raise DuplicateNotice('JWT was already processed',
+                                      issuer=app_req['iss'],
+                                      jwt_data=app_req)
+
+        return app_req
+
+    def _verify(self, signed_request, marks=None):
+        # The token is split and decoded exactly once; every stage below
+        # works on the parsed result.
+        header, app_req, signing_input, signature = _decode(
+            signed_request, algorithms=self.algorithms)
+        issuer = _get_issuer(app_req=app_req)
+        if marks is not None:
+            marks.append(('decode', _timer()))
+        _verify_decoded(header, app_req, signing_input, signature,
+                        self._keys, issuer=issuer,
+                        algorithms=self.algorithms,
+                        expected_aud=self.expected_aud)
+        if marks is not None:
+            marks.append(('signature', _timer()))
+
+        # I think this call can be removed after
+        # https://github.com/jpadilla/pyjwt/issues/121
+        verify_claims(app_req, issuer=issuer)
+        if marks is not None:
+            marks.append(('claims', _timer()))
+
+        if self.schema is not None:
+            self.schema.validate(app_req, issuer=issuer)
+        else:
+            _verify_key_paths(app_req, self._key_paths, issuer)
+        if marks is not None:
+            marks.append(('keys', _timer()))
+
+        for vl in self.validators:
+            vl(app_req)
+        if marks is not None:
+            marks.append(('validators', _timer()))
+
+        return app_req
+
+    def _measure(self, signed_request):
+        marks = [(None, _timer())]
+        outcome = 'error'
+        issuer = None
+        try:
+            app_req = self._call(signed_request, marks)
+            outcome, issuer = 'ok', app_req.get('iss')
+            return app_req
+        except InvalidJWT, exc:
+            outcome, issuer = exc.__class__.__name__, exc.issuer
+            raise
+        finally:
+            end = _timer()
+            metrics = self.metrics
+            for (_, start), (stage, stop) in zip(marks, marks[1:]):
+                metrics.timing('stage.' + stage, stop - start)
+            metrics.timing('verify', end - marks[0][1])
+            metrics.incr('outcome', tags={'outcome': outcome,
+                                          'issuer': issuer or ''})
+            try:
+                metrics.histogram('token_size', len(signed_request))
+            except TypeError:
+                pass
 
 
 def verify_jwt(signed_request, expected_aud, secret, validators=[],
-               required_keys=('request.pricePoint',
-                              'request.name',
-                              'request.description',
-                              'response.transactionID'),
-               algorithms=None):
+               required_keys=DEFAULT_REQUIRED_KEYS, algorithms=None,
+               replay_cache=None, token_cache=None,
+               max_length=MAX_TOKEN_LENGTH, metrics=None, schema=None,
+               audit=None):
     """
     Verifies a postback/chargeback JWT.
 
@@ -33,7 +229,9 @@ def verify_jwt(signed_request, expected_aud, secret, validators=[],
     Arguments:
 
     **signed_request**
-        JWT byte string.
+        JWT byte string. It can also be unicode, a :class:`bytearray` or
+        a :class:`memoryview`; a :class:`str` or :class:`bytearray` is
+        read without being copied.
 
     **expected_aud**
         The expected value for the aud (audience) of the JWT.
@@ -42,6 +240,9 @@ def verify_jwt(signed_request, expected_aud, secret, validators=[],
     **secret**
         A shared secret to validate the JWT with.
         See :func:`mozpay.verify.verify_sig`.
+        This can also be a :class:`mozpay.keyring.Keyring` to pick the
+        secret by the JWT's audience, issuer and key ID. In that case
+        *expected_aud* can be None to accept the audience of any key.
 
     **validators**
         A list of extra callables. Each one is passed a JSON Python dict
@@ -55,23 +256,205 @@ def verify_jwt(signed_request, expected_aud, secret, validators=[],
         A list of valid JWT algorithms to accept.
         By default this will only include HS256 because that's
         what the Firefox Marketplace uses.
+
+    **replay_cache**
+        An optional :class:`mozpay.replay.ReplayCache`. When given, a
+        notice that passed all checks but was already seen raises
+        :class:`mozpay.exc.DuplicateNotice`.
+
+    **token_cache**
+        An optional :class:`mozpay.cache.TokenCache` to remember the
+        outcome of verifying each token. The data is then returned
+        as a read-only dict.
+
+    **max_length**
+        Longer tokens are rejected right away.
+
+    **metrics**
+        An optional :class:`mozpay.metrics.Sink` to receive timings of
+        each verification stage, outcome counts and token sizes.
+
+    **schema**
+        An optional :class:`mozpay.schema.Schema` (or the dict to build
+        one from) to validate the payload by its typ claim. When given,
+        it is checked instead of *required_keys*. See
+        :data:`mozpay.schema.PAYMENTS`.
+
+    **audit**
+        An optional :class:`mozpay.audit.AuditLog` to record the outcome
+        of each notice in.
+
+    Tokens that are structurally invalid (too long, not three
+    base64url segments or with a disallowed header alg) are rejected
+    before any decoding with a :class:`mozpay.exc.MalformedJWT`.
+
+    This is a shortcut for calling a :class:`mozpay.verify.Verifier`;
+    verifiers are cached per configuration so repeated calls with the
+    same arguments only do per-token work.
+    """
+    verifier = _get_verifier(expected_aud, secret, validators=validators,
+                             required_keys=required_keys,
+                             algorithms=algorithms,
+                             replay_cache=replay_cache,
+                             token_cache=token_cache,
+                             max_length=max_length,
+                             metrics=metrics,
+                             schema=schema,
+                             audit=audit)
+    return verifier(signed_request)
+
+
+def _get_verifier(expected_aud, secret, **kw):
+    schema = kw.get('schema')
+    key_kw = kw
+    if isinstance(schema, dict):
+        # A schema dict is keyed by its id. The cached verifier's Schema
+        # holds on to the dict, so the id is not reused while it is
+        # cached, and a hit must be for that very dict.
+        key_kw = dict(kw, schema=('dict', id(schema)))
+    try:
+        cache_key = (expected_aud, secret,
+                     tuple(sorted((name, tuple(val)
+                                   if isinstance(val, list) else val)
+                                  for name, val in key_kw.items())))
+        verifier = _verifiers.get(cache_key)
+    except TypeError:
+        # Unhashable arguments; these just don't get cached.
+        cache_key = verifier = None
+    if (verifier is not None and isinstance(schema, dict) and
+            verifier.schema.types is not schema):
+        verifier = None
+    if verifier is None:
+        verifier = Verifier(expected_aud, secret, **kw)
+        if cache_key is not None:
+            if len(_verifiers) >= _max_cached_verifiers:
+                _verifiers.clear()
+            _verifiers[cache_key] = verifier
+    return verifier
+
+
+def verify_many(tokens, expected_aud, secret, ordered=True, processes=None,
+                backend='process', chunksize=64, **kw):
     """
-    if not algorithms:
-        algorithms = ['HS256']
-    issuer = _get_issuer(signed_request=signed_request)
-    app_req = verify_sig(signed_request, secret, issuer=issuer,
-                         algorithms=algorithms, expected_aud=expected_aud)
+    Verifies an iterable of postback/chargeback JWTs.
 
-    # I think this call can be removed after
-    # https://github.com/jpadilla/pyjwt/issues/121
-    verify_claims(app_req, issuer=issuer)
+    This yields a ``(token, result)`` pair for each token where
+    *result* is either the trusted JSON data (as returned by
+    :func:`mozpay.verify.verify_jwt`) or the
+    :class:`mozpay.exc.InvalidJWT` exception that was raised for it.
+    Any other exception stops the iteration.
 
-    verify_keys(app_req, required_keys, issuer=issuer)
+    Tokens are read lazily and only a bounded number of chunks are in
+    flight at once so this can be used on very large streams.
 
-    for vl in validators:
-        vl(app_req)
+    Arguments:
+
+    **tokens**
+        An iterable of JWT byte strings.
+
+    **expected_aud**, **secret**
+        See :func:`mozpay.verify.verify_jwt`.
+
+    **ordered**
+        When True (the default) results are yielded in the same order as
+        *tokens*. When False, results are yielded as soon as each
+        chunk is done which keeps all workers busy.
+
+    **processes**
+        The number of workers. Defaults to the number of CPUs.
+        Pass 0 to verify in the current process without a pool.
+
+    **backend**
+        Either ``'process'`` (the default) to spread work across CPU
+        cores or ``'thread'``. With the process backend any validators
+        must be picklable, such as module level functions.
+
+    **chunksize**
+        How many tokens are sent to a worker at once. Larger chunks
+        lower the inter-process overhead.
+
+    All other keyword arguments are passed to
+    :class:`mozpay.verify.Verifier`.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    chunks = _chunked(tokens, chunksize)
+    if not processes:
+        verifier = Verifier(expected_aud, secret, **kw)
+        for chunk in chunks:
+            for item in _verify_chunk(chunk, verifier):
+                yield item
+        return
+
+    if backend == 'process':
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (expected_aud, secret, kw))
+        verify_chunk = _verify_chunk
+    elif backend == 'thread':
+        pool = ThreadPool(processes)
+        verifier = Verifier(expected_aud, secret, **kw)
+        verify_chunk = lambda chunk: _verify_chunk(chunk, verifier)
+    else:
+        raise ValueError('Unknown backend: %r' % backend)
+
+    # Chunks are fed to the pool lazily; a chunk is only handed over
+    # once a slot frees up so memory use stays bounded.
+    slots = threading.Semaphore(processes * 2)
+    stopped = []
+
+    def feed():
+        for chunk in chunks:
+            slots.acquire()
+            if stopped:
+                return
+            yield chunk
+
+    try:
+        if ordered:
+            results = pool.imap(verify_chunk, feed())
+        else:
+            results = pool.imap_unordered(verify_chunk, feed())
+        for chunk_results in results:
+            slots.release()
+            for item in chunk_results:
+                yield item
+        pool.close()
+    finally:
+        stopped.append(True)
+        slots.release()
+        pool.terminate()
+
+
+# The verifier of a verify_many() worker process.
+_worker_verifier = None
+
+
+def _init_worker(expected_aud, secret, kw):
+    global _worker_verifier
+    _worker_verifier = Verifier(expected_aud, secret, **kw)
+
+
+def _verify_chunk(chunk, verifier=None):
+    if verifier is None:
+        verifier = _worker_verifier
+    results = []
+    for token in chunk:
+        try:
+            results.append((token, verifier(token)))
+        except InvalidJWT, exc:
+            results.append((token, exc))
+    return results
 
-    return app_req
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def verify_claims(app_req, issuer=None):
@@ -136,10 +519,20 @@ def verify_keys(app_req, required_keys, issuer=None):
     """
     if not issuer:
         issuer = _get_issuer(app_req=app_req)
+    return _verify_key_paths(app_req, _compile_key_paths(required_keys),
+                             issuer)
+
+
+def _compile_key_paths(required_keys):
+    return [(key_path, tuple(key_path.split('.')))
+            for key_path in required_keys]
+
+
+def _verify_key_paths(app_req, key_paths, issuer):
     key_vals = []
-    for key_path in required_keys:
+    for key_path, parts in key_paths:
         parent = app_req
-        for kp in key_path.split('.'):
+        for kp in parts:
             if not isinstance(parent, dict):
                 raise InvalidJWT('JWT is missing %r: %s is not a dict'
                                  % (key_path, kp), issuer=issuer)
@@ -160,41 +553,222 @@ def verify_sig(signed_request, secret, issuer=None, algorithms=None,
     Given a raw JWT, this verifies it was signed with
     *secret*, decodes it, and returns the JSON dict.
     """
+    header, app_req, signing_input, signature = _decode(signed_request)
     if not issuer:
-        issuer = _get_issuer(signed_request=signed_request)
-    signed_request = _to_bytes(signed_request)
-    app_req = _get_json(signed_request)
+        issuer = _get_issuer(app_req=app_req)
+    _verify_decoded(header, app_req, signing_input, signature,
+                    _key(secret),
+                    issuer=issuer, algorithms=algorithms,
+                    expected_aud=expected_aud)
+    return app_req
 
-    # Check signature.
+
+def _verify_decoded(header, app_req, signing_input, signature, keys,
+                    issuer=None, algorithms=None, expected_aud=None):
+    """
+    Check the signature and registered claims of an already decoded JWT.
+
+    This mirrors what ``jwt.decode(verify=True)`` does but without
+    splitting and parsing the token again.
+    """
     try:
-        jwt.decode(signed_request, secret, verify=True,
-                   algorithms=algorithms, audience=expected_aud)
+        _check_signature(header, app_req, signing_input, signature, keys,
+                         algorithms=algorithms, audience=expected_aud)
     except jwt.ExpiredSignatureError, exc:
         _re_raise_as(RequestExpired, '%s' % exc, issuer=issuer)
     except jwt.InvalidTokenError, exc:
         _re_raise_as(InvalidJWT,
                      'Signature verification failed: %s' % exc,
                      issuer=issuer)
-    return app_req
 
 
-def _get_json(signed_request):
-    signed_request = _to_bytes(signed_request)
-    try:
-        app_req = jwt.decode(signed_request, verify=False)
-    except jwt.DecodeError, exc:
-        _re_raise_as(InvalidJWT, 'Invalid JWT: %s' % exc)
-    if not isinstance(app_req, dict):
+def _check_signature(header, payload, signing_input, signature, keys,
+                     algorithms=None, audience=None):
+    # Raises the same PyJWT exceptions (and messages) as jwt.decode().
+    alg = header.get('alg')
+    if algorithms is not None and alg not in algorithms:
+        raise InvalidAlgorithmError(
+            'The specified alg value is not allowed')
+    if alg not in _algorithms:
+        raise InvalidAlgorithmError('Algorithm not supported')
+    if isinstance(keys, Keyring):
+        candidates = keys.find(aud=payload.get('aud'),
+                               iss=payload.get('iss'),
+                               kid=header.get('kid'))
+        if not candidates:
+            raise jwt.DecodeError('No key found for aud=%r, kid=%r'
+                                  % (payload.get('aud'), header.get('kid')))
+    else:
+        candidates = (keys,)
+    for key in candidates:
         try:
-            app_req = json.loads(app_req)
-        except ValueError, exc:
-            _re_raise_as(InvalidJWT,
-                         'Invalid JSON for JWT: %s' % exc)
-    return app_req
+            if key.verify(alg, signing_input, signature):
+                break
+        except (InvalidKeyError, TypeError, ValueError):
+            if not isinstance(keys, Keyring):
+                raise
+            # A keyring can mix key types, such as RSA keys and secrets.
+    else:
+        raise jwt.DecodeError('Signature verification failed')
+    if audience is None and isinstance(keys, Keyring):
+        # The keyring already matched the audience.
+        audience = key.aud
+        if audience is None:
+            audience = payload.get('aud')
+            if isinstance(audience, list) and audience:
+                audience = audience[0]
+
+    now = calendar.timegm(datetime.utcnow().utctimetuple())
+    if 'nbf' in payload and payload['nbf'] > now:
+        raise jwt.ExpiredSignatureError('Signature not yet valid')
+    if 'exp' in payload and payload['exp'] < now:
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+    if 'aud' in payload:
+        audience_claims = payload['aud']
+        if isinstance(audience_claims, basestring):
+            audience_claims = [audience_claims]
+        if (not isinstance(audience_claims, list) or
+                any(not isinstance(c, basestring) for c in audience_claims)):
+            raise jwt.InvalidAudienceError('Invalid claim format in token')
+        if audience not in audience_claims:
+            raise jwt.InvalidAudienceError('Invalid audience')
+    elif audience is not None:
+        raise jwt.InvalidAudienceError('No audience claim in token')
+
+
+def _key(secret, algorithms=()):
+    """Returns a Key or a Keyring for the *secret* argument."""
+    if isinstance(secret, (Key, Keyring)):
+        return secret
+    return Key(secret, algorithms=algorithms)
+
+
+def _precheck(signed_request, max_length=MAX_TOKEN_LENGTH):
+    """
+    Cheaply reject tokens that cannot possibly be valid.
+
+    This looks at the raw token only, nothing is decoded. Returns the
+    token as bytes; :class:`str` and :class:`bytearray` tokens are
+    returned as they are.
+    """
+    if not isinstance(signed_request, _token_types):
+        raise MalformedJWT('Invalid JWT: expected a string, got %r'
+                           % type(signed_request), reason='alphabet')
+    if len(signed_request) > max_length:
+        raise MalformedJWT('Invalid JWT: longer than %d characters'
+                           % max_length, reason='too-long')
+    if isinstance(signed_request, memoryview):
+        # Neither re nor str methods can read a memoryview in Python 2.
+        signed_request = signed_request.tobytes()
+    dots = signed_request.count('.')
+    if dots < 2:
+        raise MalformedJWT('Invalid JWT: Not enough segments',
+                           reason='segments')
+    if dots > 2:
+        raise MalformedJWT('Invalid JWT: Too many segments',
+                           reason='segments')
+    if not _token_re.match(signed_request):
+        raise MalformedJWT('Invalid JWT: not base64url encoded',
+                           reason='alphabet')
+    if isinstance(signed_request, unicode):
+        return str(signed_request)  # Only ASCII is left.
+    return signed_request
+
+
+def _decode(signed_request, algorithms=None):
+    """
+    Split a raw JWT and decode its segments in a single pass.
+
+    If a list of *algorithms* is given, a token whose header alg
+    is not in that list is rejected before the payload is decoded.
+
+    Returns a tuple of (header, payload, signing_input, signature).
+    The signing input is a :class:`buffer` over the token.
+    """
+    token = _to_bytes(signed_request)
+    match = _segments_re.match(token)
+    if match is not None:
+        # The token is copied once, to the standard base64 alphabet, and
+        # the segments are decoded from there in place.
+        b64 = token.translate(_b64_alphabet)
+        signing_input = buffer(token, 0, match.end(2))
+        segments = match.span(1), match.span(2), match.span(3)
+    else:
+        # Other characters are skipped while decoding, the way PyJWT
+        # does it, which needs the segments as strings.
+        b64 = None
+        try:
+            signing_input, crypto_segment = token.rsplit('.', 1)
+            header_segment, payload_segment = signing_input.split('.', 1)
+        except ValueError:
+            raise MalformedJWT('Invalid JWT: Not enough segments',
+                               reason='segments')
+        segments = header_segment, payload_segment, crypto_segment
+    header = _decode_segment(b64, segments[0], 'header')
+    if algorithms is not None and header.get('alg') not in algorithms:
+        raise MalformedJWT('Invalid JWT: alg %r is not allowed'
+                           % header.get('alg'), reason='alg')
+    app_req = _decode_segment(b64, segments[1], 'payload')
+    signature = _b64decode(b64, segments[2], 'crypto')
+    return header, app_req, signing_input, signature
+
+
+def _decode_segment(b64, segment, name):
+    data = _b64decode(b64, segment, name)
+    try:
+        obj = jsonlib.loads(data)
+    except ValueError, exc:
+        _re_raise_as(MalformedJWT,
+                     'Invalid JWT: Invalid %s string: %s' % (name, exc),
+                     reason='decode')
+    if not isinstance(obj, dict):
+        raise MalformedJWT('Invalid JWT: Invalid %s string: '
+                           'must be a json object' % name, reason='decode')
+    return obj
+
+
+def _b64decode(b64, segment, name):
+    """
+    Decode a segment, given by its (start, end) offsets in *b64*.
+
+    Without *b64*, the segment is a base64url encoded string.
+    """
+    try:
+        if b64 is None:
+            return base64url_decode(segment)
+        start, end = segment
+        # binascii only takes padded input, so just the last one to
+        # three characters are copied to be padded.
+        tail = end - (end - start) % 4
+        data = binascii.a2b_base64(buffer(b64, start, tail - start))
+        if tail < end:
+            data += binascii.a2b_base64(b64[tail:end] +
+                                        '=' * (4 - (end - tail)))
+        return data
+    except (TypeError, binascii.Error):
+        _re_raise_as(MalformedJWT, 'Invalid JWT: Invalid %s padding' % name,
+                     reason='decode')
+
+
+def _payload_bytes(signed_request):
+    """Returns the base64url decoded payload of a token."""
+    token = _to_bytes(signed_request)
+    match = _segments_re.match(token)
+    if match is None:
+        return _b64decode(None, token.rsplit('.', 1)[0].split('.', 1)[1],
+                          'payload')
+    start, end = match.span(2)
+    return _b64decode(token[start:end].translate(_b64_alphabet),
+                      (0, end - start), 'payload')
+
+
+def _get_json(signed_request):
+    return _decode(signed_request)[1]
 
 
 def _get_issuer(signed_request=None, app_req=None):
-    if not app_req:
+    if app_req is None:
         if not signed_request:
             raise TypeError('need either signed_request or app_req')
         app_req = _get_json(signed_request)
@@ -207,8 +781,13 @@ def _get_issuer(signed_request=None, app_req=None):
 
 
 def _to_bytes(signed_request):
+    # The token must be base64 encoded bytes.
+    if isinstance(signed_request, (str, bytearray)):
+        return signed_request
+    if isinstance(signed_request, memoryview):
+        return signed_request.tobytes()
     try:
-        return str(signed_request)  # must be base64 encoded bytes
+        return str(signed_request)
     except UnicodeEncodeError, exc:
         _re_raise_as(InvalidJWT,
                      'Non-ascii payment JWT: %s' % exc)
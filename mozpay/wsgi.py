@@ -0,0 +1,137 @@
+"""
+A WSGI app that receives postbacks and chargebacks without Django.
+
+It behaves like the views of :mod:`mozpay.djangoapp`::
+
+    from mozpay.wsgi import PostbackApp
+
+    app = PostbackApp(app_key, app_secret)
+
+    @app.on_postback
+    def postback(environ, jwt_data):
+        ...
+
+POST a ``notice`` form field to any URL ending in ``/postback`` or
+``/chargeback``. A valid notice is answered with its transaction ID and
+the registered callbacks are called; otherwise a 400 is returned.
+"""
+import logging
+import urllib
+
+from .exc import DuplicateNotice, InvalidJWT
+from .processor import _validate_chargeback
+from .verify import Verifier
+
+__all__ = ['PostbackApp']
+
+log = logging.getLogger(__name__)
+
+# Notices are around a kilobyte.
+DEFAULT_MAX_BODY = 64 * 1024
+
+
+class PostbackApp(object):
+    """
+    A WSGI app for postback and chargeback notices.
+
+    Arguments:
+
+    **key**, **secret**
+        Your application key and secret from the Firefox Marketplace.
+
+    **max_body**
+        Requests with a larger body are rejected with a 413 without
+        reading the body.
+
+    All other keyword arguments are passed to
+    :class:`mozpay.verify.Verifier`, for example a ``replay_cache``.
+    Duplicates are answered with their transaction ID without calling
+    the callbacks.
+    """
+
+    def __init__(self, key, secret, max_body=DEFAULT_MAX_BODY, **kw):
+        self.max_body = max_body
+        self.postback_callbacks = []
+        self.chargeback_callbacks = []
+        chargeback_kw = dict(kw)
+        if kw.get('schema') is None:
+            # A schema already requires the reason.
+            chargeback_kw.setdefault('validators', [_validate_chargeback])
+        self._routes = {
+            'postback': (Verifier(key, secret, **kw),
+                         self.postback_callbacks),
+            'chargeback': (Verifier(key, secret, **chargeback_kw),
+                           self.chargeback_callbacks),
+        }
+
+    def on_postback(self, callback):
+        """
+        Registers ``callback(environ, jwt_data)`` for valid postbacks.
+
+        This returns *callback* so it can be used as a decorator.
+        """
+        self.postback_callbacks.append(callback)
+        return callback
+
+    def on_chargeback(self, callback):
+        """
+        Registers ``callback(environ, jwt_data)`` for valid chargebacks.
+        """
+        self.chargeback_callbacks.append(callback)
+        return callback
+
+    def __call__(self, environ, start_response):
+        name = environ.get('PATH_INFO', '').rstrip('/').rsplit('/', 1)[-1]
+        if name not in self._routes:
+            return _respond(start_response, '404 Not Found')
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return _respond(start_response, '405 Method Not Allowed',
+                            headers=[('Allow', 'POST')])
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > self.max_body:
+            return _respond(start_response,
+                            '413 Request Entity Too Large')
+        notice = _form_field(environ['wsgi.input'].read(length), 'notice')
+        if notice is None:
+            log.error('%s without a notice' % name)
+            return _respond(start_response, '400 Bad Request')
+
+        verifier, callbacks = self._routes[name]
+        try:
+            data = verifier(notice)
+        except DuplicateNotice, exc:
+            log.info('duplicate %s: %s' % (name, exc))
+            return _respond(start_response, '200 OK',
+                            str(exc.jwt_data['response']['transactionID']))
+        except InvalidJWT:
+            log.exception('in %s' % name)
+            return _respond(start_response, '400 Bad Request')
+        try:
+            for callback in callbacks:
+                callback(environ, data)
+        except:
+            # The Marketplace retries the notice, which must not be
+            # taken for a duplicate.
+            verifier.forget(data, notice)
+            raise
+        return _respond(start_response, '200 OK',
+                        str(data['response']['transactionID']))
+
+
+def _form_field(body, name):
+    # Only the field we need is unquoted.
+    prefix = name + '='
+    for field in body.split('&'):
+        if field.startswith(prefix):
+            return urllib.unquote_plus(field[len(prefix):])
+    return None
+
+
+def _respond(start_response, status, body='', headers=()):
+    start_response(status, [('Content-Type', 'text/plain'),
+                            ('Content-Length', str(len(body)))] +
+                   list(headers))
+    return [body]
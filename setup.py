@@ -13,8 +13,9 @@ setup(name='mozpay',
       url='https://github.com/mozilla/mozpay-py',
       include_package_data=True,
       classifiers=[],
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       install_requires=[ln.strip() for ln in
                         open(os.path.join(os.path.dirname(__file__),
                                           'requirements.txt'))
-                        if not ln.startswith('#')])
+                        if not ln.startswith('#')],
+      extras_require={'crypto': ['cryptography']})
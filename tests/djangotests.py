@@ -0,0 +1,44 @@
+"""Helpers for testing the Django views without a Django project."""
+from django.conf import settings
+if not settings.configured:
+    settings.configure(
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mozpay.djangoapp import signals, views
+from mozpay.metrics import MemorySink
+
+from . import JWTtester
+
+
+class ViewTester(JWTtester):
+    """Posts notices to the views with the settings of :meth:`settings`."""
+
+    def setUp(self):
+        super(ViewTester, self).setUp()
+        views._settings_objects.clear()  # Objects built from settings.
+        self.sink = MemorySink()
+        self.received = []
+        signals.moz_inapp_postback.connect(self.receive)
+        self.addCleanup(signals.moz_inapp_postback.disconnect, self.receive)
+        overrides = override_settings(MOZ_APP_KEY=self.key,
+                                      MOZ_APP_SECRET=self.secret,
+                                      MOZ_METRICS=self.sink,
+                                      **self.settings())
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def settings(self):
+        return {}
+
+    def receive(self, request, jwt_data, **kw):
+        self.received.append(jwt_data)
+
+    def post(self, notice, **extra):
+        request = RequestFactory().post(
+            '/postback', 'notice=' + notice,
+            content_type='application/x-www-form-urlencoded', **extra)
+        return views.postback(request)
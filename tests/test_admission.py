@@ -0,0 +1,140 @@
+import threading
+
+from nose.tools import eq_, raises
+
+from mozpay.admission import Admission, Overloaded, TokenBucket
+
+from . import JWTtester
+from .djangotests import ViewTester
+
+
+def outcome(admission, source, now):
+    try:
+        admission.admit(source, now=now)
+    except Overloaded, exc:
+        return exc.reason
+    return 'ok'
+
+
+class TestTokenBucket(JWTtester):
+
+    def test_take(self):
+        bucket = TokenBucket(10, burst=2, now=0)
+        eq_(bucket.take(now=0), 0)
+        eq_(bucket.take(now=0), 0)
+        eq_(bucket.take(now=0), 0.1)
+        eq_(bucket.take(now=0.1), 0)
+
+    def test_burst_is_bounded(self):
+        bucket = TokenBucket(10, burst=2, now=0)
+        eq_(bucket.take(2, now=100), 0)
+        eq_(bucket.take(now=100), 0.1)
+
+    def test_penalize(self):
+        bucket = TokenBucket(10, burst=2, now=0)
+        bucket.penalize(100, now=0)
+        eq_(bucket.take(now=0), 0.3)  # The debt is at most the burst.
+        eq_(bucket.full_in(now=0), 0.4)
+
+    @raises(ValueError)
+    def test_rate(self):
+        TokenBucket(0)
+
+
+class TestAdmission(JWTtester):
+
+    def test_source(self):
+        admission = Admission(source_rate=1, source_burst=2)
+        eq_([outcome(admission, 'a', 0) for i in range(3)],
+            ['ok', 'ok', 'source'])
+        eq_(outcome(admission, 'b', 0), 'ok')
+        eq_(outcome(admission, 'a', 1), 'ok')
+
+    def test_global(self):
+        admission = Admission(rate=1, burst=2)
+        eq_([outcome(admission, source, 0) for source in 'abc'],
+            ['ok', 'ok', 'global'])
+
+    def test_penalty(self):
+        admission = Admission(source_rate=1, source_burst=5, penalty=10)
+        eq_(outcome(admission, 'a', 0), 'ok')
+        admission.penalize('a', now=0)
+        # 1 - 10 tokens, but the debt is at most the burst.
+        eq_(outcome(admission, 'a', 5), 'source')
+        eq_(outcome(admission, 'a', 6), 'ok')
+        eq_(outcome(admission, 'b', 0), 'ok')
+
+    def test_retry_after(self):
+        admission = Admission(source_rate=2, source_burst=1)
+        admission.admit('a', now=0)
+        try:
+            admission.admit('a', now=0)
+        except Overloaded, exc:
+            eq_(exc.retry_after, 0.5)
+        else:
+            raise AssertionError('Overloaded was not raised')
+
+    def test_concurrency(self):
+        admission = Admission(max_concurrent=2)
+        admission.enter()
+        admission.enter()
+        with self.assertRaises(Overloaded):
+            admission.enter()
+        admission.leave()
+        admission.enter()
+
+    def test_threads(self):
+        admission = Admission(rate=100, source_rate=100, source_burst=50)
+        admitted = []
+
+        def admit():
+            for i in range(20):
+                if outcome(admission, 'a', 0) == 'ok':
+                    admitted.append(1)
+
+        threads = [threading.Thread(target=admit) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(len(admitted), 50)
+
+    def test_no_limits(self):
+        admission = Admission()
+        for i in range(100):
+            eq_(outcome(admission, None, 0), 'ok')
+        admission.enter()
+
+
+class TestViews(ViewTester):
+
+    def settings(self):
+        return {'MOZ_ADMISSION_SOURCE_RATE': 1,
+                'MOZ_ADMISSION_SOURCE_BURST': 2,
+                'MOZ_ADMISSION_PENALTY': 5}
+
+    def test_shed(self):
+        eq_(self.post(str(self.request())).status_code, 200)
+        eq_(self.post(str(self.request())).status_code, 200)
+        response = self.post(str(self.request()))
+        eq_(response.status_code, 503)
+        eq_(response['Retry-After'], '1')
+        eq_(self.sink.counters[('overloaded', (('reason', 'source'),
+                                               ('view', 'postback')))], 1)
+
+    def test_penalty(self):
+        eq_(self.post(str(self.request(app_secret='wrong'))).status_code,
+            400)
+        response = self.post(str(self.request()))
+        eq_(response.status_code, 503)
+        eq_(response['Retry-After'], '3')  # From a debt of 2 tokens to 1.
+        eq_(self.received, [])
+
+    def test_forged_issuer(self):
+        # Junk claiming to be from the Marketplace does not lock it out.
+        forged = str(self.request(app_secret='wrong'))
+        for i in range(10):
+            self.post(forged, REMOTE_ADDR='192.0.2.1')
+        eq_(self.post(forged, REMOTE_ADDR='192.0.2.1').status_code, 503)
+        eq_(self.post(str(self.request())).status_code, 200)
+        eq_(len(self.received), 1)
@@ -0,0 +1,207 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+
+from jwt.exceptions import InvalidKeyError
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises, eq_
+
+import mozpay
+from mozpay import InvalidJWT
+from mozpay import keyring
+from mozpay.keyring import Key, Keyring
+from mozpay.verify import verify_jwt
+
+from . import JWTtester
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+except ImportError:
+    rsa = None
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).replace('=', '')
+
+
+def b64_int(value):
+    data = '%x' % value
+    return b64(binascii.unhexlify('0' * (len(data) % 2) + data))
+
+
+def oct_jwk(secret, **kw):
+    jwk = {'kty': 'oct', 'k': b64(secret)}
+    jwk.update(kw)
+    return jwk
+
+
+class TestJWK(JWTtester):
+
+    def setUp(self):
+        super(TestJWK, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'jwks.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, keys):
+        with open(self.path, 'w') as fp:
+            json.dump({'keys': keys}, fp)
+
+    def test_oct(self):
+        key = Key(oct_jwk(self.secret))
+        data = mozpay.process_postback(self.request(), self.key, key)
+        eq_(data['aud'], self.key)
+
+    def test_oct_wrong_secret(self):
+        key = Key(oct_jwk('wrong'))
+        with assert_raises(InvalidJWT):
+            mozpay.process_postback(self.request(), self.key, key)
+
+    def test_from_jwk_kid(self):
+        eq_(Key.from_jwk(oct_jwk(self.secret, kid='one')).kid, 'one')
+        eq_(Key.from_jwk(oct_jwk(self.secret, kid='one'), kid='two').kid,
+            'two')
+
+    def test_jwks_file(self):
+        self.write([oct_jwk('other', kid='other'),
+                    oct_jwk(self.secret, kid='mine', aud=self.key)])
+        ring = Keyring.from_file(self.path)
+        eq_(len(ring), 2)
+        eq_(ring.find(aud=self.key, kid='mine')[0].aud, self.key)
+        request = self.request(encode_kwargs={'headers': {'kid': 'mine'}})
+        eq_(mozpay.process_postback(request, self.key, ring)['aud'],
+            self.key)
+
+    def test_unknown_kty(self):
+        self.write([{'kty': 'nope', 'kid': 'one'}])
+        ring = Keyring.from_file(self.path)
+        with assert_raises(InvalidJWT):
+            mozpay.process_postback(self.request(), self.key, ring)
+
+    def test_mixed_keyring(self):
+        # The RSA key cannot check an HS256 token but the secret can.
+        ring = Keyring()
+        ring.add({'kty': 'RSA', 'n': 'AQAB', 'e': 'AQAB'}, aud=self.key)
+        ring.add(self.secret, aud=self.key)
+        eq_(mozpay.process_postback(self.request(), self.key, ring)['aud'],
+            self.key)
+
+
+class TestAsymmetric(JWTtester):
+
+    def setUp(self):
+        super(TestAsymmetric, self).setUp()
+        if rsa is None:
+            raise SkipTest('cryptography is not installed')
+        self.rsa_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend())
+        self.ec_key = ec.generate_private_key(ec.SECP256R1(),
+                                              default_backend())
+
+    def private_pem(self, key):
+        return key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption())
+
+    def public_pem(self, key):
+        return key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def jwk(self, key):
+        numbers = key.public_key().public_numbers()
+        if isinstance(key, rsa.RSAPrivateKey):
+            return {'kty': 'RSA', 'n': b64_int(numbers.n),
+                    'e': b64_int(numbers.e)}
+        return {'kty': 'EC', 'crv': 'P-256', 'x': b64_int(numbers.x),
+                'y': b64_int(numbers.y)}
+
+    def signed(self, key, alg):
+        return self.request(app_secret=self.private_pem(key),
+                            encode_kwargs={'algorithm': alg})
+
+    def verify(self, request, secret, alg):
+        return verify_jwt(request, self.key, secret, algorithms=[alg])
+
+    def test_rsa_pem(self):
+        request = self.signed(self.rsa_key, 'RS256')
+        secret = self.public_pem(self.rsa_key)
+        eq_(self.verify(request, secret, 'RS256')['aud'], self.key)
+
+    def test_ec_pem(self):
+        request = self.signed(self.ec_key, 'ES256')
+        secret = self.public_pem(self.ec_key)
+        eq_(self.verify(request, secret, 'ES256')['aud'], self.key)
+
+    def test_rsa_jwk(self):
+        request = self.signed(self.rsa_key, 'RS256')
+        key = Key(self.jwk(self.rsa_key))
+        eq_(self.verify(request, key, 'RS256')['aud'], self.key)
+
+    def test_ec_jwk(self):
+        request = self.signed(self.ec_key, 'ES256')
+        key = Key(self.jwk(self.ec_key))
+        eq_(self.verify(request, key, 'ES256')['aud'], self.key)
+
+    def test_wrong_key(self):
+        other = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend())
+        request = self.signed(other, 'RS256')
+        with assert_raises(InvalidJWT):
+            self.verify(request, self.public_pem(self.rsa_key), 'RS256')
+
+    def test_public_key_as_hmac_secret(self):
+        # An HS256 token signed with the public key must not pass.
+        secret = self.public_pem(self.rsa_key)
+        header = b64(json.dumps({'alg': 'HS256', 'typ': 'JWT'}))
+        signing_input = header + '.' + b64(json.dumps(self.payload()))
+        signature = hmac.new(secret, signing_input, hashlib.sha256).digest()
+        request = signing_input + '.' + b64(signature)
+        with assert_raises(InvalidKeyError):
+            verify_jwt(request, self.key, secret,
+                       algorithms=['HS256', 'RS256'])
+
+    def test_parsed_once(self):
+        pem = self.public_pem(self.rsa_key)
+        first = Key(pem, algorithms=['RS256'])
+        second = Key(pem + '\n', algorithms=['RS256', 'RS512'])
+        assert first._prepared['RS256'] is second._prepared['RS256']
+        assert first._prepared['RS256'] is second._prepared['RS512']
+        jwk = self.jwk(self.rsa_key)
+        assert (Key(jwk)._prepare('RS256') is
+                Key(dict(jwk))._prepare('RS256'))
+
+    def test_cache_is_bounded(self):
+        self.addCleanup(setattr, keyring, '_max_key_objects',
+                        keyring._max_key_objects)
+        keyring._max_key_objects = 1
+        Key(self.public_pem(self.rsa_key), algorithms=['RS256'])
+        Key(self.public_pem(self.ec_key), algorithms=['ES256'])
+        eq_(len(keyring._key_objects), 1)
+
+    def test_jwks_file(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'jwks.json')
+            jwk = self.jwk(self.ec_key)
+            jwk.update(kid='ec-1', aud=self.key)
+            with open(path, 'w') as fp:
+                json.dump({'keys': [jwk]}, fp)
+            ring = Keyring.from_file(path)
+            request = self.request(
+                app_secret=self.private_pem(self.ec_key),
+                encode_kwargs={'algorithm': 'ES256',
+                               'headers': {'kid': 'ec-1'}})
+            eq_(self.verify(request, ring, 'ES256')['aud'], self.key)
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,193 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from mozpay import (DuplicateNotice, InvalidJWT, process_chargeback,
+                    process_postback)
+from mozpay.audit import AuditLog, read_records
+from mozpay.cache import token_digest
+from mozpay.metrics import MemorySink
+from mozpay.replay import MemoryReplayCache
+
+from . import JWTtester
+
+
+class AuditTester(JWTtester):
+
+    def setUp(self):
+        super(AuditTester, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def audit(self, **kw):
+        kw.setdefault('fsync', False)
+        audit = AuditLog(self.dir, **kw)
+        self.addCleanup(audit.close, 5)
+        return audit
+
+    def records(self, *args):
+        return list(read_records(self.dir, *args))
+
+    def fill(self, audit, count, start=0):
+        for i in range(start, start + count):
+            audit.record('a.b.c', {'iss': 'x', 'typ': 'y',
+                                   'response': {'transactionID': str(i)}},
+                         now=1000 + i)
+        audit.flush()
+
+    def segments(self):
+        return sorted(os.path.join(self.dir, name)
+                      for name in os.listdir(self.dir)
+                      if name.endswith('.audit'))
+
+
+class TestAuditLog(AuditTester):
+
+    def test_record(self):
+        audit = self.audit()
+        notice = self.request(extra_res={'transactionID': u'caf\xe9'})
+        audit.record(notice, self.payload(
+            extra_res={'transactionID': u'caf\xe9'}), now=10)
+        audit.record(notice, outcome='InvalidJWT', issuer='x', now=5,
+                     wait=True)
+        first, second = self.records()
+        eq_(first, (10, token_digest(notice), u'marketplace.mozilla.org',
+                    u'mozilla/postback/pay/v1', u'caf\xe9', u'ok'))
+        eq_(second.transaction_id, u'')
+        eq_(second.issuer, u'x')
+        eq_(second.timestamp, 10)  # Never earlier than the one before.
+
+    def test_time_range(self):
+        audit = self.audit(segment_size=2000)
+        for start in range(0, 1000, 10):
+            # Segments are only started between writes.
+            self.fill(audit, 10, start=start)
+        assert len(self.segments()) > 10
+        eq_([r.transaction_id for r in self.records(1500, 1503)],
+            [u'500', u'501', u'502'])
+        eq_(len(self.records(None, 1010)), 10)
+        eq_(len(self.records(1990)), 10)
+        eq_(self.records(5000), [])
+        eq_(len(self.records()), 1000)
+
+    def test_reopen(self):
+        audit = self.audit()
+        self.fill(audit, 3)
+        audit.close()
+        self.fill(self.audit(), 3, start=3)
+        eq_([r.transaction_id for r in self.records()],
+            [unicode(i) for i in range(6)])
+
+    def test_writers(self):
+        # Logs open on one directory write their own segments, and their
+        # records are read back merged by time.
+        first = self.audit(segment_size=2000)
+        second = self.audit(segment_size=2000)
+        eq_((first.writer, second.writer), (0, 1))
+        for i in range(200):
+            self.fill(first if i % 3 else second, 1, start=i)
+        eq_([r.transaction_id for r in self.records()],
+            [unicode(i) for i in range(200)])
+        eq_([r.transaction_id for r in self.records(1100, 1104)],
+            [u'100', u'101', u'102', u'103'])
+        second.close()
+        eq_(self.audit().writer, 1)  # A closed log's number is free.
+
+    def test_torn_record(self):
+        audit = self.audit()
+        self.fill(audit, 3)
+        audit.close()
+        path, = self.segments()
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'ab') as f:
+            f.write(data[-30:-5])  # Half of a record.
+        eq_(len(self.records()), 3)
+        self.fill(self.audit(), 1, start=3)
+        eq_(len(self.records()), 4)
+        record_size = (len(data) - len('MOZPAYA1')) // 3
+        eq_(os.path.getsize(path), len(data) + record_size)
+
+    def test_metrics(self):
+        sink = MemorySink()
+        self.fill(self.audit(metrics=sink), 3)
+        batches = sink.histograms[('audit.batch', ())]
+        eq_(sink.timings[('audit.commit', ())].count, batches.count)
+        eq_(batches.total, 3)  # Flushes are not counted as records.
+
+    def test_broken_metrics(self):
+        class Broken(MemorySink):
+            def timing(self, name, seconds, tags=None):
+                raise ValueError('broken sink')
+
+        audit = self.audit(metrics=Broken())
+        self.fill(audit, 1)
+        self.fill(audit, 1, start=1)  # The writer is still running.
+        eq_(len(self.records()), 2)
+
+    def test_short_write(self):
+        write = os.write
+        self.addCleanup(setattr, os, 'write', write)
+        os.write = lambda fd, data: write(fd, data[:7])
+        audit = self.audit()
+        self.fill(audit, 3)
+        os.write = write
+        eq_([r.transaction_id for r in self.records()], [u'0', u'1', u'2'])
+
+    def test_closed(self):
+        audit = self.audit()
+        audit.close()
+        with self.assertRaises(RuntimeError):
+            audit.record('a.b.c')
+
+    def test_crash(self):
+        # A process killed while records are being written keeps the ones
+        # it waited for, followed by no gaps.
+        script = ('import os, signal, sys\n'
+                  'from mozpay.audit import AuditLog\n'
+                  'audit = AuditLog(sys.argv[1], segment_size=4096)\n'
+                  'for i in range(2000):\n'
+                  '    audit.record("a.b.c", {"response": '
+                  '{"transactionID": str(i)}}, wait=i == 999)\n'
+                  'os.kill(os.getpid(), signal.SIGKILL)\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.call([sys.executable, '-c', script, self.dir], cwd=root)
+        ids = [int(r.transaction_id) for r in self.records()]
+        assert len(ids) >= 1000, len(ids)
+        eq_(ids, range(len(ids)))
+        audit = self.audit()
+        audit.record('a.b.c', {'response': {'transactionID': 'after'}},
+                     wait=True)
+        eq_(self.records()[-1].transaction_id, u'after')
+
+
+class TestVerify(AuditTester):
+
+    def test_postback(self):
+        audit = self.audit()
+        replay_cache = MemoryReplayCache()
+        notice = self.request()
+        process_postback(notice, self.key, self.secret, audit=audit,
+                         replay_cache=replay_cache)
+        with self.assertRaises(DuplicateNotice):
+            process_postback(notice, self.key, self.secret, audit=audit,
+                             replay_cache=replay_cache)
+        with self.assertRaises(InvalidJWT):
+            process_postback(self.request(app_secret='wrong'), self.key,
+                             self.secret, audit=audit)
+        audit.flush()
+        eq_([(r.outcome, r.transaction_id) for r in self.records()],
+            [(u'ok', u'1234'), (u'DuplicateNotice', u'1234'),
+             (u'InvalidJWT', u'')])
+
+    def test_chargeback(self):
+        audit = self.audit()
+        notice = self.request(typ='mozilla/chargeback/refund/v1',
+                              extra_res={'reason': 'refund'})
+        process_chargeback(notice, self.key, self.secret, audit=audit)
+        audit.flush()
+        eq_(self.records()[0].typ, u'mozilla/chargeback/refund/v1')
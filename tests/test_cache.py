@@ -0,0 +1,144 @@
+import time
+import unittest
+
+from nose.tools import assert_raises, eq_, raises
+
+import mozpay
+from mozpay.cache import ExpiringLRU, TokenCache
+from mozpay.exc import DuplicateNotice, InvalidJWT, RequestExpired
+from mozpay.replay import MemoryReplayCache
+
+from . import JWTtester
+
+
+class CodeError(InvalidJWT):
+
+    def __init__(self, code):
+        super(CodeError, self).__init__('error code %d' % code)
+
+
+class TestExpiringLRU(unittest.TestCase):
+
+    def test_get(self):
+        cache = ExpiringLRU()
+        cache.set('a', 1, expires=20)
+        eq_(cache.get('a', now=10), 1)
+        eq_(cache.get('a', now=20), None)
+        eq_(cache.get('b', default=2, now=10), 2)
+
+    def test_add(self):
+        cache = ExpiringLRU()
+        eq_(cache.add('a', 1, expires=20, now=10), True)
+        eq_(cache.add('a', 2, expires=30, now=15), False)
+        eq_(cache.get('a', now=15), 1)
+        eq_(cache.add('a', 3, expires=40, now=25), True)
+        eq_(cache.get('a', now=25), 3)
+
+    def test_evicts_least_recently_used(self):
+        cache = ExpiringLRU(maxsize=2)
+        cache.set('a', 1, expires=20)
+        cache.set('b', 2, expires=20)
+        cache.get('a', now=10)
+        cache.set('c', 3, expires=20)
+        eq_(len(cache), 2)
+        eq_(cache.get('b', now=10), None)
+        eq_(cache.get('a', now=10), 1)
+        eq_(cache.get('c', now=10), 3)
+
+    def test_delete(self):
+        cache = ExpiringLRU()
+        cache.set('a', 1, expires=20)
+        cache.delete('a')
+        cache.delete('a')
+        eq_(cache.get('a', now=10), None)
+
+    @raises(ValueError)
+    def test_maxsize(self):
+        ExpiringLRU(maxsize=0)
+
+
+class TestTokenCache(JWTtester):
+
+    def setUp(self):
+        super(TestTokenCache, self).setUp()
+        self.cache = TokenCache()
+        self.verifier = mozpay.Verifier(self.key, self.secret,
+                                        token_cache=self.cache)
+
+    def test_hit(self):
+        token = self.request()
+        first = self.verifier(token)
+        second = self.verifier(token)
+        eq_(first, second)
+        eq_(second['response']['transactionID'], '1234')
+        eq_((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_read_only(self):
+        data = self.verifier(self.request())
+        with assert_raises(TypeError):
+            data['iss'] = 'other'
+        with assert_raises(TypeError):
+            data['response'].update(transactionID='other')
+        eq_(self.verifier(self.request())['iss'], 'marketplace.mozilla.org')
+
+    def test_cached_rejection(self):
+        token = self.request(app_secret='invalid')
+        for i in range(2):
+            try:
+                self.verifier(token)
+            except InvalidJWT, exc:
+                eq_(exc.__class__, InvalidJWT)
+                eq_(exc.issuer, 'marketplace.mozilla.org')
+                assert 'Signature verification failed' in str(exc), exc
+            else:
+                raise AssertionError('InvalidJWT was not raised')
+        eq_((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_cached_rejection_subclass(self):
+        # Exceptions that can't be rebuilt from (msg, issuer) are raised
+        # again as InvalidJWT.
+        def verify(signed_request):
+            raise CodeError(7)
+
+        for i in range(2):
+            with assert_raises(InvalidJWT) as context:
+                self.cache.verify('key', verify, 'a.b.c')
+        eq_(str(context.exception), 'error code 7')
+        eq_((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_entries_are_verified_again(self):
+        token = self.request()
+        data = self.verifier(token)
+        # Pretend the cached entry outlived the JWT.
+        key = self.cache._cache._data.keys()[0]
+        self.cache._cache.set(key, (True, data), time.time() - 1)
+        self.verifier(token)
+        eq_((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_expiry_is_exp(self):
+        payload = self.payload()
+        self.verifier(self.request(payload=payload))
+        value, expires = self.cache._cache._data.values()[0]
+        eq_(expires, payload['exp'])
+
+    def test_expired_tokens_are_not_cached(self):
+        token = self.request(exp=1)
+        for i in range(2):
+            with assert_raises(RequestExpired):
+                self.verifier(token)
+        eq_(len(self.cache._cache), 0)
+
+    def test_separate_verifiers(self):
+        token = self.request()
+        self.verifier(token)
+        other = mozpay.Verifier(self.key, 'other secret',
+                                token_cache=self.cache)
+        with assert_raises(InvalidJWT):
+            other(token)
+
+    def test_replay_cache_still_applies(self):
+        self.verifier.replay_cache = MemoryReplayCache()
+        token = self.request()
+        self.verifier(token)
+        with assert_raises(DuplicateNotice):
+            self.verifier(token)
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from mozpay.cli import main
+
+from . import JWTtester
+
+
+class FailingOutput(StringIO):
+    # Fails to write after *lines* lines.
+
+    def __init__(self, lines):
+        StringIO.__init__(self)
+        self.lines = lines
+
+    def write(self, data):
+        if self.getvalue().count('\n') >= self.lines:
+            raise IOError('No space left on device')
+        StringIO.write(self, data)
+
+
+class TestVerifyCommand(JWTtester):
+
+    def setUp(self):
+        super(TestVerifyCommand, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.notices = os.path.join(self.tmp, 'notices.jsonl')
+        self.results = os.path.join(self.tmp, 'results.jsonl')
+        self.stderr = sys.stderr
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.tmp)
+
+    def write(self, lines):
+        with open(self.notices, 'wb') as fp:
+            for line in lines:
+                fp.write(line + '\n')
+
+    def verify_file(self, *args):
+        sys.stderr = StringIO()
+        status = main(['verify', self.notices, '--key', self.key,
+                       '--secret', self.secret, '--processes', '0',
+                       '--output', self.results] + list(args))
+        summary = json.loads(sys.stderr.getvalue())
+        with open(self.results) as fp:
+            results = [json.loads(ln) for ln in fp]
+        return status, summary, results
+
+    def test_verify(self):
+        chargeback = self.payload(typ='mozilla/chargeback/pay/v1')
+        self.write([json.dumps({'notice': self.request()}),
+                    json.dumps(self.request(app_secret='invalid')),
+                    '',
+                    self.request(exp=1),
+                    self.request(payload=chargeback)])
+        status, summary, results = self.verify_file()
+        eq_(status, 1)
+        eq_([r['ok'] for r in results], [True, False, False, False])
+        eq_(results[0]['transactionID'], '1234')
+        eq_([r.get('error') for r in results[1:]],
+            ['InvalidJWT', 'RequestExpired', 'InvalidJWT'])
+        eq_(summary['total'], 4)
+        eq_(summary['ok'], 1)
+        eq_(summary['errors'], {'InvalidJWT': 2, 'RequestExpired': 1})
+        eq_(summary['next_offset'], os.path.getsize(self.notices))
+
+    def test_resume_from_offset(self):
+        self.write([self.request(), self.request()])
+        status, summary, results = self.verify_file()
+        eq_(status, 0)
+        os.unlink(self.results)
+        status, summary, resumed = self.verify_file(
+            '--offset', str(results[1]['offset']))
+        eq_(summary['total'], 1)
+        eq_(resumed, results[1:])
+
+    def test_interrupted(self):
+        # The summary resumes after the last result that was written,
+        # not after the notices that were read ahead.
+        self.write([self.request()] * 3)
+        stdout = sys.stdout
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+        sys.stdout = FailingOutput(lines=1)
+        sys.stderr = StringIO()
+        with self.assertRaises(IOError):
+            main(['verify', self.notices, '--key', self.key,
+                  '--secret', self.secret, '--processes', '0'])
+        summary = json.loads(sys.stderr.getvalue())
+        eq_(summary['ok'], 1)  # The second result was not written.
+        eq_(summary['next_offset'], os.path.getsize(self.notices) // 3)
+
+    def test_postback_rules(self):
+        chargeback = self.payload(typ='mozilla/chargeback/pay/v1')
+        self.write([self.request(payload=chargeback)])
+        status, summary, results = self.verify_file('--type', 'postback')
+        eq_(summary['ok'], 1)
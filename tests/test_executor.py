@@ -0,0 +1,85 @@
+import cPickle as pickle
+import threading
+import unittest
+
+from nose.tools import eq_, raises
+
+from mozpay.executor import BoundedExecutor
+
+
+class ArgsError(Exception):
+    # Can't be unpickled: Exception pickles self.args, not (code, text).
+
+    def __init__(self, code, text):
+        super(ArgsError, self).__init__('%d %s' % (code, text))
+
+
+def make_lock():
+    return threading.Lock()
+
+
+def raise_args_error():
+    raise ArgsError(1, 'failed')
+
+
+class TestBoundedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(workers=1, max_pending=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_result(self):
+        eq_(self.executor.submit(sum, [1, 2]).result(timeout=10), 3)
+
+    @raises(ZeroDivisionError)
+    def test_exception(self):
+        self.executor.submit(divmod, 1, 0).result(timeout=10)
+
+    def test_done_callback(self):
+        done = []
+        future = self.executor.submit(sum, [1, 2])
+        future.add_done_callback(done.append)
+        future.result(timeout=10)
+        future.add_done_callback(done.append)
+        eq_(done, [future, future])
+
+    def test_backpressure(self):
+        release = threading.Event()
+        futures = [self.executor.submit(release.wait, 10) for i in range(2)]
+        submitted = threading.Event()
+
+        def submit():
+            futures.append(self.executor.submit(sum, [1]))
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # The third call waits for a free slot.
+        assert not submitted.wait(0.2)
+        release.set()
+        thread.join(10)
+        eq_(futures[2].result(timeout=10), 1)
+
+
+class TestProcesses(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(workers=1, max_pending=1,
+                                        processes=True)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_result(self):
+        eq_(self.executor.submit(sum, [1, 2]).result(timeout=10), 3)
+
+    def test_unpicklable(self):
+        # The futures fail and free their slot instead of hanging.
+        for func in (make_lock, raise_args_error):
+            exc = self.executor.submit(func).exception(timeout=10)
+            assert isinstance(exc, pickle.PicklingError), exc
+        with self.assertRaises(TypeError):
+            self.executor.submit(sum, [threading.Lock()])
+        eq_(self.executor.submit(sum, [1]).result(timeout=10), 1)
@@ -0,0 +1,116 @@
+import json
+import random
+
+from nose.tools import eq_
+
+import mozpay
+from mozpay import InvalidJWT, jsonlib
+
+from . import JWTtester
+
+corpus = [
+    '{"a":1}', '{"a":1,}', '{"a":"x\ny"}', '{"a":"\x01"}', '{"a":01}',
+    '{"a":-01}', '{"a":0}', '{"a":-0}', '{"a":0.5}', '{"a":1e05}',
+    '{"a":99999999999999999999999}', '{"a":-99999999999999999999999}',
+    '{"a":0.1}', '{"a":1e400}', '{"a":NaN}', '{"a":Infinity}',
+    '{"a":"\xff"}', '{"a":"\xed\xa0\x80"}', '{"a":"\\ud800"}',
+    '{"a":"\\ud83d\\ude00"}', '{"a":"\\u00e9"}', '{"a":"\xc3\xa9"}',
+    '{"a":1} x', '{"a":1}{}', ' {"a":1} ', '{"a":[1,2,]}',
+    '{"a":1.00000000000000011}', '{"a":0.30000000000000004}',
+    '{"a":1,"a":2}', '{"a":true,"b":null,"c":false}', '[1]', '"a"', '',
+    '{"a":"id=01"}', '{"a":"\\/"}', '{"a":"\\x"}', '{"a":[' * 50 + ']' * 50,
+]
+
+
+def outcome(loads, data):
+    try:
+        value = loads(data)
+    except Exception, exc:
+        return 'error', exc.__class__.__name__, str(exc)
+    return 'ok', value, _types(value)
+
+
+def _types(value):
+    # Equal values can still have different types, such as 1 and 1.0.
+    # ASCII text may come back as str or unicode.
+    if isinstance(value, dict):
+        return sorted((k, _types(k), _types(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_types(v) for v in value]
+    if isinstance(value, basestring):
+        return basestring
+    return type(value)
+
+
+def mutations(data, count, seed=0):
+    rand = random.Random(seed)
+    alphabet = '{}[]",:0123456789.eE+-\\/u \n\x00\xff\xc3abtrufnl'
+    for i in xrange(count):
+        chars = list(data)
+        for j in xrange(rand.randint(1, 3)):
+            pos = rand.randrange(len(chars))
+            action = rand.randrange(3)
+            if action == 0:
+                chars[pos] = rand.choice(alphabet)
+            elif action == 1:
+                chars.insert(pos, rand.choice(alphabet))
+            else:
+                del chars[pos]
+        yield ''.join(chars)
+
+
+class TestBackends(JWTtester):
+
+    def setUp(self):
+        super(TestBackends, self).setUp()
+        self.addCleanup(jsonlib.use, jsonlib.backend)
+
+    def check(self, data):
+        expected = outcome(json.loads, data)
+        for name, (loads, dumps) in jsonlib.backends.items():
+            eq_(outcome(loads, data), expected,
+                'backend %s differs for %r' % (name, data))
+
+    def test_corpus(self):
+        for data in corpus:
+            self.check(data)
+
+    def test_mutations(self):
+        payload = self.payload(extra_req={
+            'productData': 'my_product_id=1234&price=0.99',
+            'name': u'Caf\xe9', 'pricePoint': [0, -5, 1.5e3, 2 ** 40]})
+        for data in (json.dumps(payload),
+                     json.dumps(payload, ensure_ascii=False).encode('utf8')):
+            for data in mutations(data, 3000):
+                self.check(data)
+
+    def test_dumps(self):
+        data = self.payload(extra_req={'price': 0.1 + 0.2, 'name': u'\xe9'})
+        for name, (loads, dumps) in jsonlib.backends.items():
+            eq_(json.loads(dumps(data)), data)
+
+    def test_verify(self):
+        requests = [self.request(),
+                    self.request(extra_req={'productData': u'\xe9' * 1000}),
+                    self.request(extra_req={'pricePoint': 10 ** 30})]
+        results = {}
+        for name in jsonlib.backends:
+            jsonlib.use(name)
+            results[name] = [mozpay.process_postback(r, self.key, self.secret)
+                             for r in requests]
+        for name, result in results.items():
+            eq_(result, results['json'])
+            eq_(_types(result), _types(results['json']))
+
+    def test_verify_errors(self):
+        header = 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9'
+        for payload in ('eyJhIjoxLH0', 'eyJhIjowMX0'):  # {"a":1,}, {"a":01}
+            messages = set()
+            for name in jsonlib.backends:
+                jsonlib.use(name)
+                try:
+                    mozpay.process_postback(header + '.' + payload + '.abc',
+                                            self.key, self.secret)
+                except InvalidJWT, exc:
+                    messages.add(str(exc))
+            eq_(len(messages), 1, messages)
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from nose.tools import assert_raises, eq_
+
+import mozpay
+from mozpay import InvalidJWT
+from mozpay.keyring import Keyring
+
+from . import JWTtester
+
+
+class TestKeyring(JWTtester):
+
+    def setUp(self):
+        super(TestKeyring, self).setUp()
+        self.keyring = Keyring()
+        self.verifier = mozpay.process_postback
+
+    def verify(self, request, key=None):
+        return self.verifier(request, key, self.keyring)
+
+    def test_by_audience(self):
+        self.keyring.add('other secret', aud='other app')
+        self.keyring.add(self.secret, aud=self.key)
+        data = self.verify(self.request())
+        eq_(data['aud'], self.key)
+        other = self.request(app_id='other app', app_secret='other secret')
+        eq_(self.verify(other)['aud'], 'other app')
+
+    def test_wrong_audience_secret(self):
+        self.keyring.add('other secret', aud=self.key)
+        self.keyring.add(self.secret, aud='other app')
+        with assert_raises(InvalidJWT):
+            self.verify(self.request())
+
+    def test_unknown_audience(self):
+        self.keyring.add(self.secret, aud='other app')
+        with assert_raises(InvalidJWT):
+            self.verify(self.request())
+
+    def test_expected_audience(self):
+        self.keyring.add(self.secret)
+        self.verify(self.request(), key=self.key)
+        with assert_raises(InvalidJWT):
+            self.verify(self.request(), key='other app')
+
+    def test_by_issuer(self):
+        self.keyring.add('other secret', iss='other issuer')
+        self.keyring.add(self.secret, iss='marketplace.mozilla.org')
+        self.verify(self.request())
+
+    def test_by_kid(self):
+        self.keyring.add('old secret', aud=self.key, kid='old')
+        self.keyring.add(self.secret, aud=self.key, kid='new')
+        request = self.request(encode_kwargs={'headers': {'kid': 'new'}})
+        self.verify(request)
+        eq_(self.keyring.find(aud=self.key, kid='new')[0].kid, 'new')
+
+    def test_find_is_most_specific_first(self):
+        any_key = self.keyring.add('a')
+        app_key = self.keyring.add('b', aud=self.key)
+        eq_(self.keyring.find(aud=self.key), [app_key, any_key])
+        eq_(self.keyring.find(aud='other app'), [any_key])
+        eq_(self.keyring.find(aud=[self.key]), [any_key])
+
+    def test_rotation(self):
+        now = time.time()
+        old = self.keyring.add('old secret', aud=self.key,
+                               not_after=now + 60)
+        new = self.keyring.add(self.secret, aud=self.key,
+                               not_before=now - 60)
+        # Both keys are valid while they overlap.
+        self.verify(self.request())
+        self.verify(self.request(app_secret='old secret'))
+        eq_(self.keyring.find(aud=self.key, now=now + 120), [new])
+        eq_(self.keyring.find(aud=self.key, now=now - 120), [old])
+
+    def test_expired_key(self):
+        self.keyring.add(self.secret, aud=self.key, not_after=time.time())
+        with assert_raises(InvalidJWT):
+            self.verify(self.request())
+
+
+class TestKeyringFile(JWTtester):
+
+    def setUp(self):
+        super(TestKeyringFile, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'keyring.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, keys, mtime):
+        with open(self.path, 'w') as fp:
+            json.dump({'keys': keys}, fp)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reload(self):
+        self.write([{'secret': 'old secret', 'aud': self.key}], 1000)
+        keyring = Keyring.from_file(self.path, check_interval=0)
+        with assert_raises(InvalidJWT):
+            mozpay.process_postback(self.request(), self.key, keyring)
+
+        self.write([{'secret': self.secret, 'aud': self.key}], 2000)
+        mozpay.process_postback(self.request(), self.key, keyring)
+        eq_(len(keyring), 1)
+
+    def test_bad_reload_keeps_keys(self):
+        self.write([{'secret': self.secret, 'aud': self.key}], 1000)
+        keyring = Keyring.from_file(self.path, check_interval=0)
+        with open(self.path, 'w') as fp:
+            fp.write('{not json')
+        os.utime(self.path, (2000, 2000))
+        mozpay.process_postback(self.request(), self.key, keyring)
+
+    def test_check_interval(self):
+        self.write([{'secret': 'old secret', 'aud': self.key}], 1000)
+        keyring = Keyring.from_file(self.path, check_interval=3600)
+        self.write([{'secret': self.secret, 'aud': self.key}], 2000)
+        eq_(keyring.find(aud=self.key)[0].secret, 'old secret')
@@ -0,0 +1,114 @@
+import socket
+import unittest
+
+from nose.tools import eq_
+
+import mozpay
+from mozpay.cache import TokenCache
+from mozpay.metrics import MemorySink, StatsdSink
+from mozpay.replay import MemoryReplayCache
+
+from . import JWTtester
+
+ISSUER = 'marketplace.mozilla.org'
+
+
+class TestVerifierMetrics(JWTtester):
+
+    def setUp(self):
+        super(TestVerifierMetrics, self).setUp()
+        self.sink = MemorySink()
+        self.verifier = mozpay.process_postback
+
+    def verify(self, request, **kw):
+        kw['metrics'] = self.sink
+        return super(TestVerifierMetrics, self).verify(request,
+                                                       verify_kwargs=kw)
+
+    def timings(self):
+        return sorted(name for name, tags in self.sink.timings)
+
+    def test_ok(self):
+        request = self.request()
+        self.verify(request)
+        eq_(self.timings(),
+            ['stage.claims', 'stage.decode', 'stage.keys', 'stage.precheck',
+             'stage.signature', 'stage.validators', 'verify'])
+        eq_(self.sink.counters,
+            {('outcome', (('issuer', ISSUER), ('outcome', 'ok'))): 1})
+        size = self.sink.histograms[('token_size', ())]
+        eq_((size.count, size.max), (1, len(request)))
+
+    def test_invalid(self):
+        for i in range(2):
+            try:
+                self.verify(self.request(app_secret='invalid'))
+            except mozpay.InvalidJWT:
+                pass
+        eq_(self.timings(), ['stage.decode', 'stage.precheck', 'verify'])
+        eq_(self.sink.timings[('verify', ())].count, 2)
+        eq_(self.sink.counters,
+            {('outcome', (('issuer', ISSUER), ('outcome', 'InvalidJWT'))): 2})
+
+    def test_malformed(self):
+        try:
+            self.verify('garbage')
+        except mozpay.InvalidJWT:
+            pass
+        eq_(self.timings(), ['verify'])
+        eq_(self.sink.counters,
+            {('outcome', (('issuer', ''), ('outcome', 'MalformedJWT'))): 1})
+
+    def test_caches(self):
+        request = self.request()
+        kw = {'token_cache': TokenCache(),
+              'replay_cache': MemoryReplayCache()}
+        self.verify(request, **kw)
+        self.sink.reset()
+        try:
+            self.verify(request, **kw)
+        except mozpay.DuplicateNotice:
+            pass
+        eq_(self.timings(),
+            ['stage.cache', 'stage.precheck', 'stage.replay', 'verify'])
+
+
+class TestStatsdSink(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def received(self):
+        return self.listener.recv(1024)
+
+    def test_lines(self):
+        sink = StatsdSink('127.0.0.1', self.port)
+        sink.timing('stage.decode', 0.0123)
+        eq_(self.received(), 'mozpay.stage.decode:12.300|ms')
+        sink.timing('stage.claims', 0.000004)
+        eq_(self.received(), 'mozpay.stage.claims:0.004|ms')
+        sink.incr('outcome', tags={'outcome': 'ok', 'issuer': ISSUER})
+        eq_(self.received(), 'mozpay.outcome.ok:1|c')
+        sink.histogram('token_size', 812)
+        eq_(self.received(), 'mozpay.token_size:812|h')
+
+    def test_issuers(self):
+        sink = StatsdSink('127.0.0.1', self.port, issuers=[ISSUER])
+        sink.incr('outcome', tags={'outcome': 'ok', 'issuer': ISSUER})
+        eq_(self.received(),
+            'mozpay.outcome.marketplace_mozilla_org.ok:1|c')
+        sink.incr('outcome', tags={'outcome': 'InvalidJWT',
+                                   'issuer': 'junk.example.com'})
+        eq_(self.received(), 'mozpay.outcome.other.InvalidJWT:1|c')
+
+    def test_tagged(self):
+        sink = StatsdSink('127.0.0.1', self.port, prefix='', tagged=True)
+        sink.incr('outcome', tags={'outcome': 'ok', 'issuer': ISSUER})
+        eq_(self.received(),
+            'outcome:1|c|#issuer:marketplace_mozilla_org,outcome:ok')
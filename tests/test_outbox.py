@@ -0,0 +1,178 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from nose.tools import eq_
+
+from mozpay.metrics import MemorySink
+from mozpay.outbox import Outbox
+
+from . import JWTtester
+
+
+class Recorder(object):
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def __call__(self, kind, jwt_data):
+        with self.lock:
+            if self.fail:
+                self.fail -= 1
+                raise ValueError('receiver failed')
+            self.delivered.append((kind, jwt_data))
+
+    def wait(self, count, timeout=5):
+        end = time.time() + timeout
+        while len(self.delivered) < count and time.time() < end:
+            time.sleep(0.01)
+        return self.delivered
+
+
+def wait_for(check, timeout=5):
+    end = time.time() + timeout
+    while not check() and time.time() < end:
+        time.sleep(0.01)
+    return check()
+
+
+class TestOutbox(JWTtester):
+
+    def setUp(self):
+        super(TestOutbox, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'outbox.db')
+
+    def outbox(self, handler, **kw):
+        kw.setdefault('synchronous', 'NORMAL')
+        outbox = Outbox(self.path, handler, **kw)
+        self.addCleanup(outbox.close, 5)
+        return outbox
+
+    def test_deliver(self):
+        recorder = Recorder()
+        outbox = self.outbox(recorder)
+        payload = self.payload(extra_req={'name': u'Caf\xe9'})
+        outbox.put('postback', payload)
+        outbox.put('chargeback', self.payload())
+        eq_(recorder.wait(2)[0], ('postback', payload))
+        eq_(recorder.delivered[1][0], 'chargeback')
+        assert wait_for(lambda: outbox.pending() == 0)
+
+    def test_retry(self):
+        recorder = Recorder(fail=2)
+        sink = MemorySink()
+        outbox = self.outbox(recorder, retry_delay=0.01, metrics=sink)
+        outbox.put('postback', self.payload())
+        eq_(len(recorder.wait(1)), 1)
+        assert wait_for(lambda: outbox.pending() == 0)
+        eq_(sink.counters[('outbox.delivery', (('kind', 'postback'),
+                                               ('outcome', 'retry')))], 2)
+
+    def test_group_commit(self):
+        sink = MemorySink()
+        gate = threading.Event()
+        outbox = self.outbox(lambda kind, data: gate.wait(5), metrics=sink)
+        threads = [threading.Thread(target=outbox.put,
+                                    args=('postback', self.payload()))
+                   for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        batches = sink.histograms[('outbox.batch', ())]
+        eq_(batches.total, 51)  # The puts and the first wake up.
+        assert batches.count < 51, batches.count
+        gate.set()
+        assert wait_for(lambda: outbox.pending() == 0)
+
+    def test_backlog(self):
+        # More notices than the workers take at once wait in the file.
+        gate = threading.Event()
+        recorder = Recorder()
+
+        def handler(kind, jwt_data):
+            gate.wait(5)
+            recorder(kind, jwt_data)
+
+        outbox = self.outbox(handler, workers=1)
+        for i in range(10):
+            outbox.put('postback', self.payload(extra_res={'n': i}))
+        eq_(outbox.pending(), 10)
+        gate.set()
+        delivered = recorder.wait(10)
+        eq_(sorted(data['response']['n'] for kind, data in delivered),
+            range(10))
+
+    def test_closed(self):
+        outbox = self.outbox(Recorder())
+        outbox.close()
+        with self.assertRaises(RuntimeError):
+            outbox.put('postback', self.payload())
+
+    def test_undelivered_after_close(self):
+        outbox = self.outbox(Recorder(fail=1), retry_delay=60)
+        outbox.put('postback', self.payload())
+        assert wait_for(lambda: outbox._inflight == 0)
+        outbox.close()
+        eq_(outbox.pending(), 1)
+
+    def test_crash(self):
+        # A process that dies with notices in flight or not yet taken.
+        script = ('import os, sys, threading\n'
+                  'from mozpay.outbox import Outbox\n'
+                  'never = threading.Event()\n'
+                  'outbox = Outbox(sys.argv[1], lambda k, d: never.wait(),\n'
+                  '                workers=1, lease=0.5)\n'
+                  'for i in range(10):\n'
+                  '    outbox.put("postback", {"n": i})\n'
+                  'os._exit(0)\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, '-c', script, self.path],
+                              cwd=root)
+        recorder = Recorder()
+        self.outbox(recorder)
+        delivered = recorder.wait(10)
+        eq_(sorted(data['n'] for kind, data in delivered), range(10))
+
+    def test_shared_file(self):
+        first, second = Recorder(), Recorder()
+        one = self.outbox(first)
+        two = self.outbox(second)
+        for i in range(20):
+            (one if i % 2 else two).put('postback', {'n': i})
+        assert wait_for(lambda: one.pending() == 0)
+        eq_(sorted(data['n'] for kind, data in
+                   first.delivered + second.delivered), range(20))
+
+    def test_locked_file(self):
+        # Outcomes that can't be committed while another connection holds
+        # the write lock are committed once it is released.
+        handled = threading.Event()
+        release = threading.Event()
+
+        def handler(kind, jwt_data):
+            handled.set()
+            release.wait(5)
+
+        outbox = self.outbox(handler, workers=1)
+        outbox._conn.execute('PRAGMA busy_timeout = 50')
+        outbox.put('postback', self.payload())
+        assert handled.wait(5)
+        other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        release.set()
+        time.sleep(0.5)  # Acknowledging fails a few times.
+        eq_(outbox.pending(), 1)
+        other.execute('ROLLBACK')
+        assert wait_for(lambda: outbox.pending() == 0)
+        eq_(outbox._inflight, 0)
@@ -2,6 +2,7 @@ from nose.tools import eq_, raises
 
 import mozpay
 from mozpay import InvalidJWT
+from mozpay.executor import BoundedExecutor
 
 from . import JWTtester
 
@@ -31,3 +32,25 @@ class TestCallbacks(JWTtester):
         payload = self.payload(typ='mozilla/chargeback/pay/v1')
         self.verify(self.request(payload=payload),
                     verifier=mozpay.process_chargeback)
+
+    def test_postback_async(self):
+        future = mozpay.process_postback_async(self.request(), self.key,
+                                               self.secret)
+        eq_(future.result(timeout=10)['response']['transactionID'], '1234')
+
+    def test_chargeback_async(self):
+        payload = self.payload(typ='mozilla/chargeback/pay/v1')
+        future = mozpay.process_chargeback_async(
+            self.request(payload=payload), self.key, self.secret)
+        assert isinstance(future.exception(timeout=10), InvalidJWT)
+
+    @raises(InvalidJWT)
+    def test_async_in_processes(self):
+        executor = BoundedExecutor(workers=2, processes=True)
+        try:
+            future = mozpay.process_postback_async(
+                self.request(app_secret='invalid'), self.key, self.secret,
+                executor=executor)
+            future.result(timeout=10)
+        finally:
+            executor.shutdown()
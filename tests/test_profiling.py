@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import time
+import unittest
+
+from nose.tools import eq_
+
+from mozpay.profiling import Profiler, report
+
+
+def slow_function():
+    time.sleep(0.2)
+    return 'done'
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def files(self, pattern):
+        return glob.glob(os.path.join(self.tmp, pattern))
+
+    def test_not_profiled(self):
+        profiler = Profiler(self.tmp)
+        eq_(profiler.call({}, sum, [1, 2]), 3)
+        eq_(os.listdir(self.tmp), [])
+
+    def test_sampled(self):
+        profiler = Profiler(self.tmp, rate=1)
+        meta = {'view': 'postback'}
+
+        def func():
+            meta['outcome'] = 'ok'
+            return sum([1, 2])
+
+        eq_(profiler.call(meta, func), 3)
+        eq_(len(self.files('*.prof')), 1)
+        with open(self.files('*.prof.json')[0]) as fp:
+            saved = json.load(fp)
+        eq_(saved['view'], 'postback')
+        eq_(saved['outcome'], 'ok')
+        eq_(saved['mode'], 'sampled')
+
+    def test_slow(self):
+        profiler = Profiler(self.tmp, slow=0.05, interval=0.01)
+        eq_(profiler.call({}, sum, [1]), 1)
+        eq_(os.listdir(self.tmp), [])
+        eq_(profiler.call({'view': 'postback'}, slow_function), 'done')
+        eq_(len(self.files('*.stacks')), 1)
+        with open(self.files('*.stacks')[0]) as fp:
+            stacks = json.load(fp)
+        assert stacks
+        assert any('slow_function' in stack[-1] for stack, count in stacks)
+
+        out = StringIO()
+        report(self.tmp, out=out)
+        assert 'slow_function' in out.getvalue(), out.getvalue()
+        assert 'by view: postback=1' in out.getvalue(), out.getvalue()
+
+    def test_keeps_latest(self):
+        profiler = Profiler(self.tmp, rate=1, keep=2)
+        for i in range(4):
+            profiler.call({}, sum, [i])
+        eq_(len(self.files('*.prof')), 2)
+        eq_(len(self.files('*.json')), 2)
+
+    def test_exception(self):
+        profiler = Profiler(self.tmp, rate=1)
+        with self.assertRaises(ZeroDivisionError):
+            profiler.call({}, divmod, 1, 0)
+        eq_(len(self.files('*.prof')), 1)
@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from mozpay.audit import AuditLog, read_records
+from mozpay.cache import token_digest
+from mozpay.cli import main
+from mozpay.reconcile import ReconciliationIndex, build_index
+from mozpay.transaction import Chargeback
+
+from . import JWTtester
+
+CHARGEBACK = 'mozilla/chargeback/refund/v1'
+
+
+class ReconcileTester(JWTtester):
+
+    def setUp(self):
+        super(ReconcileTester, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.dir = os.path.join(self.tmp, 'audit')
+        self.path = os.path.join(self.tmp, 'postbacks.index')
+        self.log = AuditLog(self.dir, fsync=False)
+        self.addCleanup(self.log.close)
+
+    def postback(self, transaction_id, iss='marketplace.mozilla.org',
+                 typ='mozilla/postback/pay/v1', **kw):
+        data = self.payload(typ=typ,
+                            extra_res={'transactionID': transaction_id})
+        data['iss'] = iss
+        self.log.record(self.request(payload=data, **kw), data)
+
+    def chargeback(self, transaction_id):
+        return self.payload(typ=CHARGEBACK,
+                            extra_res={'transactionID': transaction_id,
+                                       'reason': 'refund'})
+
+    def index(self, **kw):
+        self.log.flush()
+        build_index(self.dir, self.path, **kw)
+        index = ReconciliationIndex(self.path, self.dir)
+        self.addCleanup(index.close)
+        return index
+
+
+class TestReconcile(ReconcileTester):
+
+    def test_statuses(self):
+        self.postback('1')
+        self.postback('2')
+        self.postback('3')
+        self.postback('3', typ='mozilla/postback/refund/v1')
+        self.postback('4')
+        self.log.record('a.b.c', outcome='InvalidJWT')
+        index = self.index()
+        eq_(len(index), 5)
+        results = list(index.reconcile([
+            self.chargeback('1'), self.chargeback('9'),
+            self.chargeback('2'), self.chargeback('2'),
+            self.chargeback('3'), self.payload()]))
+        eq_([(r.status, r.transaction_id) for r in results],
+            [('matched', u'1'), ('orphan', u'9'), ('matched', u'2'),
+             ('duplicate', u'2'), ('ambiguous', u'3')])
+        eq_(results[0].postbacks[0].transaction_id, u'1')
+        eq_(len(results[4].postbacks), 2)
+
+    def test_retried_postback(self):
+        notice = self.request()
+        self.log.record(notice, self.payload())
+        self.log.record(notice, self.payload())
+        # Retried with a freshly signed token.
+        self.log.record(self.request(app_secret='other'), self.payload())
+        result, = self.index().reconcile([self.chargeback('1234')])
+        eq_(result.status, 'matched')
+        eq_(len(result.postbacks), 1)
+        eq_(result.postbacks[0].digest, token_digest(notice))
+
+    def test_issuer(self):
+        self.postback('1', iss='other.example.com')
+        index = self.index()
+        eq_(index.lookup('marketplace.mozilla.org', '1'), [])
+        eq_(len(index.lookup('other.example.com', u'1')), 1)
+
+    def test_runs(self):
+        # More entries than fit in memory are merged from sorted runs.
+        for i in range(50):
+            self.postback(str(i))
+        index = self.index(run_size=7)
+        eq_(len(index), 50)
+        eq_([r.status for r in index.reconcile(
+            self.chargeback(str(i)) for i in range(50))],
+            ['matched'] * 50)
+
+    def test_chargeback_types(self):
+        self.postback('1')
+        self.postback('2')
+        self.postback('3')
+        data = self.chargeback('3')
+        self.log.record(self.request(payload=data), data)
+        index = self.index()
+        chargebacks = [Chargeback.from_jwt(self.chargeback('1')),
+                       {'ok': True, 'iss': 'marketplace.mozilla.org',
+                        'typ': CHARGEBACK, 'transactionID': '2'}]
+        chargebacks.extend(read_records(self.dir))
+        eq_([r.transaction_id for r in index.reconcile(chargebacks)],
+            [u'1', u'2', u'3'])
+
+    def test_empty(self):
+        index = self.index()
+        eq_(len(index), 0)
+        eq_([r.status for r in index.reconcile([self.chargeback('1')])],
+            ['orphan'])
+
+
+class TestReconcileCommand(ReconcileTester):
+
+    def reconcile(self, *args):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        self.addCleanup(setattr, sys, 'stderr', stderr)
+        output = os.path.join(self.tmp, 'results.jsonl')
+        status = main(['reconcile', self.dir] + list(args) +
+                      ['--output', output])
+        with open(output) as fp:
+            results = [json.loads(ln) for ln in fp]
+        os.remove(output)
+        return status, results, json.loads(sys.stderr.getvalue())
+
+    def test_audit_log(self):
+        self.postback('1')
+        for transaction_id in ('1', '2'):
+            data = self.chargeback(transaction_id)
+            self.log.record(self.request(payload=data), data)
+        self.log.flush()
+        status, results, summary = self.reconcile()
+        eq_(status, 1)
+        eq_([(r['status'], r['transactionID']) for r in results],
+            [('orphan', '2')])
+        eq_(summary['indexed'], 1)
+        eq_(summary['matched'], 1)
+        # The index is only built again once the log changes.
+        status, results, summary = self.reconcile('--all')
+        eq_(len(results), 2)
+        assert 'indexed' not in summary
+
+    def test_chargebacks_file(self):
+        self.postback('1')
+        self.log.flush()
+        path = os.path.join(self.tmp, 'chargebacks.jsonl')
+        with open(path, 'wb') as fp:
+            fp.write(json.dumps({'ok': True, 'typ': CHARGEBACK,
+                                 'iss': 'marketplace.mozilla.org',
+                                 'transactionID': '1'}) + '\n')
+        status, results, summary = self.reconcile(path)
+        eq_((status, results, summary['matched']), (0, [], 1))
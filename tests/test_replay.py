@@ -0,0 +1,205 @@
+import multiprocessing
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+from nose.tools import assert_raises, eq_, raises
+
+import mozpay
+from mozpay import DuplicateNotice
+from mozpay.djangoapp import signals
+from mozpay.replay import MemoryReplayCache, SharedReplayCache
+
+from . import JWTtester
+from .djangotests import ViewTester
+
+
+class TestReplay(JWTtester):
+
+    def setUp(self):
+        super(TestReplay, self).setUp()
+        self.cache = MemoryReplayCache()
+        self.verifier = mozpay.process_postback
+
+    def verify(self, request):
+        return super(TestReplay, self).verify(
+            request, verify_kwargs={'replay_cache': self.cache})
+
+    def test_first_notice(self):
+        data = self.verify(self.request())
+        eq_(data['response']['transactionID'], '1234')
+
+    def test_same_token(self):
+        token = self.request()
+        self.verify(token)
+        try:
+            self.verify(token)
+        except DuplicateNotice, exc:
+            eq_(exc.issuer, 'marketplace.mozilla.org')
+            eq_(exc.jwt_data['response']['transactionID'], '1234')
+        else:
+            raise AssertionError('DuplicateNotice was not raised')
+
+    @raises(DuplicateNotice)
+    def test_same_transaction(self):
+        self.verify(self.request())
+        self.verify(self.request(iat=self.payload()['iat'] - 10))
+
+    def test_other_transaction(self):
+        self.verify(self.request())
+        self.verify(self.request(extra_res={'transactionID': '5678'}))
+
+    def test_chargeback_of_transaction(self):
+        self.verify(self.request())
+        self.verifier = mozpay.process_chargeback
+        self.verify(self.request(typ='mozilla/chargeback/pay/v1',
+                                 extra_res={'reason': 'refund'}))
+
+    def test_invalid_notice_is_not_recorded(self):
+        try:
+            self.verify(self.request(app_secret='invalid'))
+        except mozpay.InvalidJWT:
+            pass
+        self.verify(self.request())
+
+    def test_forget(self):
+        token = self.request()
+        data = self.verify(token)
+        self.cache.forget(data, token)
+        self.verify(token)  # Not a duplicate.
+
+    def test_expired_entries(self):
+        eq_(self.cache.add('key', expires=1), True)
+        eq_(self.cache.add('key', expires=1), True)
+
+    def test_pickle(self):
+        exc = pickle.loads(pickle.dumps(
+            DuplicateNotice('dupe', issuer='iss', jwt_data={'a': 1})))
+        eq_(exc.jwt_data, {'a': 1})
+        eq_(exc.issuer, 'iss')
+
+
+def _add_keys(args):
+    path, keys = args
+    cache = SharedReplayCache(path)
+    added = [key for key in keys if cache.add(key, time.time() + 60)]
+    cache.close()
+    return added
+
+
+class TestSharedReplayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'replay')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_add(self):
+        cache = SharedReplayCache(self.path, slots=64, bucket_size=8)
+        eq_(cache.add('a', time.time() + 60), True)
+        eq_(cache.add('a', time.time() + 60), False)
+        eq_(cache.add('b', time.time() + 60), True)
+        eq_(cache.add('c', 1), True)
+        eq_(cache.add('c', 1), True)  # Expired.
+
+    def test_delete(self):
+        cache = SharedReplayCache(self.path, slots=64, bucket_size=8)
+        cache.add('a', time.time() + 60)
+        cache.add('b', time.time() + 60)
+        cache.delete('a')
+        cache.delete('c')
+        eq_(cache.add('a', time.time() + 60), True)
+        eq_(cache.add('b', time.time() + 60), False)
+
+    def test_shared_between_instances(self):
+        cache = SharedReplayCache(self.path, slots=64, bucket_size=8)
+        eq_(cache.add('a', time.time() + 60), True)
+        other = SharedReplayCache(self.path)
+        eq_(other.slots, 64)
+        eq_(other.add('a', time.time() + 60), False)
+
+    def test_full_bucket_replaces_soonest_expiry(self):
+        cache = SharedReplayCache(self.path, slots=4, bucket_size=4)
+        now = time.time()
+        for i in range(4):
+            cache.add(str(i), now + 60 + i)
+        eq_(cache.add('new', now + 60), True)
+        eq_(cache.add('0', now + 60), True)  # Was replaced.
+        eq_(cache.add('3', now + 60), False)
+
+    def test_interrupted_creation(self):
+        # A file whose creator died before writing the header, or
+        # before sizing it, is initialised.
+        size = SharedReplayCache._header.size + 64 * 24
+        for data in ('\0' * size, '\0' * 10,
+                     SharedReplayCache._header.pack('MOZPAYRC', 64, 8)):
+            with open(self.path, 'wb') as fp:
+                fp.write(data)
+            cache = SharedReplayCache(self.path, slots=64, bucket_size=8)
+            eq_((cache.slots, cache.bucket_size), (64, 8))
+            eq_(cache.add('a', time.time() + 60), True)
+            eq_(os.path.getsize(self.path), size)
+
+    @raises(ValueError)
+    def test_not_a_cache(self):
+        with open(self.path, 'wb') as fp:
+            fp.write('x' * 100)
+        SharedReplayCache(self.path)
+
+    def test_verify(self):
+        tester = JWTtester('setUp')
+        tester.setUp()
+        cache = SharedReplayCache(self.path, slots=64, bucket_size=8)
+        token = tester.request()
+        mozpay.process_postback(token, tester.key, tester.secret,
+                                replay_cache=cache)
+        other = SharedReplayCache(self.path)
+        with assert_raises(DuplicateNotice):
+            mozpay.process_postback(token, tester.key, tester.secret,
+                                    replay_cache=other)
+
+    def test_multiprocess_stress(self):
+        SharedReplayCache(self.path, slots=2 ** 14)
+        keys = ['key-%d' % i for i in range(2000)]
+        jobs = []
+        for i in range(8):
+            # Every worker adds all keys in its own order.
+            random.shuffle(keys)
+            jobs.append((self.path, list(keys)))
+        pool = multiprocessing.Pool(4)
+        try:
+            added = pool.map(_add_keys, jobs)
+        finally:
+            pool.terminate()
+        added = [key for worker_keys in added for key in worker_keys]
+        # Each key was added by exactly one worker.
+        eq_(len(added), len(keys))
+        eq_(sorted(added), sorted(keys))
+
+
+class TestViews(ViewTester):
+
+    def settings(self):
+        return {'MOZ_REPLAY_CACHE': MemoryReplayCache()}
+
+    def test_failed_receiver(self):
+        # A retry of a notice whose receiver raised is handled again.
+        def fail(**kw):
+            raise ValueError('receiver failed')
+        signals.moz_inapp_postback.connect(fail)
+        notice = str(self.request())
+        try:
+            with self.assertRaises(ValueError):
+                self.post(notice)
+        finally:
+            signals.moz_inapp_postback.disconnect(fail)
+        eq_(self.post(notice).content, '1234')
+        eq_(len(self.received), 2)
+        eq_(self.post(notice).content, '1234')
+        eq_(len(self.received), 2)  # Now it is a duplicate.
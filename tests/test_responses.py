@@ -0,0 +1,84 @@
+import time
+
+from nose.tools import eq_
+
+import mozpay
+from mozpay.djangoapp.responses import DjangoResponseCache, ResponseCache
+
+from . import JWTtester
+from .djangotests import ViewTester
+
+
+class TestResponseCache(JWTtester):
+
+    def test_get(self):
+        cache = ResponseCache()
+        eq_(cache.get('postback', 'a.b.c'), None)
+        cache.set('postback', 'a.b.c', '1234')
+        eq_(cache.get('postback', 'a.b.c'), '1234')
+        eq_(cache.get('postback', u'a.b.c'), '1234')
+        eq_(cache.get('chargeback', 'a.b.c'), None)
+        eq_((cache.hits, cache.misses), (2, 2))
+
+    def test_expired(self):
+        cache = ResponseCache(ttl=0)
+        cache.set('postback', 'a.b.c', '1234')
+        eq_(cache.get('postback', 'a.b.c'), None)
+
+    def test_notice_expires(self):
+        cache = ResponseCache()
+        cache.set('postback', 'a.b.c', '1234', expires=time.time() - 1)
+        eq_(cache.get('postback', 'a.b.c'), None)
+        cache.set('postback', 'a.b.c', '1234', expires=time.time() + 0.2)
+        eq_(cache.get('postback', 'a.b.c'), '1234')
+        time.sleep(0.3)
+        eq_(cache.get('postback', 'a.b.c'), None)
+
+    def test_bounded(self):
+        cache = ResponseCache(maxsize=2)
+        for token in ('a.b.c', 'd.e.f', 'g.h.i'):
+            cache.set('postback', token, token)
+        eq_(cache.get('postback', 'a.b.c'), None)
+        eq_(cache.get('postback', 'g.h.i'), 'g.h.i')
+
+    def test_django(self):
+        cache = DjangoResponseCache()
+        cache.set('postback', 'a.b.c', '1234')
+        eq_(DjangoResponseCache().get('postback', 'a.b.c'), '1234')
+        cache.set('postback', 'd.e.f', '1234', expires=time.time() + 0.5)
+        eq_(cache.get('postback', 'd.e.f'), None)
+
+
+class TestViews(ViewTester):
+
+    def settings(self):
+        self.responses = ResponseCache()
+        return {'MOZ_RESPONSE_CACHE': self.responses}
+
+    def test_retry(self):
+        notice = str(self.request())
+        eq_(self.post(notice).content, '1234')
+        process_postback = mozpay.process_postback
+        self.addCleanup(setattr, mozpay, 'process_postback',
+                        process_postback)
+        mozpay.process_postback = None  # Not verified again.
+        eq_(self.post(notice).content, '1234')
+        eq_(len(self.received), 1)
+        eq_(self.responses.hits, 1)
+        eq_(self.sink.counters[('response_cache', (('outcome', 'hit'),
+                                                   ('view', 'postback')))],
+            1)
+
+    def test_rejected_not_cached(self):
+        notice = str(self.request(app_secret='wrong'))
+        eq_(self.post(notice).status_code, 400)
+        eq_(self.post(notice).status_code, 400)
+        eq_(self.responses.hits, 0)
+
+    def test_expiring_notice(self):
+        notice = str(self.request(payload=self.payload(exp=time.time() + 1)))
+        eq_(self.post(notice).content, '1234')
+        key = self.responses.key('postback', notice)
+        eq_(self.responses._cache.get(key), '1234')
+        # Not remembered past the notice's exp claim.
+        eq_(self.responses._cache.get(key, now=time.time() + 2), None)
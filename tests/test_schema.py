@@ -0,0 +1,131 @@
+import pickle
+
+from nose.tools import assert_raises, eq_
+
+import mozpay
+from mozpay import InvalidJWT
+from mozpay.schema import Field, PAYMENTS, Schema
+from mozpay.verify import verify_jwt
+
+from . import JWTtester
+
+
+class Text(unicode):
+    pass
+
+
+class Number(int):
+    pass
+
+
+class TestSchema(JWTtester):
+
+    def setUp(self):
+        super(TestSchema, self).setUp()
+        self.verifier = verify_jwt
+
+    def check(self, update=None, update_request=None, update_response=None,
+              typ='mozilla/postback/pay/v1', schema=PAYMENTS):
+        payload = self.payload(typ=typ, extra_res=update_response)
+        if update_request:
+            payload['request'].update(update_request)
+        if update:
+            payload.update(update)
+        return schema.validate(payload)
+
+    def raises(self, message, **kw):
+        with assert_raises(InvalidJWT) as cm:
+            self.check(**kw)
+        eq_(cm.exception.msg, message)
+
+    def test_postback(self):
+        self.check()
+
+    def test_chargeback(self):
+        self.check(typ='mozilla/chargeback/pay/v1',
+                   update_response={'reason': 'refund'})
+
+    def test_chargeback_reason(self):
+        self.raises("JWT is missing 'response.reason': reason is not a "
+                    "valid key", typ='mozilla/chargeback/pay/v1')
+
+    def test_unknown_typ(self):
+        self.raises("JWT has an unknown typ: 'nope'", typ='nope')
+
+    def test_missing(self):
+        self.raises("JWT is missing 'request.name': name is not a valid key",
+                    update_request={'name': ''})
+
+    def test_missing_parent(self):
+        self.raises("JWT is missing 'response.transactionID': response is "
+                    "not a valid key", update={'response': None})
+
+    def test_not_a_dict(self):
+        self.raises("JWT is missing 'response.transactionID': response is "
+                    "not a dict", update={'response': 'nope'})
+
+    def test_int(self):
+        self.raises("JWT has an invalid 'request.pricePoint': expected int, "
+                    "got '1'", update_request={'pricePoint': '1'})
+        self.raises("JWT has an invalid 'request.pricePoint': expected int, "
+                    "got True", update_request={'pricePoint': True})
+        self.check(update_request={'pricePoint': 10 ** 20})
+        self.check(update_request={'pricePoint': 0})
+
+    def test_check(self):
+        self.raises("JWT has an invalid 'request.pricePoint': -1",
+                    update_request={'pricePoint': -1})
+
+    def test_optional(self):
+        self.check(update_request={'productData': None})
+        self.raises("JWT has an invalid 'request.productData': expected "
+                    "basestring, got 5", update_request={'productData': 5})
+
+    def test_choices(self):
+        schema = Schema({None: {'request.currency':
+                                Field(basestring, choices=['EUR', 'USD'])}})
+        self.check(update_request={'currency': 'USD'}, schema=schema)
+        self.raises("JWT has an invalid 'request.currency': 'XXX' is not "
+                    "one of 'EUR', 'USD'", update_request={'currency': 'XXX'},
+                    schema=schema)
+        self.raises("JWT has an invalid 'request.currency': expected "
+                    "basestring, got {1: 2}",
+                    update_request={'currency': {1: 2}}, schema=schema)
+
+    def test_subclasses(self):
+        # Values of other classes than the common ones are checked closely.
+        self.check(update_request={'name': Text(u'Caf\xe9'),
+                                   'pricePoint': Number(5)})
+        self.raises("JWT has an invalid 'request.pricePoint': -1",
+                    update_request={'pricePoint': Number(-1)})
+        schema = Schema({None: {'request': Field(dict),
+                                'request.name': Field(basestring)}})
+        self.check(schema=schema)
+        self.raises("JWT has an invalid 'request': expected dict, got "
+                    "['x']", update={'request': ['x']}, schema=schema)
+
+    def test_pickle(self):
+        schema = pickle.loads(pickle.dumps(PAYMENTS))
+        eq_(sorted(schema.types), sorted(PAYMENTS.types))
+        with assert_raises(InvalidJWT):
+            self.check(typ='mozilla/chargeback/pay/v1', schema=schema)
+
+    def test_verify_jwt(self):
+        request = self.request(extra_req={'pricePoint': 'one'})
+        eq_(verify_jwt(request, self.key, self.secret)['request']
+            ['pricePoint'], 'one')
+        with assert_raises(InvalidJWT):
+            verify_jwt(request, self.key, self.secret, schema=PAYMENTS)
+
+    def test_dict_schema(self):
+        schema = {None: {'request.pricePoint': Field(basestring)}}
+        with assert_raises(InvalidJWT):
+            self.verify(verify_kwargs={'schema': schema})
+
+    def test_process_chargeback(self):
+        payload = self.payload(typ='mozilla/chargeback/pay/v1')
+        with assert_raises(InvalidJWT) as cm:
+            mozpay.process_chargeback(self.request(payload=payload),
+                                      self.key, self.secret,
+                                      schema=PAYMENTS)
+        assert 'response.reason' in cm.exception.msg
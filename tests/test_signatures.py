@@ -0,0 +1,120 @@
+import base64
+import json
+
+import jwt
+from nose.tools import eq_
+
+import mozpay
+from mozpay import InvalidJWT
+from mozpay.keyring import Key
+from mozpay.verify import verify_sig
+
+from . import JWTtester
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).replace('=', '')
+
+
+def accepts_pyjwt(request, secret, algorithms, audience):
+    try:
+        jwt.decode(request, secret, algorithms=algorithms, audience=audience)
+    except Exception:
+        return False
+    return True
+
+
+def accepts_mozpay(request, secret, algorithms, audience):
+    try:
+        verify_sig(request, secret, algorithms=algorithms,
+                   expected_aud=audience)
+    except InvalidJWT:
+        return False
+    return True
+
+
+class TestSignatures(JWTtester):
+    """The HMAC fast path must agree with PyJWT on every token."""
+
+    algorithms = ['HS256', 'HS384', 'HS512']
+
+    def corpus(self):
+        for alg in self.algorithms:
+            valid = str(self.request(encode_kwargs={'algorithm': alg}))
+            header, payload, sig = valid.split('.')
+            yield alg, valid
+            yield alg + ' wrong secret', str(self.request(
+                app_secret='wrong', encode_kwargs={'algorithm': alg}))
+            yield alg + ' tampered payload', '.'.join(
+                [header, b64(json.dumps(self.payload(app_id='other'))), sig])
+            yield alg + ' flipped bit', valid[:-2] + (
+                'A' if valid[-2] != 'A' else 'B') + valid[-1]
+            yield alg + ' truncated signature', valid[:-4]
+            yield alg + ' extended signature', valid + 'AAAA'
+            yield alg + ' empty signature', valid.rsplit('.', 1)[0] + '.'
+            yield alg + ' padded signature', valid + '=='
+            yield alg + ' junk in signature', valid[:-3] + '!!' + valid[-3:]
+            yield alg + ' bad base64', valid[:-1] + '.'
+            yield alg + ' wrong audience', str(self.request(
+                app_id='other', encode_kwargs={'algorithm': alg}))
+            yield alg + ' expired', str(self.request(
+                iat=1, exp=2, encode_kwargs={'algorithm': alg}))
+            yield alg + ' kid', str(self.request(
+                encode_kwargs={'algorithm': alg,
+                               'headers': {'kid': 'some key'}}))
+        valid = str(self.request())
+        header, payload, sig = valid.split('.')
+        for name, bad_header in [
+                ('alg none', {'alg': 'none', 'typ': 'JWT'}),
+                ('no alg', {'typ': 'JWT'}),
+                ('unknown alg', {'alg': 'HS1024', 'typ': 'JWT'}),
+                ('lowercase alg', {'alg': 'hs256', 'typ': 'JWT'}),
+                ('alg switch', {'alg': 'HS512', 'typ': 'JWT'})]:
+            yield name, '.'.join([b64(json.dumps(bad_header)), payload, sig])
+        yield 'header not json', '.'.join([b64('{nope'), payload, sig])
+        yield 'one segment', payload
+        yield 'two segments', header + '.' + payload
+        yield 'four segments', valid + '.' + sig
+        yield 'empty', ''
+
+    def check(self, secret, algorithms, audience):
+        for name, request in self.corpus():
+            eq_(accepts_mozpay(request, secret, algorithms, audience),
+                accepts_pyjwt(request, secret, algorithms, audience),
+                'disagreement for %s: %r' % (name, request))
+
+    def test_all_algorithms(self):
+        self.check(self.secret, self.algorithms, self.key)
+
+    def test_only_hs256(self):
+        self.check(self.secret, ['HS256'], self.key)
+
+    def test_wrong_secret(self):
+        self.check('not the secret', self.algorithms, self.key)
+
+    def test_unicode_secret(self):
+        self.secret = u'sekr\u0107t'
+        self.check(self.secret, self.algorithms, self.key)
+
+    def test_verifier_is_stricter(self):
+        # The pre-filter rejects some tokens PyJWT decodes (such as
+        # padding) but never accepts one that PyJWT rejects.
+        verifier = mozpay.Verifier(self.key, self.secret,
+                                   algorithms=self.algorithms)
+        for name, request in self.corpus():
+            try:
+                verifier(request)
+            except InvalidJWT:
+                continue
+            assert accepts_pyjwt(request, self.secret, self.algorithms,
+                                 self.key), name
+
+    def test_key_reused(self):
+        key = Key(self.secret, algorithms=self.algorithms)
+        for alg in self.algorithms:
+            request = str(self.request(encode_kwargs={'algorithm': alg}))
+            signing_input, sig = request.rsplit('.', 1)
+            signature = jwt.utils.base64url_decode(sig)
+            for i in range(3):
+                assert key.verify(alg, signing_input, signature)
+                assert not key.verify(alg, signing_input + 'x', signature)
@@ -0,0 +1,95 @@
+import json
+import pickle
+
+from nose.tools import assert_raises, eq_
+
+import mozpay
+from mozpay.transaction import Chargeback, Transaction
+
+from . import JWTtester
+
+
+class TestTransaction(JWTtester):
+
+    def process(self, processor=mozpay.process_postback, **payload_kw):
+        request = self.request(**payload_kw)
+        return processor(request, self.key, self.secret, as_object=True)
+
+    def test_postback(self):
+        tx = self.process(extra_req={'productData': 'my_product_id=1234'})
+        assert isinstance(tx, Transaction)
+        eq_(tx.iss, 'marketplace.mozilla.org')
+        eq_(tx.aud, self.key)
+        eq_(tx.typ, 'mozilla/postback/pay/v1')
+        eq_(tx.pricePoint, 1)
+        eq_(tx.name, 'My bands latest album')
+        eq_(tx.productData, 'my_product_id=1234')
+        eq_(tx.transactionID, '1234')
+        assert not hasattr(tx, 'reason')
+
+    def test_chargeback(self):
+        tx = self.process(processor=mozpay.process_chargeback,
+                          typ='mozilla/chargeback/pay/v1',
+                          extra_res={'reason': 'refund'})
+        assert isinstance(tx, Chargeback)
+        eq_(tx.reason, 'refund')
+        eq_(tx.transactionID, '1234')
+
+    def test_dict_by_default(self):
+        data = mozpay.process_postback(self.request(), self.key, self.secret)
+        eq_(data['response']['transactionID'], '1234')
+
+    def test_raw(self):
+        tx = self.process(extra_res={'extra': {'nested': [1, 2]}})
+        eq_(json.loads(tx.raw)['response']['extra'], {'nested': [1, 2]})
+        eq_(tx.data['response']['extra'], {'nested': [1, 2]})
+        eq_(tx.data['iss'], tx.iss)
+
+    def test_from_jwt_without_token(self):
+        payload = self.payload()
+        tx = Transaction.from_jwt(payload)
+        eq_(tx.data['request'], payload['request'])
+        eq_(tx.transactionID, '1234')
+
+    def test_missing_fields(self):
+        tx = Transaction.from_jwt({'iss': 'x', 'request': 'not a dict'})
+        eq_(tx.pricePoint, None)
+        eq_(tx.transactionID, None)
+
+    def test_read_only(self):
+        tx = self.process()
+        with assert_raises(AttributeError):
+            tx.transactionID = '5678'
+        with assert_raises(AttributeError):
+            del tx.iss
+        with assert_raises(AttributeError):
+            tx.other = 1
+
+    def test_text(self):
+        tx = self.process(extra_req={'name': u'Caf\xe9'})
+        eq_(type(tx.iss), str)
+        eq_(tx.name, u'Caf\xe9')
+
+    def test_shared_claims(self):
+        one, two = self.process(), self.process()
+        assert one.iss is two.iss
+        assert one.aud is two.aud
+
+    def test_pickle(self):
+        for tx in (self.process(),
+                   self.process(processor=mozpay.process_chargeback,
+                                typ='mozilla/chargeback/pay/v1',
+                                extra_res={'reason': 'refund'})):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                copy = pickle.loads(pickle.dumps(tx, protocol))
+                eq_(copy, tx)
+                eq_(copy.raw, tx.raw)
+
+    def test_unknown_field(self):
+        with assert_raises(TypeError):
+            Transaction('{}', reason='nope')
+
+    def test_async(self):
+        future = mozpay.process_postback_async(self.request(), self.key,
+                                               self.secret, as_object=True)
+        eq_(future.result(5).transactionID, '1234')
@@ -1,11 +1,16 @@
+import binascii
 import calendar
 from datetime import datetime, timedelta
+import pickle
 import time
 
-from nose.tools import raises
+import jwt
+from nose.tools import eq_, raises
 
 import mozpay
-from mozpay.exc import InvalidJWT, RequestExpired
+from mozpay import verify
+from mozpay.exc import InvalidJWT, MalformedJWT, RequestExpired
+from mozpay.schema import Field
 
 from . import JWTtester
 
@@ -127,3 +132,228 @@ class TestVerify(JWTtester):
     def test_hs256_is_default_algorithm(self):
         # By default, only HS256 JWTs are accepted.
         self.verify(self.request(encode_kwargs={'algorithm': 'HS384'}))
+
+    def test_bad_signature_names_issuer(self):
+        try:
+            self.verify(self.request(app_secret='invalid'))
+        except InvalidJWT, exc:
+            eq_(exc.issuer, 'marketplace.mozilla.org')
+            eq_(str(exc), "Signature verification failed: Signature "
+                          "verification failed "
+                          "(iss=u'marketplace.mozilla.org')")
+        else:
+            raise AssertionError('InvalidJWT was not raised')
+
+    @raises(InvalidJWT)
+    def test_empty_payload(self):
+        self.verify(jwt.encode({}, self.secret))
+
+    def test_malformed_jwt_has_no_issuer(self):
+        try:
+            self.verify('<not valid JWT>')
+        except InvalidJWT, exc:
+            eq_(exc.issuer, None)
+            eq_(str(exc), 'Invalid JWT: Not enough segments')
+        else:
+            raise AssertionError('InvalidJWT was not raised')
+
+
+class TestVerifier(JWTtester):
+
+    def setUp(self):
+        super(TestVerifier, self).setUp()
+        self.verifier = self.make_verifier
+
+    def make_verifier(self, request, key, secret, **kw):
+        return mozpay.Verifier(key, secret, **kw)(request)
+
+    def test_reusable(self):
+        verifier = mozpay.Verifier(self.key, self.secret)
+        for tx in ('1', '2'):
+            payload = self.payload(extra_res={'transactionID': tx})
+            data = verifier(self.request(payload=payload))
+            eq_(data['response']['transactionID'], tx)
+
+    @raises(InvalidJWT)
+    def test_wrong_secret(self):
+        self.verify(self.request(app_secret='invalid'))
+
+    @raises(InvalidJWT)
+    def test_required_keys(self):
+        self.verify(verify_kwargs={'required_keys': ['request.nope']})
+
+    @raises(InvalidJWT)
+    def test_validators(self):
+        def fail(data):
+            raise InvalidJWT('nope')
+        self.verify(verify_kwargs={'validators': [fail]})
+
+    def test_verify_jwt_caches_verifier(self):
+        args = (self.key, self.secret)
+        assert verify._get_verifier(*args) is verify._get_verifier(*args)
+
+    def test_schema_dict_caches_verifier(self):
+        args = (self.key, self.secret)
+        schema = {None: {'request.name': Field(basestring)}}
+        first = verify._get_verifier(*args, schema=schema)
+        assert verify._get_verifier(*args, schema=schema) is first
+        other = dict(schema)
+        assert verify._get_verifier(*args, schema=other) is not first
+
+
+class TestVerifyMany(JWTtester):
+
+    def tokens(self):
+        tokens = []
+        for tx in range(10):
+            payload = self.payload(extra_res={'transactionID': str(tx)})
+            tokens.append(self.request(payload=payload))
+        tokens.insert(3, self.request(app_secret='invalid'))
+        return tokens
+
+    def check(self, results, tokens):
+        eq_([token for token, result in results], tokens)
+        bad = results[3][1]
+        assert isinstance(bad, InvalidJWT), bad
+        eq_(bad.issuer, 'marketplace.mozilla.org')
+        del results[3]
+        eq_([data['response']['transactionID'] for token, data in results],
+            [str(tx) for tx in range(10)])
+
+    def verify_many(self, tokens, **kw):
+        return list(verify.verify_many(iter(tokens), self.key, self.secret,
+                                       chunksize=3, **kw))
+
+    def test_in_process(self):
+        tokens = self.tokens()
+        self.check(self.verify_many(tokens, processes=0), tokens)
+
+    def test_threads(self):
+        tokens = self.tokens()
+        self.check(self.verify_many(tokens, processes=2, backend='thread'),
+                   tokens)
+
+    def test_processes(self):
+        tokens = self.tokens()
+        self.check(self.verify_many(tokens, processes=2), tokens)
+
+    def test_unordered(self):
+        tokens = self.tokens()
+        results = self.verify_many(tokens, processes=2, ordered=False)
+        eq_(sorted(token for token, result in results), sorted(tokens))
+
+    def test_kwargs(self):
+        results = self.verify_many(self.tokens(), processes=2,
+                                   required_keys=['request.nope'])
+        for token, result in results:
+            assert isinstance(result, InvalidJWT), result
+
+    @raises(ValueError)
+    def test_unknown_backend(self):
+        self.verify_many(self.tokens(), processes=2, backend='nope')
+
+
+class TestMalformed(JWTtester):
+
+    def setUp(self):
+        super(TestMalformed, self).setUp()
+        self.verifier = mozpay.process_postback
+
+    def reason(self, request, **verify_kwargs):
+        try:
+            self.verify(request, verify_kwargs=verify_kwargs)
+        except MalformedJWT, exc:
+            return exc.reason
+        raise AssertionError('MalformedJWT was not raised')
+
+    def test_too_long(self):
+        eq_(self.reason(self.request(), max_length=10), 'too-long')
+
+    def test_segments(self):
+        eq_(self.reason('abc.def'), 'segments')
+        eq_(self.reason(self.request() + '.abc'), 'segments')
+
+    def test_alphabet(self):
+        eq_(self.reason('abc.d+f.ghi'), 'alphabet')
+        eq_(self.reason(u'abc.d\u0107f.ghi'), 'alphabet')
+        eq_(self.reason('abc..ghi'), 'alphabet')
+
+    def test_alg(self):
+        request = self.request(encode_kwargs={'algorithm': 'HS384'})
+        eq_(self.reason(request), 'alg')
+
+    def test_decode(self):
+        eq_(self.reason('abc.def.ghi'), 'decode')
+
+    def test_pickle(self):
+        exc = pickle.loads(pickle.dumps(MalformedJWT('bad', reason='alg')))
+        eq_(exc.reason, 'alg')
+
+
+class TestTokenTypes(JWTtester):
+
+    def setUp(self):
+        super(TestTokenTypes, self).setUp()
+        self.verifier = mozpay.process_postback
+
+    def types(self, request):
+        request = str(request)
+        return [request, unicode(request), bytearray(request),
+                memoryview(request), memoryview(bytearray(request))]
+
+    def test_verify(self):
+        request = self.request(extra_req={'productData': 'x' * 1001})
+        expected = self.verify(request)
+        for token in self.types(request):
+            eq_(self.verify(token), expected)
+            eq_(verify.verify_sig(token, self.secret, expected_aud=self.key),
+                expected)
+
+    def test_malformed(self):
+        for request, reason in (('abc.def', 'segments'),
+                                ('abc.d\xc4\x87f.ghi', 'alphabet'),
+                                ('abc.def.ghi', 'decode')):
+            for token in (bytearray(request), memoryview(request)):
+                try:
+                    self.verify(token)
+                except MalformedJWT, exc:
+                    eq_(exc.reason, reason)
+                else:
+                    raise AssertionError('%r was accepted' % token)
+
+    @raises(MalformedJWT)
+    def test_other_type(self):
+        self.verify(buffer(self.request()))
+
+    def test_as_object(self):
+        request = self.request()
+        expected = mozpay.process_postback(request, self.key, self.secret,
+                                           as_object=True)
+        for token in self.types(request):
+            tx = mozpay.process_postback(token, self.key, self.secret,
+                                         as_object=True)
+            eq_(tx.raw, expected.raw)
+
+    def test_base64(self):
+        # Segments are decoded like PyJWT does, padding errors included.
+        alphabet = 'ABCxyz0189-_'
+        for length in range(13):
+            for i in range(20):
+                segment = ''.join(alphabet[(i * 7 + j * 5) % len(alphabet)]
+                                  for j in range(length))
+                try:
+                    expected = jwt.utils.base64url_decode(segment)
+                except (TypeError, binascii.Error):
+                    expected = MalformedJWT
+                b64 = segment.translate(verify._b64_alphabet)
+                try:
+                    data = verify._b64decode(b64, (0, length), 'payload')
+                except MalformedJWT:
+                    data = MalformedJWT
+                eq_(data, expected, segment)
+
+    def test_verify_sig_not_base64url(self):
+        # Anything outside the alphabet is skipped, as PyJWT does.
+        header, payload, sig = str(self.request()).split('.')
+        request = '%s.%s\r\n\r\n.%s' % (header, payload, sig)
+        eq_(verify._get_json(request), jwt.decode(request, verify=False))
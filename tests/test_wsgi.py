@@ -0,0 +1,107 @@
+from StringIO import StringIO
+import urllib
+from wsgiref import util
+
+from nose.tools import eq_
+
+from mozpay.replay import MemoryReplayCache
+from mozpay.schema import Field
+from mozpay.wsgi import PostbackApp
+
+from . import JWTtester
+
+
+class TestPostbackApp(JWTtester):
+
+    def setUp(self):
+        super(TestPostbackApp, self).setUp()
+        self.app = PostbackApp(self.key, self.secret, max_body=4096,
+                               replay_cache=MemoryReplayCache())
+        self.postbacks = []
+        self.chargebacks = []
+        self.app.on_postback(lambda environ, data:
+                             self.postbacks.append(data))
+        self.app.on_chargeback(lambda environ, data:
+                               self.chargebacks.append(data))
+
+    def post(self, path, notice=None, method='POST', body=None):
+        if body is None:
+            body = urllib.urlencode({'notice': notice, 'other': 'x'})
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': StringIO(body)}
+        util.setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        body = ''.join(self.app(environ, start_response))
+        return response['status'], body
+
+    def test_postback(self):
+        eq_(self.post('/moz/postback', self.request()), ('200 OK', '1234'))
+        eq_(len(self.postbacks), 1)
+        eq_(self.postbacks[0]['response']['transactionID'], '1234')
+        eq_(self.chargebacks, [])
+
+    def test_chargeback(self):
+        payload = self.payload(typ='mozilla/chargeback/pay/v1',
+                               extra_res={'reason': 'refund'})
+        eq_(self.post('/chargeback', self.request(payload=payload)),
+            ('200 OK', '1234'))
+        eq_(len(self.chargebacks), 1)
+
+    def test_chargeback_without_reason(self):
+        status, body = self.post('/chargeback', self.request())
+        eq_(status, '400 Bad Request')
+
+    def test_chargeback_schema(self):
+        # A configured schema decides what chargebacks must contain.
+        self.app = PostbackApp(self.key, self.secret,
+                               schema={None: {'request': Field(dict)}})
+        self.app.on_chargeback(lambda environ, data:
+                               self.chargebacks.append(data))
+        eq_(self.post('/chargeback', self.request()), ('200 OK', '1234'))
+        eq_(len(self.chargebacks), 1)
+
+    def test_invalid(self):
+        status, body = self.post('/postback',
+                                 self.request(app_secret='invalid'))
+        eq_(status, '400 Bad Request')
+        eq_(self.postbacks, [])
+
+    def test_duplicate(self):
+        notice = self.request()
+        self.post('/postback', notice)
+        eq_(self.post('/postback', notice), ('200 OK', '1234'))
+        eq_(len(self.postbacks), 1)
+
+    def test_failed_callback(self):
+        notice = self.request()
+        self.app.on_postback(self.fail)
+        with self.assertRaises(ValueError):
+            self.post('/postback', notice)
+        self.app.postback_callbacks.remove(self.fail)
+        eq_(self.post('/postback', notice), ('200 OK', '1234'))
+        eq_(len(self.postbacks), 2)
+
+    def fail(self, environ, data):
+        raise ValueError('callback failed')
+
+    def test_missing_notice(self):
+        status, body = self.post('/postback', body='other=1')
+        eq_(status, '400 Bad Request')
+
+    def test_too_large(self):
+        status, body = self.post('/postback', body='x' * 5000)
+        eq_(status, '413 Request Entity Too Large')
+
+    def test_not_found(self):
+        status, body = self.post('/other', self.request())
+        eq_(status, '404 Not Found')
+
+    def test_get(self):
+        status, body = self.post('/postback', method='GET', body='')
+        eq_(status, '405 Method Not Allowed')